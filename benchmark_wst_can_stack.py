@@ -0,0 +1,212 @@
+import argparse
+import json
+import math
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from spparser.SpParser import SpParser
+from wstcan.P2StatusDecoder import P2StatusDecoder
+from wstcan.SimulatedBMS import SimulatedBMS, SimulatedBus
+from wstcan.WSTCan import WSTCan
+
+# Benchmarks the CAN protocol stack against a SimulatedBus and the parsers on generated data, and saves the results as
+# JSON. Compare two runs with --compare to catch releases that got slower.
+#
+# 	python benchmark_wst_can_stack.py --output before.json
+# 	python benchmark_wst_can_stack.py --output after.json --compare before.json
+
+
+def percentile(sorted_values, percent):
+	# nearest rank
+	index = max(int(math.ceil(percent / 100.0 * len(sorted_values))) - 1, 0)
+	return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def run_benchmark(function, iterations, items_per_call=1):
+	"""
+	Call function iterations times and time each call.
+	:arguments
+		items_per_call: number of queries (or records) one call handles, for the per second rate
+	:returns
+		dict with the call count, per second rate and latency statistics in ms
+	"""
+	function()  # warm up
+	latencies = []
+	start = time.perf_counter()
+	for i in range(iterations):
+		call_start = time.perf_counter()
+		function()
+		latencies.append(time.perf_counter() - call_start)
+	total = time.perf_counter() - start
+	latencies.sort()
+	return {
+		'iterations': iterations,
+		'items_per_call': items_per_call,
+		'total_seconds': round(total, 6),
+		'per_second': round(iterations * items_per_call / total, 3) if total > 0 else None,
+		'mean_ms': round(sum(latencies) / len(latencies) * 1000, 4),
+		'p50_ms': round(percentile(latencies, 50) * 1000, 4),
+		'p99_ms': round(percentile(latencies, 99) * 1000, 4),
+		'min_ms': round(latencies[0] * 1000, 4),
+		'max_ms': round(latencies[-1] * 1000, 4)
+	}
+
+
+def protocol_benchmarks(args):
+	batteries = [SimulatedBMS(node_id=2 + i, serial="%06d" % (100000 + i), log_records=args.log_records)
+							 for i in range(args.nodes)]
+	bus = SimulatedBus(batteries, latency=args.latency, frame_time=args.frame_time)
+	wstcan = WSTCan(transport=bus)
+	if args.session:
+		wstcan.open_session(start_receiver=args.receiver, cache_identity=False)
+	node_id = batteries[0].node_id
+	node_ids = [battery.node_id for battery in batteries]
+	iterations = args.iterations
+	parameter_numbers = list(range(9, 31))
+	parameter_values = dict((n, n * 10) for n in parameter_numbers)
+
+	benchmarks = [
+		("query_bms", lambda: wstcan.queryBMS(wstcan.voltageStatusCommand), iterations, 1),
+		("sp_realtime_status", lambda: wstcan.get_parsed_sp_status("realtime"), max(iterations // 3, 1), 3),
+		("read_status", lambda: wstcan.readStatus(node_id), iterations, 1),
+		("rack_status", lambda: wstcan.get_rack_status(node_ids), iterations, len(node_ids)),
+		("custom_parameter_read_bulk", lambda: wstcan.read_custom_parameters(node_id, parameter_numbers, short_int=True),
+		 max(iterations // 10, 1), len(parameter_numbers)),
+		("custom_parameter_write_bulk", lambda: wstcan.write_custom_parameters(node_id, parameter_values, short_int=True),
+		 max(iterations // 10, 1), len(parameter_numbers)),
+		("custom_parameter_read_single", lambda: wstcan.readCustomParameter(node_id, 4), args.slow_iterations, 1),
+		("node_scan", lambda: wstcan.scanNodeIDs(pipelined=True), args.slow_iterations, 1),
+		("log_download", lambda: wstcan.getLog(), args.slow_iterations, args.log_records),
+		("log_download_protocol_2", lambda: wstcan.TestGetLogProtocol2(node_id), args.slow_iterations, args.log_records),
+	]
+	results = {}
+	try:
+		for name, function, benchmark_iterations, items_per_call in benchmarks:
+			if args.only and name not in args.only:
+				continue
+			print("running %s" % name)
+			results[name] = run_benchmark(function, benchmark_iterations, items_per_call)
+	finally:
+		if args.session:
+			wstcan.close_session()
+	return results
+
+
+def parser_benchmarks(args):
+	sp_parser = SpParser()
+	battery = SimulatedBMS(log_records=args.parser_records)
+	log_records = battery.log
+	status = {
+		'parsed_voltage_status': sp_parser.parse_voltage_status(battery.voltage_status()),
+		'parsed_current_status': sp_parser.parse_current_status(battery.current_status()),
+		'parsed_power_status': sp_parser.parse_power_status(battery.power_status())
+	}
+	status_decoder = P2StatusDecoder()
+	status_data = bytearray(battery.status_data())
+	status_snapshots = [status_data] * args.parser_records
+	parameter_data = dict(battery.sp_parameters)
+	parameter_data['custom_parameters'] = [float(value) for value in range(8)]
+
+	benchmarks = [
+		("parse_log", lambda: sp_parser.parse_log(log_records), args.iterations, len(log_records)),
+		("parse_sp_parameters", lambda: sp_parser.parse_sp_parameters(parameter_data, dict(status), bms_model=battery.bms_model),
+		 args.iterations, 1),
+		("decode_p2_status", lambda: status_decoder.status_dict(status_decoder.decode(status_data)), args.iterations, 1),
+	]
+	try:
+		import numpy  # noqa: F401. the column benchmarks only run when numpy is installed
+		benchmarks.append(
+			("parse_log_columns", lambda: sp_parser.parse_log_columns(log_records), args.iterations, len(log_records)))
+		benchmarks.append(("decode_p2_status_columns", lambda: status_decoder.decode_columns(status_snapshots),
+											 args.iterations, len(status_snapshots)))
+	except ImportError:
+		pass
+	results = {}
+	for name, function, iterations, items_per_call in benchmarks:
+		if args.only and name not in args.only:
+			continue
+		print("running %s" % name)
+		results[name] = run_benchmark(function, iterations, items_per_call)
+	return results
+
+
+def git_commit():
+	try:
+		return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+	except Exception:
+		return None
+
+
+# Print the change against an earlier run. Returns the names of the benchmarks that got slower than tolerance.
+def compare_results(results, previous_results, tolerance):
+	regressions = []
+	print("\n%-32s %14s %14s %9s" % ("benchmark", "before /s", "now /s", "change"))
+	for name, result in results.items():
+		previous = previous_results.get(name)
+		if previous is None or not previous.get('per_second') or not result.get('per_second'):
+			continue
+		change = result['per_second'] / previous['per_second'] - 1
+		flag = ""
+		if change < -tolerance:
+			regressions.append(name)
+			flag = " [SLOWER]"
+		print("%-32s %14.2f %14.2f %8.1f%%%s" % (name, previous['per_second'], result['per_second'], change * 100, flag))
+	return regressions
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Benchmark the WSTCan protocol stack and the SP parsers")
+	parser.add_argument("--output", default=None, help="JSON result file. Default benchmark_<date>.json")
+	parser.add_argument("--compare", default=None, help="earlier JSON result file to compare with")
+	parser.add_argument("--tolerance", type=float, default=0.2,
+											help="allowed drop in per second rate before a benchmark counts as slower (0.2 = 20%%)")
+	parser.add_argument("--iterations", type=int, default=100, help="calls per fast benchmark")
+	parser.add_argument("--slow-iterations", type=int, default=3,
+											help="calls for the benchmarks with fixed waits (single parameter, node scan and logs)")
+	parser.add_argument("--latency", type=float, default=0.001, help="simulated BMS reply latency in seconds")
+	parser.add_argument("--frame-time", type=float, default=0.0, help="simulated time between reply frames in seconds")
+	parser.add_argument("--nodes", type=int, default=4, help="simulated batteries on the bus")
+	parser.add_argument("--log-records", type=int, default=200, help="log records per simulated battery")
+	parser.add_argument("--parser-records", type=int, default=2000, help="log records for the parser benchmarks")
+	parser.add_argument("--no-session", dest="session", action="store_false", help="don't keep the channel open")
+	parser.add_argument("--no-receiver", dest="receiver", action="store_false",
+											help="don't use the background receiver in the session")
+	parser.add_argument("--only", nargs="*", default=None, help="names of the benchmarks to run")
+	args = parser.parse_args(argv)
+
+	results = {}
+	results.update(parser_benchmarks(args))
+	results.update(protocol_benchmarks(args))
+
+	report = {
+		'created': datetime.now().isoformat(),
+		'git_commit': git_commit(),
+		'python': sys.version.split()[0],
+		'platform': platform.platform(),
+		'settings': vars(args),
+		'results': results
+	}
+	output = args.output or "benchmark_%s.json" % datetime.now().strftime("%Y%m%d_%H%M%S")
+	with open(output, "w") as f:
+		json.dump(report, f, indent=2)
+
+	print("\n%-32s %10s %10s %10s" % ("benchmark", "per sec", "p50 ms", "p99 ms"))
+	for name, result in results.items():
+		print("%-32s %10.2f %10.3f %10.3f" % (name, result['per_second'], result['p50_ms'], result['p99_ms']))
+	print("results saved to %s" % output)
+
+	if args.compare:
+		with open(args.compare, "r") as f:
+			previous_results = json.load(f)['results']
+		regressions = compare_results(results, previous_results, args.tolerance)
+		if regressions:
+			print("\nSlower than %s: %s" % (args.compare, ", ".join(regressions)))
+			return 1
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,80 @@
+import json
+import pathlib
+
+try:
+	import pyarrow  # optional. Only needed for the columnar log files
+	import pyarrow.ipc
+	import pyarrow.parquet
+except ImportError:
+	pyarrow = None
+
+from spparser.SpParser import SpParser
+
+IDENTITY_METADATA_KEY = b"wst_battery_identity"
+
+
+# Writes logs to Parquet (.parquet) or Arrow IPC (.arrow / .feather) files with one typed column per log field, as
+# returned by SpParser.parse_log_columns, and the battery identity (eg. get_battery_description) as file metadata.
+# SP and protocol 2 logs use the same 33 byte records, so both are written from the raw records.
+class SpColumnarWriter:
+	def __init__(self, compression="zstd"):
+		self.compression = compression  # parquet compression
+
+	@staticmethod
+	def check_pyarrow():
+		if pyarrow is None:
+			raise Exception("pyarrow is required for Parquet/Arrow log files")
+
+	@staticmethod
+	def file_format(file_path):
+		suffix = pathlib.Path(file_path).suffix.lower()
+		if suffix == ".parquet":
+			return "parquet"
+		if suffix in (".arrow", ".feather"):
+			return "arrow"
+		raise Exception("Unknown columnar file extension %s. Use .parquet or .arrow" % suffix)
+
+	def log_table(self, raw_records, identity=None):
+		self.check_pyarrow()
+		columns = SpParser().parse_log_columns(raw_records)
+		arrays = []
+		names = []
+		for name, values in columns.items():
+			arrays.append(pyarrow.array(values, from_pandas=True))  # from_pandas turns NaT dates into nulls
+			names.append(name)
+		metadata = {IDENTITY_METADATA_KEY: json.dumps(identity or {}, default=str).encode("utf-8")}
+		return pyarrow.Table.from_arrays(arrays, names=names, metadata=metadata)
+
+	def write_log(self, raw_records, file_path, identity=None, overwrite=False):
+		"""
+		Write raw log records (from getLog/iterLog or TestGetLogProtocol2) to a columnar file.
+		:arguments
+			raw_records: list of 33 byte records or one buffer with the records back to back
+			file_path: .parquet or .arrow/.feather file
+			identity: dict with the battery identity, stored as JSON in the file metadata
+		"""
+		file_format = self.file_format(file_path)
+		if pathlib.Path(file_path).is_file() and not overwrite:
+			raise Exception("File already exists. use overwrite=True to overwrite.")
+		table = self.log_table(raw_records, identity)
+		if file_format == "parquet":
+			pyarrow.parquet.write_table(table, file_path, compression=self.compression)
+		else:
+			with pyarrow.ipc.new_file(str(file_path), table.schema) as writer:
+				writer.write_table(table)
+
+	def read_log(self, file_path):
+		"""
+		Load a file written by write_log.
+		:returns
+			(pyarrow.Table, identity dict)
+		"""
+		self.check_pyarrow()
+		if self.file_format(file_path) == "parquet":
+			table = pyarrow.parquet.read_table(file_path)
+		else:
+			with pyarrow.memory_map(str(file_path), "r") as source:
+				table = pyarrow.ipc.open_file(source).read_all()
+		metadata = table.schema.metadata or {}
+		identity = json.loads(metadata.get(IDENTITY_METADATA_KEY, b"{}").decode("utf-8"))
+		return table, identity
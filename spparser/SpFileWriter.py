@@ -2,6 +2,7 @@ import os
 import pathlib
 import shutil
 
+import xlsxwriter
 from openpyxl.reader.excel import load_workbook
 from openpyxl.styles import Font, NamedStyle
 from openpyxl.utils import get_column_letter
@@ -34,8 +35,10 @@ class SpFileWriter:
 		file_path = pathlib.Path(file_path)
 		return file_path.with_suffix(extension)
 
+	# streaming=True writes the rows straight to disk with xlsxwriter in constant memory mode, so parsed_log['records']
+	# may also be a generator. The sheet looks the same, the column widths are worked out while the rows are written.
 	# noinspection PyBroadException
-	def write_log_to_excel(self, parsed_log, excel_file_path, overwrite=False):
+	def write_log_to_excel(self, parsed_log, excel_file_path, overwrite=False, streaming=False):
 
 		excel_file_path = self.add_file_extension_if_missing(excel_file_path, extension='.xlsx')
 
@@ -46,16 +49,24 @@ class SpFileWriter:
 			else:
 				raise Exception("File already exists. use overwrite=True to overwrite.")
 
+		if streaming:
+			self.write_log_to_excel_streaming(parsed_log, excel_file_path)
+			return
+
 		wb = Workbook()
 		ws = wb.active
 		ws.title = "Log"
+		self.fill_log_sheet(ws, parsed_log)
+
+		# save file
+		wb.save(excel_file_path)
 
+	def fill_log_sheet(self, ws, parsed_log):
 		# Ready data
 		log_headings = parsed_log['headings']
 		log_records = parsed_log['records']
 
 		# write headings and log
-		ws = wb.active
 		ws.append(log_headings)
 		for record in log_records:
 			ws.append(record)
@@ -75,7 +86,14 @@ class SpFileWriter:
 				continue
 			date_cell.style = date_style
 
-		# Adjust width of columns
+		self.adjust_column_widths(ws)
+
+		# Apply filter
+		full_cell_range = "A1:" + get_column_letter(ws.max_column) + str(ws.max_row)
+		ws.auto_filter.ref = full_cell_range
+
+	# Adjust width of columns
+	def adjust_column_widths(self, ws):
 		# Iterate over all columns and adjust their widths
 		for column in ws.columns:
 			max_length = 0
@@ -89,12 +107,36 @@ class SpFileWriter:
 			adjusted_width = (max_length + 2) * self.cell_width_margin
 			ws.column_dimensions[column_letter].width = adjusted_width
 
-		# Apply filter
-		full_cell_range = "A1:" + get_column_letter(ws.max_column) + str(ws.max_row)
-		ws.auto_filter.ref = full_cell_range
+	def write_log_to_excel_streaming(self, parsed_log, excel_file_path):
+		wb = xlsxwriter.Workbook(str(excel_file_path), {'constant_memory': True})
+		ws = wb.add_worksheet("Log")
+		heading_format = wb.add_format({'bold': True})
+		date_format = wb.add_format({'num_format': 'YYYY-MM-DD HH:MM:SS'})
 
-		# save file
-		wb.save(excel_file_path)
+		log_headings = parsed_log['headings']
+		column_widths = [len(str(heading)) for heading in log_headings]
+		for column, heading in enumerate(log_headings):
+			ws.write(0, column, heading, heading_format)
+
+		# rows must be written in order in constant memory mode
+		row = 0
+		for record in parsed_log['records']:
+			row += 1
+			for column, value in enumerate(record):
+				if column == 1:  # dates in column B
+					ws.write(row, column, value, date_format)
+				else:
+					ws.write(row, column, value)
+				if column >= len(column_widths):
+					column_widths.append(0)
+				value_length = len(str(value))
+				if value_length > column_widths[column]:
+					column_widths[column] = value_length
+
+		for column, max_length in enumerate(column_widths):
+			ws.set_column(column, column, (max_length + 2) * self.cell_width_margin)
+		ws.autofilter(0, 0, row, len(column_widths) - 1)
+		wb.close()
 
 	def write_log_stats_to_excel(self, parsed_log_statistics, excel_file_path, append=True):
 		excel_file_path = self.add_file_extension_if_missing(excel_file_path, extension='.xlsx')
@@ -110,25 +152,7 @@ class SpFileWriter:
 			wb = load_workbook(excel_file_path)
 			ws = wb.create_sheet(title="Log Statistics")
 
-		# write statistics
-		ws.append(["Name", "Value"])
-		for record in parsed_log_statistics.items():
-			ws.append(record)
-
-		# Adjust width of columns
-		# Iterate over all columns and adjust their widths
-
-		for column in ws.columns:
-			max_length = 0
-			column_letter = column[0].column_letter
-			for cell in column:
-				try:
-					if len(str(cell.value)) > max_length:
-						max_length = len(str(cell.value))
-				except:
-					pass
-			adjusted_width = (max_length + 2) * self.cell_width_margin
-			ws.column_dimensions[column_letter].width = adjusted_width
+		self.fill_name_value_sheet(ws, parsed_log_statistics)
 
 		wb.save(excel_file_path)
 
@@ -146,27 +170,17 @@ class SpFileWriter:
 			wb = load_workbook(excel_file_path)
 			ws = wb.create_sheet(title="Battery Information")
 
+		self.fill_name_value_sheet(ws, general_battery_info)
+
+		wb.save(excel_file_path)
+
+	def fill_name_value_sheet(self, ws, values):
 		# write statistics
 		ws.append(["Name", "Value"])
-		for record in general_battery_info.items():
+		for record in values.items():
 			ws.append(record)
 
-		# Adjust width of columns
-		# Iterate over all columns and adjust their widths
-
-		for column in ws.columns:
-			max_length = 0
-			column_letter = column[0].column_letter
-			for cell in column:
-				try:
-					if len(str(cell.value)) > max_length:
-						max_length = len(str(cell.value))
-				except:
-					pass
-			adjusted_width = (max_length + 2) * self.cell_width_margin
-			ws.column_dimensions[column_letter].width = adjusted_width
-
-		wb.save(excel_file_path)
+		self.adjust_column_widths(ws)
 
 	def write_realtime_status_to_excel(self, realtime_status, excel_file_path, append=True):
 		excel_file_path = self.add_file_extension_if_missing(excel_file_path, extension='.xlsx')
@@ -182,6 +196,11 @@ class SpFileWriter:
 			wb = load_workbook(excel_file_path)
 			ws = wb.create_sheet(title="Realtime status")
 
+		self.fill_realtime_status_sheet(ws, realtime_status)
+
+		wb.save(excel_file_path)
+
+	def fill_realtime_status_sheet(self, ws, realtime_status):
 		data_to_write = []
 		for key, value in realtime_status['parsed_voltage_status'].items():
 			if isinstance(value, dict):
@@ -257,22 +276,7 @@ class SpFileWriter:
 		for row in data_to_write:
 			ws.append(row)
 
-		# Adjust width of columns
-		# Iterate over all columns and adjust their widths
-
-		for column in ws.columns:
-			max_length = 0
-			column_letter = column[0].column_letter
-			for cell in column:
-				try:
-					if len(str(cell.value)) > max_length:
-						max_length = len(str(cell.value))
-				except:
-					pass
-			adjusted_width = (max_length + 2) * self.cell_width_margin
-			ws.column_dimensions[column_letter].width = adjusted_width
-
-		wb.save(excel_file_path)
+		self.adjust_column_widths(ws)
 
 	def write_parameters_to_excel(self, parsed_parameters, excel_file_path, append=True):
 		excel_file_path = self.add_file_extension_if_missing(excel_file_path, extension='.xlsx')
@@ -288,6 +292,11 @@ class SpFileWriter:
 			wb = load_workbook(excel_file_path)
 			ws = wb.create_sheet(title="Parameters")
 
+		self.fill_parameters_sheet(ws, parsed_parameters)
+
+		wb.save(excel_file_path)
+
+	def fill_parameters_sheet(self, ws, parsed_parameters):
 		data_to_write = []
 		indent = 0
 		for group, parameters_in_group in parsed_parameters.items():
@@ -308,19 +317,33 @@ class SpFileWriter:
 		for row in data_to_write:
 			ws.append(row)
 
-		# Adjust width of columns
-		# Iterate over all columns and adjust their widths
+		self.adjust_column_widths(ws)
 
-		for column in ws.columns:
-			max_length = 0
-			column_letter = column[0].column_letter
-			for cell in column:
-				try:
-					if len(str(cell.value)) > max_length:
-						max_length = len(str(cell.value))
-				except:
-					pass
-			adjusted_width = (max_length + 2) * self.cell_width_margin
-			ws.column_dimensions[column_letter].width = adjusted_width
+	def write_report_to_excel(self, all_status, excel_file_path, overwrite=False):
+		"""
+		Write a full battery report in one go, instead of opening and saving the file once per section.
+		:arguments
+			all_status: dict as returned by WSTCan.get_all_sp_status. The log is optional.
+		"""
+		excel_file_path = self.add_file_extension_if_missing(excel_file_path, extension='.xlsx')
+
+		if pathlib.Path(excel_file_path).is_file():
+			if overwrite:
+				if self.create_backup_file(excel_file_path):
+					os.remove(excel_file_path)  # we only remove file if backup was created.
+			else:
+				raise Exception("File already exists. use overwrite=True to overwrite.")
+
+		wb = Workbook()
+		wb.remove(wb.active)
+		if 'log' in all_status:
+			self.fill_log_sheet(wb.create_sheet(title="Log"), all_status['log']['parsed_log'])
+			self.fill_name_value_sheet(wb.create_sheet(title="Log Statistics"), all_status['log']['parsed_log_statistics'])
+		if 'basic_info' in all_status:
+			self.fill_name_value_sheet(wb.create_sheet(title="Battery Information"), all_status['basic_info'])
+		if 'realtime_status' in all_status:
+			self.fill_realtime_status_sheet(wb.create_sheet(title="Realtime status"), all_status['realtime_status'])
+		if 'parsed_parameters' in all_status:
+			self.fill_parameters_sheet(wb.create_sheet(title="Parameters"), all_status['parsed_parameters'])
 
 		wb.save(excel_file_path)
@@ -0,0 +1,60 @@
+import json
+import pathlib
+from datetime import datetime
+
+
+# Local store of downloaded raw log records, one JSON file per BMS serial. Records are the 33 byte SP log records as
+# lists of ints (SP and protocol 2 use the same record layout) and are kept newest first.
+# Used by WSTCan.syncLog to only download and store the records newer than the last pull. The download stops at the
+# first record equal to one of the known_records_to_match newest stored records, so:
+# - When the BMS log wraps (drops its oldest records to make room) nothing changes, as long as fewer records were logged
+# 	since the last sync than the BMS log holds. Otherwise none of the known records is left in the log, so the whole log
+# 	is downloaded and added. The records the BMS dropped in between are missing from the store, as on the BMS.
+# - When the BMS log is reset (cleared, or the serial is given to another BMS) none of the known records is found
+# 	either. The whole new log is added in front of the stored records, which are kept.
+# - A new record equal to a known one (same date and values, eg. when the BMS clock is not set) stops the download
+# 	early and the records after it are not stored.
+class SpLogStore:
+	def __init__(self, directory="logs", known_records_to_match=5):
+		self.directory = pathlib.Path(directory)
+		# number of the newest stored records used to recognize where the already stored part of the log begins
+		self.known_records_to_match = known_records_to_match
+
+	def file_path(self, serial):
+		return self.directory / ("%s.json" % serial)
+
+	def load(self, serial):
+		file_path = self.file_path(serial)
+		if not file_path.is_file():
+			return []
+		with open(file_path, "r") as f:
+			return json.load(f)['records']
+
+	def save(self, serial, records):
+		self.directory.mkdir(parents=True, exist_ok=True)
+		file_path = self.file_path(serial)
+		temp_file_path = file_path.with_suffix(".json.tmp")
+		with open(temp_file_path, "w") as f:
+			json.dump({'serial': str(serial), 'updated': datetime.now().isoformat(), 'records': records}, f)
+		temp_file_path.replace(file_path)  # so an interrupted save never leaves a half written store
+
+	# The newest stored records as tuples. A downloaded record equal to one of these is already in the store.
+	def known_records(self, serial):
+		return set(tuple(record) for record in self.load(serial)[:self.known_records_to_match])
+
+	def merge(self, serial, new_records, newest_first=True):
+		"""
+		Add newly downloaded records to the store of a battery.
+		:arguments
+			new_records: records not in the store yet, in the order they were downloaded
+			newest_first: the order of new_records
+		:returns
+			all stored records of the battery, newest first
+		"""
+		new_records = [list(record) for record in new_records]
+		if not newest_first:
+			new_records.reverse()
+		records = new_records + self.load(serial)
+		if len(new_records) > 0:
+			self.save(serial, records)
+		return records
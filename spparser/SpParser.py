@@ -1,3 +1,4 @@
+import functools
 import json
 import math
 import os
@@ -6,6 +7,76 @@ import struct
 import sys
 from datetime import datetime
 
+try:
+	import numpy  # optional. Only needed for parse_log_columns
+except ImportError:
+	numpy = None
+
+# Layout of a 33 byte SP log record, see parse_log_record. Multi byte values are big endian. The date is 6 BCD bytes.
+_LOG_RECORD_FIELDS = [
+	('entry_id', 'u1'), ('date', 'u1', (6,)), ('pack_voltage', '>u2'), ('cell_min_voltage', '>u2'),
+	('cell_max_voltage', '>u2'), ('current', '>i2'), ('min_temperature', 'u1'), ('max_temperature', 'u1'), ('soc', 'u1'),
+	('remaining_capacity', '>u4'), ('cycle_count', '>u2'), ('state_1', 'u1'), ('state_2', 'u1'), ('state_3', 'u1'),
+	('charge_flag', 'u1'), ('event', 'u1'), ('soh', 'u1'), ('mos_temperature', 'u1'), ('cell_number_min_temperature', 'u1'),
+	('cell_number_max_temperature', 'u1')]
+LOG_RECORD_SIZE = 33
+
+# Field layouts of the SP status responses, as (name, struct format) with None as name for empty flag and reserved
+# bytes. Compiled once into a big endian struct.Struct by _compile_layout, so a response is decoded with one unpack_from.
+# 4 byte values split by a flag byte (the capacities) are read as two words and combined in the parser.
+_VOLTAGE_STATUS_HEADER = [
+	('pack_cells_total', 'B'), ('temperature_probes_total', 'B')]  # followed by one word per cell
+_CURRENT_STATUS_HEADER = [
+	('status_byte', 'B'), ('current', 'H'), (None, '4x'), ('total_temperature_probes_count', 'B')]  # then the probes
+# Follows the temperature probes of the current status
+_CURRENT_STATUS_TAIL = [
+	('shunt_resistor', 'H'),
+	# Balancing flags for cell 17-24, 9-16 and 1-8.
+	('balancing_byte_3', 'B'), ('balancing_byte_2', 'B'), ('balancing_byte_1', 'B'),
+	('firmware_version', 'B'), ('mosfet_status', 'B'), ('failure_status', 'B')]
+_POWER_STATUS_LAYOUT = [
+	(None, 'x'), ('soc', 'B'), (None, 'x'), ('cycles', 'H'),
+	(None, 'x'), ('design_capacity_high', 'H'), (None, 'x'), ('design_capacity_low', 'H'),
+	(None, 'x'), ('full_capacity_high', 'H'), (None, 'x'), ('full_capacity_low', 'H'),
+	(None, 'x'), ('remaining_capacity_high', 'H'), (None, 'x'), ('remaining_capacity_low', 'H'),
+	(None, 'x'), ('remaining_discharge_minutes', 'H'), (None, 'x'), ('remaining_charge_minutes', 'H'),
+	(None, 'x'), ('hours_since_last_charge', 'H'), ('max_hours_between_charge', 'H'),  # obs - no flag byte here
+	(None, '7x'),  # reserved bytes 34-40
+	('total_battery_voltage', 'H'), ('cell_max_voltage', 'H'), ('cell_min_voltage', 'H')]
+# The two statistics frames merged, without their first byte
+_LOG_STATISTICS_LAYOUT = [(None, '4x')] + [(name, 'H') for name in [
+	'cot_count', 'cut_count', 'dot_count', 'dut_count', 'fet_ot_count', 'software_ov_count', 'software_uv_count',
+	'pack_ov_count', 'pack_uv_count', 'chg_full_count', 'hardware_ov_count', 'hard_uv', 'soft_coc', 'soft_doc',
+	'hard_oc', 'hardware_sc', 'uv_shutdown', 'auto_shutdown_count', 'button_shutdown_count', 'reset_count']] + [
+	('accumulated_discharge_minutes', 'I'), ('accumulated_charge_minutes', 'I'), ('app_updates_count', 'B')]
+
+
+def _compile_layout(layout):
+	return struct.Struct('>' + ''.join(fmt for name, fmt in layout)), [name for name, fmt in layout if name is not None]
+
+
+_VOLTAGE_STATUS_HEADER_STRUCT = _compile_layout(_VOLTAGE_STATUS_HEADER)
+_CURRENT_STATUS_HEADER_STRUCT = _compile_layout(_CURRENT_STATUS_HEADER)
+_CURRENT_STATUS_TAIL_STRUCT = _compile_layout(_CURRENT_STATUS_TAIL)
+_POWER_STATUS_STRUCT = _compile_layout(_POWER_STATUS_LAYOUT)
+_LOG_STATISTICS_STRUCT = _compile_layout(_LOG_STATISTICS_LAYOUT)
+
+
+def _unpack_layout(compiled_layout, data, offset=0):
+	layout_struct, names = compiled_layout
+	return dict(zip(names, layout_struct.unpack_from(data, offset)))
+
+
+# struct for the variable length sections (cell voltages, temperature probes). One per count, compiled on first use.
+@functools.lru_cache(maxsize=None)
+def _count_struct(fmt, count):
+	return struct.Struct('>%d%s' % (count, fmt))
+
+
+# 65535 is read as 0, like parse_two_bytes_big_endian and parse_four_bytes_big_endian do
+def _unsigned(value):
+	return 0 if value == 65535 else value
+
 
 # noinspection PyListCreation,PyDictCreation
 class SpParser:
@@ -172,20 +243,16 @@ class SpParser:
 
 	def parse_voltage_status(self, voltage_data_array):
 		voltage_status = {}
-		voltage_status['pack_cells_total'] = voltage_data_array[0]
-		voltage_status['temperature_probes_total'] = voltage_data_array[1]
+		data = bytes(voltage_data_array)
+		voltage_status.update(_unpack_layout(_VOLTAGE_STATUS_HEADER_STRUCT, data))
 		voltage_status['system_cells_total'] = voltage_data_array[2]  # Not really used as far as we have seen.
 
-		# Loop to get all cell voltages
+		# All cell voltages with one unpack. 2 bytes per cell starting at byte 3.
+		cell_voltages_in_mv = _count_struct('H', voltage_status['pack_cells_total']).unpack_from(data, 3)
 		voltage_status["cell_voltages"] = {}
 		cell_diff_temp_array = []
-		for i in range(voltage_status['pack_cells_total']):
-			array_location_for_current_cell_voltage_high_byte = 3 + i * 2
-			array_location_for_current_cell_voltage_low_byte = 4 + i * 2
-			high_byte = voltage_data_array[array_location_for_current_cell_voltage_high_byte]
-			low_byte = voltage_data_array[array_location_for_current_cell_voltage_low_byte]
-			cell_voltage_in_mv = self.parse_two_bytes_big_endian(high_byte, low_byte)
-			cell_voltage_in_v = float(cell_voltage_in_mv) / 1000
+		for i, cell_voltage_in_mv in enumerate(cell_voltages_in_mv):
+			cell_voltage_in_v = float(_unsigned(cell_voltage_in_mv)) / 1000
 			cell_diff_temp_array.append(cell_voltage_in_v)
 			voltage_status["cell_voltages"]["cell_%s" % (i+1)] = cell_voltage_in_v
 
@@ -196,16 +263,16 @@ class SpParser:
 
 	def parse_current_status(self, current_data_array):
 		current_status = {}
-		current_status_byte = current_data_array[0]
+		data = bytes(current_data_array)
+		header = _unpack_layout(_CURRENT_STATUS_HEADER_STRUCT, data)
+		current_status_byte = header['status_byte']
 		current_status['mos_temperature_probe_present'] = self.is_bit_set(current_status_byte, 4)
 		current_status['ambient_temperature_probe_present'] = self.is_bit_set(current_status_byte, 5)
 		current_status['status_flags'] = self.get_status_code_desc_abbr_array(current_data_array)
 		current_status['status_flags_snake_case'] = self.get_status_codes_snake_case(current_data_array)
 
-		high_byte = current_data_array[1]
-		low_byte = current_data_array[2]
 		# current is in 10mA, so we convert to A
-		current_value = float(self.parse_two_bytes_big_endian(high_byte, low_byte))/100
+		current_value = float(_unsigned(header['current'])) / 100
 		if 'dsg' in current_status['status_flags_snake_case']:
 			current_status['current'] = current_value * (-1)
 		else:
@@ -213,60 +280,52 @@ class SpParser:
 
 		# temperature probes for cells are in a dict. mos and ambient have separate keys
 		current_status['cell_temperature_probes'] = {}
-		current_status['total_temperature_probes_count'] = current_data_array[7]
+		current_status['total_temperature_probes_count'] = header['total_temperature_probes_count']
 		total_probes = current_status['total_temperature_probes_count']
 		mos_probes = int(current_status['mos_temperature_probe_present'])
 		ambient_probes = int(current_status['ambient_temperature_probe_present'])
 		# cell probes are what is left when the ambient and mos are removed.
-		current_status['cell_temperature_probes_count'] = total_probes - mos_probes - ambient_probes
-		# loop over cells temperature probes and save in dict
-		for i in range(current_status['cell_temperature_probes_count']):
-			array_location_for_temperature_probe = 8 + i
-			current_status['cell_temperature_probes']["cell_temperature_%s" % (i+1)] = current_data_array[array_location_for_temperature_probe] - 40
+		cell_probes = total_probes - mos_probes - ambient_probes
+		current_status['cell_temperature_probes_count'] = cell_probes
+
+		# The cell probes from byte 8 on, followed by the mos and ambient probe bytes, in one unpack.
+		# The mos and ambient probes are only read when present.
+		probes = _count_struct('B', max(cell_probes, 0) + 2).unpack_from(data, 8 + min(cell_probes, 0))
+		for i in range(cell_probes):
+			current_status['cell_temperature_probes']["cell_temperature_%s" % (i+1)] = probes[i] - 40
 
 		# Mos and ambient probe temp.
-		array_location_for_mos_probe = 8 + current_status['cell_temperature_probes_count']
-		array_location_for_ambient_probe = 8 + current_status['cell_temperature_probes_count'] + 1
 		if current_status['mos_temperature_probe_present']:
-			current_status['mos_temperature'] = current_data_array[array_location_for_mos_probe] - 40
+			current_status['mos_temperature'] = probes[-2] - 40
 		else:
 			current_status['mos_temperature'] = "NA"
 		if current_status['ambient_temperature_probe_present']:
-			current_status['ambient_temperature'] = current_data_array[array_location_for_ambient_probe] - 40
+			current_status['ambient_temperature'] = probes[-1] - 40
 		else:
 			current_status['ambient_temperature'] = "NA"
 
-		#  resistor value
-		array_start_location_for_shunt_resistor = 8 + current_status['cell_temperature_probes_count'] + mos_probes + ambient_probes#  two bytes
-		shunt_resistor_byte = self.read_two_bytes_big_endian_from_array(current_data_array, array_start_location_for_shunt_resistor)
+		# shunt resistor, balancing, firmware, mosfet and failure bytes follow the probes
+		array_start_location_for_shunt_resistor = 8 + cell_probes + mos_probes + ambient_probes
+		tail = _unpack_layout(_CURRENT_STATUS_TAIL_STRUCT, data, array_start_location_for_shunt_resistor)
 		self.debug_print("Shunt resistor data %s from array %s" % (current_data_array[array_start_location_for_shunt_resistor:array_start_location_for_shunt_resistor+1], current_data_array))
-		current_status['shunt_resistor'] = float(shunt_resistor_byte) / 100
+		current_status['shunt_resistor'] = float(_unsigned(tail['shunt_resistor'])) / 100
 
 		#  balancing bytes are in reversed order. last byte in array holds the first cells.
-		balancing_byte_3_array_location = array_start_location_for_shunt_resistor + 2	 # Holds cell 17-24 balancing flags
-		balancing_byte_2_array_location = array_start_location_for_shunt_resistor + 3  # Holds cell 9-16 balancing flags
-		balancing_byte_1_array_location = array_start_location_for_shunt_resistor + 4  # Holds cell 1-8 balancing flags
-		bal_byte_1 = current_data_array[balancing_byte_1_array_location]
-		bal_byte_2 = current_data_array[balancing_byte_2_array_location]
-		bal_byte_3 = current_data_array[balancing_byte_3_array_location]
-		balancing_flags = int.from_bytes(struct.pack('BBB', bal_byte_3, bal_byte_2, bal_byte_1), 'big')
+		balancing_flags = (tail['balancing_byte_3'] << 16) | (tail['balancing_byte_2'] << 8) | tail['balancing_byte_1']
 		current_status["cells_currently_balancing"] = {}
 		for cell_number in range(24):
 			current_status["cells_currently_balancing"]["cell_%s_balancing" % (cell_number + 1)] = self.is_bit_set(balancing_flags, cell_number)
 
 		# Firmware version
-		array_fw_version_byte_location = balancing_byte_1_array_location + 1
-		current_status['firmware_version'] = current_data_array[array_fw_version_byte_location]
+		current_status['firmware_version'] = tail['firmware_version']
 
 		# Mosfet status
-		array_location_mosfet_status = array_fw_version_byte_location + 1
-		mosfet_status_byte = current_data_array[array_location_mosfet_status]
+		mosfet_status_byte = tail['mosfet_status']
 		current_status['discharge_mosfet_on'] = self.is_bit_set(mosfet_status_byte, 1)
 		current_status['charge_mosfet_on'] = self.is_bit_set(mosfet_status_byte, 2)
 
 		# failure status for mosfet and cell voltage and temperature
-		array_location_failure_status = array_location_mosfet_status + 1
-		failure_status_byte = current_data_array[array_location_failure_status]
+		failure_status_byte = tail['failure_status']
 		current_status['temperature_sensor_failure'] = self.is_bit_set(failure_status_byte, 0)
 		current_status['cell_voltage_failure'] = self.is_bit_set(failure_status_byte, 1)
 		current_status['discharge_mosfet_failure'] = self.is_bit_set(failure_status_byte, 2)
@@ -274,95 +333,31 @@ class SpParser:
 		return current_status
 
 	def parse_power_status(self, power_data_array):
+		fields = _unpack_layout(_POWER_STATUS_STRUCT, bytes(power_data_array))
 		power_status = {}
-
-		# SoC
-		power_status['soc'] = power_data_array[1]
-
-		# empty flag byte in power_data_array[2]
-
+		power_status['soc'] = fields['soc']
 		# Cycle count - sp docs refer to this as checksum for some strange reason.
-		high_byte = power_data_array[3]
-		low_byte = power_data_array[4]
-		power_status['cycles'] = self.parse_two_bytes_big_endian(high_byte, low_byte)
-
-		# empty flag byte in power_data_array[5]
-
-		# Design capacity
-		high_high_byte = power_data_array[6]
-		low_high_byte = power_data_array[7]
-		# empty flag byte in power_data_array[8]
-		high_low_byte = power_data_array[9]
-		low_low_byte = power_data_array[10]
-		power_status['design_capacity'] = self.parse_four_bytes_big_endian(high_high_byte, low_high_byte, high_low_byte, low_low_byte)
-
-		# empty flag byte in power_data_array[11]
-
-		# full capacity
-		high_high_byte = power_data_array[12]
-		low_high_byte = power_data_array[13]
-		# empty flag byte in power_data_array[14]
-		high_low_byte = power_data_array[15]
-		low_low_byte = power_data_array[16]
-		power_status['full_capacity'] = self.parse_four_bytes_big_endian(high_high_byte, low_high_byte, high_low_byte, low_low_byte)
-
-		# empty flag byte in power_data_array[17]
-
-		# remaining capacity
-		high_high_byte = power_data_array[18]
-		low_high_byte = power_data_array[19]
-		# empty flag byte in power_data_array[20]
-		high_low_byte = power_data_array[21]
-		low_low_byte = power_data_array[22]
-		power_status['remaining_capacity'] = self.parse_four_bytes_big_endian(high_high_byte, low_high_byte, high_low_byte, low_low_byte)
-
-		# empty flag byte in power_data_array[23]
-
-		# Remaining discharge time in min
-		high_byte = power_data_array[24]
-		low_byte = power_data_array[25]
-		power_status['remaining_discharge_minutes'] = self.parse_two_bytes_big_endian(high_byte, low_byte)
+		power_status['cycles'] = _unsigned(fields['cycles'])
+		# The capacities are 4 bytes split in two words by an empty flag byte
+		for capacity in ['design_capacity', 'full_capacity', 'remaining_capacity']:
+			power_status[capacity] = _unsigned((fields[capacity + '_high'] << 16) | fields[capacity + '_low'])
+
+		# Remaining discharge and charge time in min
+		power_status['remaining_discharge_minutes'] = _unsigned(fields['remaining_discharge_minutes'])
 		if power_status['remaining_discharge_minutes'] == 65535:
 			power_status['remaining_discharge_minutes'] = -1
-
-		# empty flag byte in power_data_array[26]
-
-		# remaining charge time in min
-		high_byte = power_data_array[27]
-		low_byte = power_data_array[28]
-		power_status['remaining_charge_minutes'] = self.parse_two_bytes_big_endian(high_byte, low_byte)
+		power_status['remaining_charge_minutes'] = _unsigned(fields['remaining_charge_minutes'])
 		if power_status['remaining_charge_minutes'] == 65535:
 			power_status['remaining_charge_minutes'] = -1
 
-		# empty flag byte in power_data_array[29]
-
-		# charge intervals(time since last charge) in hours
-		high_byte = power_data_array[30]
-		low_byte = power_data_array[31]
-		power_status['hours_since_last_charge'] = self.parse_two_bytes_big_endian(high_byte, low_byte)
-		# obs - no flag byte here
-		# the longest charge interval (max time between two charges ever)
-		high_byte = power_data_array[32]
-		low_byte = power_data_array[33]
-		power_status['max_hours_between_charge'] = self.parse_two_bytes_big_endian(high_byte, low_byte)
+		# charge intervals(time since last charge) and the longest charge interval (max time between two charges ever) in hours
+		power_status['hours_since_last_charge'] = _unsigned(fields['hours_since_last_charge'])
+		power_status['max_hours_between_charge'] = _unsigned(fields['max_hours_between_charge'])
 
-		# reserved bytes 34-40
-
-		# total battery voltage
-		high_byte = power_data_array[41]
-		low_byte = power_data_array[42]
-		# total battery voltage is on 10mV, so we convert to V
-		power_status['total_battery_voltage'] = float(self.parse_two_bytes_big_endian(high_byte, low_byte)) / 100
-
-		# cell max voltage
-		high_byte = power_data_array[43]
-		low_byte = power_data_array[44]
-		power_status['cell_max_voltage'] = float(self.parse_two_bytes_big_endian(high_byte, low_byte))/1000
-
-		# cell min voltage
-		high_byte = power_data_array[45]
-		low_byte = power_data_array[46]
-		power_status['cell_min_voltage'] = float(self.parse_two_bytes_big_endian(high_byte, low_byte))/1000
+		# total battery voltage is on 10mV, so we convert to V. Cell voltages are in mV.
+		power_status['total_battery_voltage'] = float(_unsigned(fields['total_battery_voltage'])) / 100
+		power_status['cell_max_voltage'] = float(_unsigned(fields['cell_max_voltage']))/1000
+		power_status['cell_min_voltage'] = float(_unsigned(fields['cell_min_voltage']))/1000
 
 		# Handle extended protocol
 		# See: "SuperPower common communication protocol V1.1 06.06.2022.doc"
@@ -385,40 +380,28 @@ class SpParser:
 	def parse_log_statistics(self, log_statistics_data_array):
 		# if argument is an array, we assume two stat frames are here. If not we assume it's the correct-merged array.
 		# this "should" make us UART compatible.
-		log_statistics = {}
-
 		if isinstance(log_statistics_data_array[0], list):
 			log_statistics_data_array = log_statistics_data_array[0][1:] + log_statistics_data_array[1][1:]
 
-		offset = 4  # first 4 bytes are reserved
-		log_statistics['cot_count'] = self.read_two_bytes_big_endian_from_array(log_statistics_data_array, 0+offset, unsigned=True)
-		log_statistics['cut_count'] = self.read_two_bytes_big_endian_from_array(log_statistics_data_array, 2+offset, unsigned=True)
-		log_statistics['dot_count'] = self.read_two_bytes_big_endian_from_array(log_statistics_data_array, 4+offset, unsigned=True)
-		log_statistics['dut_count'] = self.read_two_bytes_big_endian_from_array(log_statistics_data_array, 6+offset, unsigned=True)
-		log_statistics['fet_ot_count'] = self.read_two_bytes_big_endian_from_array(log_statistics_data_array, 8+offset, unsigned=True)
-		log_statistics['software_ov_count'] = self.read_two_bytes_big_endian_from_array(log_statistics_data_array, 10+offset, unsigned=True)
-		log_statistics['software_uv_count'] = self.read_two_bytes_big_endian_from_array(log_statistics_data_array, 12+offset, unsigned=True)
-		log_statistics['pack_ov_count'] = self.read_two_bytes_big_endian_from_array(log_statistics_data_array, 14+offset, unsigned=True)
-		log_statistics['pack_uv_count'] = self.read_two_bytes_big_endian_from_array(log_statistics_data_array, 16+offset, unsigned=True)
-		log_statistics['chg_full_count'] = self.read_two_bytes_big_endian_from_array(log_statistics_data_array, 18+offset, unsigned=True)
-		log_statistics['hardware_ov_count'] = self.read_two_bytes_big_endian_from_array(log_statistics_data_array, 20+offset, unsigned=True)
-		log_statistics['hard_uv'] = self.read_two_bytes_big_endian_from_array(log_statistics_data_array, 22+offset, unsigned=True)
-		log_statistics['soft_coc'] = self.read_two_bytes_big_endian_from_array(log_statistics_data_array, 24+offset, unsigned=True)
-		log_statistics['soft_doc'] = self.read_two_bytes_big_endian_from_array(log_statistics_data_array, 26+offset, unsigned=True)
-		log_statistics['hard_oc'] = self.read_two_bytes_big_endian_from_array(log_statistics_data_array, 28+offset, unsigned=True)
-		log_statistics['hardware_sc'] = self.read_two_bytes_big_endian_from_array(log_statistics_data_array, 30+offset, unsigned=True)
-		log_statistics['uv_shutdown'] = self.read_two_bytes_big_endian_from_array(log_statistics_data_array, 32+offset, unsigned=True)
-		log_statistics['auto_shutdown_count'] = self.read_two_bytes_big_endian_from_array(log_statistics_data_array, 34+offset, unsigned=True)
-		log_statistics['button_shutdown_count'] = self.read_two_bytes_big_endian_from_array(log_statistics_data_array, 36+offset, unsigned=True)
-		log_statistics['reset_count'] = self.read_two_bytes_big_endian_from_array(log_statistics_data_array, 38+offset, unsigned=True)
-		log_statistics['accumulated_discharge_minutes'] = self.read_four_bytes_big_endian_from_array(log_statistics_data_array, 40+offset, unsigned=True)
-		log_statistics['accumulated_charge_minutes'] = self.read_four_bytes_big_endian_from_array(log_statistics_data_array, 44+offset, unsigned=True)
-		log_statistics['app_updates_count'] = 0 if log_statistics_data_array[48+offset] == 255 else log_statistics_data_array[48+offset]
+		fields = _unpack_layout(_LOG_STATISTICS_STRUCT, bytes(log_statistics_data_array))
+		log_statistics = {}
+		for name, value in fields.items():
+			log_statistics[name] = _unsigned(value)
+		log_statistics['app_updates_count'] = 0 if fields['app_updates_count'] == 255 else fields['app_updates_count']
 		return log_statistics
 
 	# expects a 6 integer array
 	@staticmethod
 	def parse_sp_log_date(date_array) -> str:
+		date_time = SpParser.sp_log_datetime(date_array)
+		if date_time is None:
+			date_time = "corrupted"
+
+		return str(date_time)
+
+	# expects a 6 integer array. Returns a datetime or None if the date is not a valid date.
+	@staticmethod
+	def sp_log_datetime(date_array):
 		# all the date values are parsed to padded hex string, then to int.
 		# it is a strange way it is coded...
 		year = int("20"+"{:02x}".format(date_array[0]))
@@ -428,11 +411,9 @@ class SpParser:
 		minute = int("{:02x}".format(date_array[4]))
 		second = int("{:02x}".format(date_array[5]))
 		try:
-			date_time = datetime(year, month, day, hour, minute, second)
+			return datetime(year, month, day, hour, minute, second)
 		except ValueError:
-			date_time = "corrupted"
-
-		return str(date_time)
+			return None
 
 	def parse_log(self, log_data_array):
 		parsed_log = {}
@@ -444,222 +425,286 @@ class SpParser:
 
 		parsed_records = []  # holds the parsed records before assigning to dict in the end
 		for i, raw_record in enumerate(log_data_array):  # loop to parse all log data into new parsed records
-			parsed_record = []
-
 			# Index. We assign our own, because the actual entry id from the record is 1 byte, so it
 			# restarts multiple times in large logs.
-			parsed_record.append(i+1)  # Index - see comment above
-			date = self.parse_sp_log_date(raw_record[1:7])  # Date
-			parsed_record.append(date)
-
-			pack_voltage = self.read_two_bytes_big_endian_from_array(raw_record, 7)  # 'Pack_V'
-			pack_voltage = float(pack_voltage)/100
-			parsed_record.append(pack_voltage)
-
-			cell_min_voltage = self.read_two_bytes_big_endian_from_array(raw_record, 9)  # 'Cell_min_(V)'
-			cell_min_voltage = float(cell_min_voltage)/1000
-			parsed_record.append(cell_min_voltage)
-
-			cell_max_voltage = self.read_two_bytes_big_endian_from_array(raw_record, 11)  # 'Cell_Max_(V)'
-			cell_max_voltage = float(cell_max_voltage) / 1000
-			parsed_record.append(cell_max_voltage)
-
-			current = self.read_two_bytes_big_endian_from_array(raw_record, 13, unsigned=False)  # 'Current_(A)'
-			current = float(current)/100
-			parsed_record.append(current)
-
-			min_temp = raw_record[15]-40  # 'Min_Temp_(deg-C)'
-			parsed_record.append(min_temp)
-
-			max_temp = raw_record[16]-40  # 'Max_Temp_(deg-C)'
-			parsed_record.append(max_temp)
-
-			soc = raw_record[17]  # 'SoC_(%)'
-			parsed_record.append(soc)
-
-			remaining_capacity = self.read_four_bytes_big_endian_from_array(raw_record, start_location=18)  # 'Rem_Cap_(mAh)'
-			parsed_record.append(remaining_capacity)
-
-			cycle_count = self.read_two_bytes_big_endian_from_array(raw_record, start_location=22)  # 'Cycles_#'
-			parsed_record.append(cycle_count)
-
-			# States 1,2 & 3
-			# I have chosen to use hex representation as keys, because they are like this in the documentation.
-			states_dict_array = []
-			states_dict_array.append({
-				0x00: 'Normal',
-				0x01: 'Pack UV Recovery',
-				0x02: 'Cell UV Recovery',
-				0x04: 'Pack OV Recovery',
-				0x08: 'Cell OV Recovery',
-				0x10: 'Pack UV',
-				0x20: 'Cell UV',
-				0x40: 'Pack OV',
-				0x80: 'Cell OV',
-				0xa0: 'Cell OV/Cell UV (Failure)'})  # State 1 dict
-
-			states_dict_array.append({
-				0x00: 'Normal',
-				0x04: 'SC Recovery',
-				0x08: 'DOC Recovery',
-				0x10: 'COC Recovery',
-				0x20: 'SC',
-				0x40: 'DOC',
-				0x80: 'COC'})  # State 2 dict
-
-			states_dict_array.append({
-				0x00: 'Normal',
-				0x10: 'DOT Recovery',
-				0x20: 'COT Recovery',
-				0x40: 'DOT',
-				0x80: 'COT'})  # State 3 dict
-
-			# ready array with the three state values from the raw data, transformed to hex string.
-			state_values = [raw_record[24], raw_record[25], raw_record[26]]
-
-			# write the human-readable version by 'translating' from the indexes
-			# we have 3 states, so we do this 3 times
-			for state_index in range(3):
-				if state_values[state_index] in states_dict_array[state_index]:
-					parsed_record.append(states_dict_array[state_index][state_values[state_index]])
-				else:
-					# if the status is not found, pass on the raw value as hex for readability.
-					parsed_record.append("0x" + "{:02x}".format(state_values[state_index]))
-
-			# Charge / Discharge flag
-			charge_flag_index = {
-				0x20: 'Standby',
-				0x40: 'DSG',
-				0x80: 'CHG'}
-			charge_flag = raw_record[27]
-
-			charge_status = "0x" + "{:02x}".format(charge_flag)  # default value if not in flag_index dict
-
-			if charge_flag in charge_flag_index:
-				charge_status = charge_flag_index[charge_flag]
-
-			parsed_record.append(charge_status)
-
-			# 'Event'
-			event_code_dict = {
-				0x1: "Manual Restart",
-				0x2: "Manual Shutdown",
-				0x3: "UV Shutdown",
-				0x4: "Power Up",
-				0x5: "Reserved",
-				0x6: "Full Cap. Update",
-				0x7: "Cycle Count Update",
-				0x8: "D-Fet Off",
-				0x9: "C-Fet Off",
-				0xA: "D-Fet On",
-				0xB: "C-Fet On",
-				0xC: "Write Configuration Parameters",
-				0xD: "Charging Current Calibration",
-				0xE: "Discharge Current Calibration",
-				0xF: "Voltage Calibration",
-				0x16: "Cell Over voltage Alarm",
-				0x17: "Tov Alarm",
-				0x18: "Battery Over-Discharge Alarm",
-				0x19: "Tuv Alarm",
-				0x1A: "Charging Over current Alarm",
-				0x1B: "Discharge Over current Alarm",
-				0x1C: "Charging Over temperature Alarm",
-				0x1D: "Discharge Over-Temperature Alarm",
-				0x1E: "Charging Mos Failure",
-				0x1F: "Discharge Mos Failure",
-				0x20: "Voltage Acquisition Failure",
-				0x21: "Temperature Acquisition Failure",
-				0x22: "Current Acquisition Failure",
-				0x23: "Charging Starts",
-				0x24: "Charging Stopped",
-				0x25: "Full Charge Protection",
-				0x26: "Full Charge Recovery",
-				0x27: "Discharge Starts",
-				0x28: "Discharge Stops",
-				0x29: "Automatic Power Off",
-				0x2A: "AFE Internal Error",
-				0x2B: "Soc Corrected To 0%",
-				0x2C: "Open Circuit - Full Of FCC Updates",
-				0x2D: "Charges - Full Of FCC Updates",
-				0x2E: "Open Circuit-Charge Stop Fcc Update",
-				0x2F: "Charge - Full Of Fcc Updates",
-				0x30: "Anti-Sparking Switch Short Circuit Protection",
-				0x31: "Pre-Discharge Short Circuit Protection",
-				0x32: "Heating Start ",
-				0x33: "Heating Stop ",
-				0x34: "15S Delayed Current Detection ",
-				0x35: "Low Voltage Brick",
-				0x36: "Low Voltage Brick Recovery",
-				0x37: "Cell Voltage Diff. Brick",
-				0x38: "Cell Voltage Diff. Brick Recovery",
-				0x39: "Cp8 Extended Protection Initialized",
-				0x5A: "Cell Imbalance Alarm",
-				0x5B: "Cell Imbalance Alarm Recovery",
-				0x5C: "Pc Design Capacity Calibration",
-				0x5D: "Pc Remaining Capacity Calibration",
-				0x5E: "Full Soc Correction",
-				0x5F: "Scheduled Recording",
-				0x60: "Mos High Temperature Protection",
-				0x61: "Mos High Temperature Recovery",
-				0x62: "Charging",
-				0x63: "Discharging",
-				0x64: "Program Update Enters Bootloader",
-				0x65: "Battery Over Voltage Alarm Recovery",
-				0x66: "Battery Under Voltage Alarm Recovery",
-				0x67: "Total Pressure Over voltage Alarm Recovery",
-				0x68: "Total Pressure Over-Discharge Alarm Recovery",
-				0x69: "Charging Temperature Alarm Recovery",
-				0x6A: "Discharge Temperature Alarm Recovery",
-				0x6B: "Short Circuit Automatic Recovery Lock",
-				0x6C: "Over current Automatic Recovery Lock",
-				0x6D: "Cell Voltage Failure Protection",
-				0x6E: "Cell Voltage Difference Failure Recovery",
-				0x6F: "Charging Is Prohibited",
-				0x70: "Prohibit Charging Recovery",
-				0x71: "Charging Over current Alarm Recovery",
-				0x72: "Discharge Over current Alarm Recovery",
-				0x73: "Mos High Temperature Alarm",
-				0x74: "Mos High Temperature Alarm Recovery",
-				0x75: "Environmental High Temperature Alarm",
-				0x76: "Environment High Temperature Alarm Recovery",
-				0x77: "Environmental Low Temperature Alarm",
-				0x78: "Environmental Low Temperature Alarm Recovery",
-				0x79: "Capacity Low Alarm",
-				0x7A: "Capacity Low Alarm Recovery",
-				0x7B: "Environmental High Temperature Protection",
-				0x7C: "Environmental High Temperature Protection Recovery",
-				0x7D: "Environmental Low Temperature Protection",
-				0x7E: "Environmental Low Temperature Protection Recovery",
-				0x7F: "Charging Current Limit Is On",
-				0x80: "Charging Current Limit Off"
-			}
-			event_code = raw_record[28]
-			event_text = "0x" + "{:02x}".format(event_code)  # Default
-			if event_code in event_code_dict:
-				event_text = event_code_dict[event_code]
-			parsed_record.append(event_text)
-
-			# 'SoH_(%)'
-			soh = raw_record[29]
-			parsed_record.append(soh)
-
-			# 'MOS_Temp._(C)'
-			mos_temperature = raw_record[30] - 40  # offset ntc by -40
-			parsed_record.append(mos_temperature)
-
-			# 'Cell_#_min_temp'
-			cell_number_min_temp = raw_record[31]
-			parsed_record.append(cell_number_min_temp)
-
-			# 'Cell_#_max_temp.'
-			cell_number_max_temp = raw_record[32]
-			parsed_record.append(cell_number_max_temp)
-
-			parsed_records.append(parsed_record)  # Add to list of parsed records
+			parsed_records.append(self.parse_log_record(raw_record, i+1))  # Add to list of parsed records
 
 		parsed_log['records'] = parsed_records
 		return parsed_log
 
+	# parse one 33 byte log record. entry_number is put in the first column, see parse_log.
+	def parse_log_record(self, raw_record, entry_number):
+		parsed_record = []
+		parsed_record.append(entry_number)  # Index
+		date = self.parse_sp_log_date(raw_record[1:7])  # Date
+		parsed_record.append(date)
+
+		pack_voltage = self.read_two_bytes_big_endian_from_array(raw_record, 7)  # 'Pack_V'
+		pack_voltage = float(pack_voltage)/100
+		parsed_record.append(pack_voltage)
+
+		cell_min_voltage = self.read_two_bytes_big_endian_from_array(raw_record, 9)  # 'Cell_min_(V)'
+		cell_min_voltage = float(cell_min_voltage)/1000
+		parsed_record.append(cell_min_voltage)
+
+		cell_max_voltage = self.read_two_bytes_big_endian_from_array(raw_record, 11)  # 'Cell_Max_(V)'
+		cell_max_voltage = float(cell_max_voltage) / 1000
+		parsed_record.append(cell_max_voltage)
+
+		current = self.read_two_bytes_big_endian_from_array(raw_record, 13, unsigned=False)  # 'Current_(A)'
+		current = float(current)/100
+		parsed_record.append(current)
+
+		min_temp = raw_record[15]-40  # 'Min_Temp_(deg-C)'
+		parsed_record.append(min_temp)
+
+		max_temp = raw_record[16]-40  # 'Max_Temp_(deg-C)'
+		parsed_record.append(max_temp)
+
+		soc = raw_record[17]  # 'SoC_(%)'
+		parsed_record.append(soc)
+
+		remaining_capacity = self.read_four_bytes_big_endian_from_array(raw_record, start_location=18)  # 'Rem_Cap_(mAh)'
+		parsed_record.append(remaining_capacity)
+
+		cycle_count = self.read_two_bytes_big_endian_from_array(raw_record, start_location=22)  # 'Cycles_#'
+		parsed_record.append(cycle_count)
+
+		# States 1,2 & 3
+		# I have chosen to use hex representation as keys, because they are like this in the documentation.
+		states_dict_array = []
+		states_dict_array.append({
+			0x00: 'Normal',
+			0x01: 'Pack UV Recovery',
+			0x02: 'Cell UV Recovery',
+			0x04: 'Pack OV Recovery',
+			0x08: 'Cell OV Recovery',
+			0x10: 'Pack UV',
+			0x20: 'Cell UV',
+			0x40: 'Pack OV',
+			0x80: 'Cell OV',
+			0xa0: 'Cell OV/Cell UV (Failure)'})  # State 1 dict
+
+		states_dict_array.append({
+			0x00: 'Normal',
+			0x04: 'SC Recovery',
+			0x08: 'DOC Recovery',
+			0x10: 'COC Recovery',
+			0x20: 'SC',
+			0x40: 'DOC',
+			0x80: 'COC'})  # State 2 dict
+
+		states_dict_array.append({
+			0x00: 'Normal',
+			0x10: 'DOT Recovery',
+			0x20: 'COT Recovery',
+			0x40: 'DOT',
+			0x80: 'COT'})  # State 3 dict
+
+		# ready array with the three state values from the raw data, transformed to hex string.
+		state_values = [raw_record[24], raw_record[25], raw_record[26]]
+
+		# write the human-readable version by 'translating' from the indexes
+		# we have 3 states, so we do this 3 times
+		for state_index in range(3):
+			if state_values[state_index] in states_dict_array[state_index]:
+				parsed_record.append(states_dict_array[state_index][state_values[state_index]])
+			else:
+				# if the status is not found, pass on the raw value as hex for readability.
+				parsed_record.append("0x" + "{:02x}".format(state_values[state_index]))
+
+		# Charge / Discharge flag
+		charge_flag_index = {
+			0x20: 'Standby',
+			0x40: 'DSG',
+			0x80: 'CHG'}
+		charge_flag = raw_record[27]
+
+		charge_status = "0x" + "{:02x}".format(charge_flag)  # default value if not in flag_index dict
+
+		if charge_flag in charge_flag_index:
+			charge_status = charge_flag_index[charge_flag]
+
+		parsed_record.append(charge_status)
+
+		# 'Event'
+		event_code_dict = {
+			0x1: "Manual Restart",
+			0x2: "Manual Shutdown",
+			0x3: "UV Shutdown",
+			0x4: "Power Up",
+			0x5: "Reserved",
+			0x6: "Full Cap. Update",
+			0x7: "Cycle Count Update",
+			0x8: "D-Fet Off",
+			0x9: "C-Fet Off",
+			0xA: "D-Fet On",
+			0xB: "C-Fet On",
+			0xC: "Write Configuration Parameters",
+			0xD: "Charging Current Calibration",
+			0xE: "Discharge Current Calibration",
+			0xF: "Voltage Calibration",
+			0x16: "Cell Over voltage Alarm",
+			0x17: "Tov Alarm",
+			0x18: "Battery Over-Discharge Alarm",
+			0x19: "Tuv Alarm",
+			0x1A: "Charging Over current Alarm",
+			0x1B: "Discharge Over current Alarm",
+			0x1C: "Charging Over temperature Alarm",
+			0x1D: "Discharge Over-Temperature Alarm",
+			0x1E: "Charging Mos Failure",
+			0x1F: "Discharge Mos Failure",
+			0x20: "Voltage Acquisition Failure",
+			0x21: "Temperature Acquisition Failure",
+			0x22: "Current Acquisition Failure",
+			0x23: "Charging Starts",
+			0x24: "Charging Stopped",
+			0x25: "Full Charge Protection",
+			0x26: "Full Charge Recovery",
+			0x27: "Discharge Starts",
+			0x28: "Discharge Stops",
+			0x29: "Automatic Power Off",
+			0x2A: "AFE Internal Error",
+			0x2B: "Soc Corrected To 0%",
+			0x2C: "Open Circuit - Full Of FCC Updates",
+			0x2D: "Charges - Full Of FCC Updates",
+			0x2E: "Open Circuit-Charge Stop Fcc Update",
+			0x2F: "Charge - Full Of Fcc Updates",
+			0x30: "Anti-Sparking Switch Short Circuit Protection",
+			0x31: "Pre-Discharge Short Circuit Protection",
+			0x32: "Heating Start ",
+			0x33: "Heating Stop ",
+			0x34: "15S Delayed Current Detection ",
+			0x35: "Low Voltage Brick",
+			0x36: "Low Voltage Brick Recovery",
+			0x37: "Cell Voltage Diff. Brick",
+			0x38: "Cell Voltage Diff. Brick Recovery",
+			0x39: "Cp8 Extended Protection Initialized",
+			0x5A: "Cell Imbalance Alarm",
+			0x5B: "Cell Imbalance Alarm Recovery",
+			0x5C: "Pc Design Capacity Calibration",
+			0x5D: "Pc Remaining Capacity Calibration",
+			0x5E: "Full Soc Correction",
+			0x5F: "Scheduled Recording",
+			0x60: "Mos High Temperature Protection",
+			0x61: "Mos High Temperature Recovery",
+			0x62: "Charging",
+			0x63: "Discharging",
+			0x64: "Program Update Enters Bootloader",
+			0x65: "Battery Over Voltage Alarm Recovery",
+			0x66: "Battery Under Voltage Alarm Recovery",
+			0x67: "Total Pressure Over voltage Alarm Recovery",
+			0x68: "Total Pressure Over-Discharge Alarm Recovery",
+			0x69: "Charging Temperature Alarm Recovery",
+			0x6A: "Discharge Temperature Alarm Recovery",
+			0x6B: "Short Circuit Automatic Recovery Lock",
+			0x6C: "Over current Automatic Recovery Lock",
+			0x6D: "Cell Voltage Failure Protection",
+			0x6E: "Cell Voltage Difference Failure Recovery",
+			0x6F: "Charging Is Prohibited",
+			0x70: "Prohibit Charging Recovery",
+			0x71: "Charging Over current Alarm Recovery",
+			0x72: "Discharge Over current Alarm Recovery",
+			0x73: "Mos High Temperature Alarm",
+			0x74: "Mos High Temperature Alarm Recovery",
+			0x75: "Environmental High Temperature Alarm",
+			0x76: "Environment High Temperature Alarm Recovery",
+			0x77: "Environmental Low Temperature Alarm",
+			0x78: "Environmental Low Temperature Alarm Recovery",
+			0x79: "Capacity Low Alarm",
+			0x7A: "Capacity Low Alarm Recovery",
+			0x7B: "Environmental High Temperature Protection",
+			0x7C: "Environmental High Temperature Protection Recovery",
+			0x7D: "Environmental Low Temperature Protection",
+			0x7E: "Environmental Low Temperature Protection Recovery",
+			0x7F: "Charging Current Limit Is On",
+			0x80: "Charging Current Limit Off"
+		}
+		event_code = raw_record[28]
+		event_text = "0x" + "{:02x}".format(event_code)  # Default
+		if event_code in event_code_dict:
+			event_text = event_code_dict[event_code]
+		parsed_record.append(event_text)
+
+		# 'SoH_(%)'
+		soh = raw_record[29]
+		parsed_record.append(soh)
+
+		# 'MOS_Temp._(C)'
+		mos_temperature = raw_record[30] - 40  # offset ntc by -40
+		parsed_record.append(mos_temperature)
+
+		# 'Cell_#_min_temp'
+		cell_number_min_temp = raw_record[31]
+		parsed_record.append(cell_number_min_temp)
+
+		# 'Cell_#_max_temp.'
+		cell_number_max_temp = raw_record[32]
+		parsed_record.append(cell_number_max_temp)
+
+		return parsed_record
+
+	def parse_log_columns(self, raw_records):
+		"""
+		Parse many log records at once with numpy. Gives the same values as parse_log, but as one array per column.
+		:arguments
+			raw_records: list of 33 byte records, or one bytes-like buffer with the records back to back
+		:returns
+			dict of column name: numpy array. 'entry' is our own 1 based index like in parse_log, 'date' is datetime64[s]
+			with NaT for invalid dates. States, charge flag and event are the raw values.
+		"""
+		if numpy is None:
+			raise Exception("numpy is required to parse the log as columns")
+		if isinstance(raw_records, (bytes, bytearray, memoryview)):
+			buffer = bytes(raw_records)
+		else:
+			buffer = numpy.asarray(raw_records, dtype=numpy.uint8).reshape(-1, LOG_RECORD_SIZE).tobytes()
+		if len(buffer) % LOG_RECORD_SIZE != 0:
+			raise Exception("Log buffer length %s is not a multiple of %s" % (len(buffer), LOG_RECORD_SIZE))
+		records = numpy.frombuffer(buffer, dtype=numpy.dtype(_LOG_RECORD_FIELDS))
+
+		# 65535 is read as 0, like parse_two_bytes_big_endian and parse_four_bytes_big_endian do
+		def unsigned_column(name):
+			return numpy.where(records[name] == 65535, 0, records[name])
+
+		columns = {}
+		columns['entry'] = numpy.arange(1, len(records) + 1)
+		columns['entry_id'] = records['entry_id']
+		columns['date'] = self.parse_sp_log_date_columns(records['date'])
+		columns['pack_voltage'] = unsigned_column('pack_voltage') / 100
+		columns['cell_min_voltage'] = unsigned_column('cell_min_voltage') / 1000
+		columns['cell_max_voltage'] = unsigned_column('cell_max_voltage') / 1000
+		columns['current'] = records['current'] / 100
+		columns['min_temperature'] = records['min_temperature'].astype(numpy.int16) - 40
+		columns['max_temperature'] = records['max_temperature'].astype(numpy.int16) - 40
+		columns['soc'] = records['soc']
+		columns['remaining_capacity'] = unsigned_column('remaining_capacity')
+		columns['cycle_count'] = unsigned_column('cycle_count')
+		for name in ['state_1', 'state_2', 'state_3', 'charge_flag', 'event', 'soh']:
+			columns[name] = records[name]
+		columns['mos_temperature'] = records['mos_temperature'].astype(numpy.int16) - 40
+		columns['cell_number_min_temperature'] = records['cell_number_min_temperature']
+		columns['cell_number_max_temperature'] = records['cell_number_max_temperature']
+		return columns
+
+	# numpy version of sp_log_datetime for an (n, 6) array of BCD dates. Invalid dates become NaT.
+	@staticmethod
+	def parse_sp_log_date_columns(date_bytes):
+		high_nibbles = (date_bytes >> 4).astype(numpy.int64)
+		low_nibbles = (date_bytes & 0x0F).astype(numpy.int64)
+		valid = numpy.all((high_nibbles < 10) & (low_nibbles < 10), axis=1)
+		values = high_nibbles * 10 + low_nibbles
+		year, month, day, hour, minute, second = [values[:, i] for i in range(6)]
+		valid &= (month >= 1) & (month <= 12) & (day >= 1) & (hour < 24) & (minute < 60) & (second < 60)
+		month = numpy.where(valid, month, 1)
+		day = numpy.where(valid, day, 1)
+		months = (year + 2000 - 1970) * 12 + month - 1
+		first_of_month = months.astype('datetime64[M]').astype('datetime64[D]')
+		dates = first_of_month + (day - 1).astype('timedelta64[D]')
+		valid &= dates.astype('datetime64[M]') == months.astype('datetime64[M]')  # day does not exist in that month
+		date_times = dates.astype('datetime64[s]') + (hour * 3600 + minute * 60 + second).astype('timedelta64[s]')
+		return numpy.where(valid, date_times, numpy.datetime64('NaT'))
+
 	@staticmethod
 	def decode_bms_serial_number(encoded_data):
 		bms_batch_packed_as_hex = encoded_data[0:5]
@@ -0,0 +1,27 @@
+import sys
+
+from wstcan.SimulatedBMS import SimulatedBMS, SimulatedBus
+from wstcan_protocol_tester.WSTProtocolTester import WSTProtocolTester, TestException
+
+# Run with --simulated to test against a SimulatedBus with 30 ms reply latency instead of a battery.
+if __name__ == "__main__":
+	print("Running All Tests")
+	transport = None
+	if "--simulated" in sys.argv:
+		battery = SimulatedBMS()
+		for parameter_number in range(9, 17):
+			battery.custom_parameters[parameter_number] = parameter_number
+		transport = SimulatedBus([battery], latency=0.03)
+	wst_protocol_tester = WSTProtocolTester(transport=transport)
+	tests_to_run = [
+		"test_custom_parameter_bulk_late_replies",
+		"test_async_custom_parameter_late_reply"]
+	results = wst_protocol_tester.run_tests(tests_to_run)
+
+	print("\n\nTest Results: ")
+	for test, result in results.items():
+		indicator = "[FAIL]"
+		if result:
+			indicator = "[TRUE]"
+
+		print("%s %s" % (test, indicator))
@@ -0,0 +1,78 @@
+import sys
+
+from wstcan.FrameAssembly import P2StatusAssembler
+
+
+class TestException(Exception):
+	def __init__(self, message):
+		self.message = message
+		print("[FAIL]", message)
+		super().__init__(self.message)
+
+
+# protocol 2 status frames of node_id for status, header first
+def status_frames(node_id, status):
+	frames = [[node_id, 0, 1, 0, 0, 0, 0, 0]]
+	if status:
+		frames.append([node_id, 0] + list(status[0:5]) + [1])
+		for index, offset in enumerate(range(5, len(status), 6), 2):
+			frames.append([node_id] + list(status[offset:offset + 6]) + [index])
+	frames[0][3] = len(frames)
+	return frames
+
+
+def test_out_of_order_status():
+	status = bytes(range(5 + 3 * 6))
+	frames = status_frames(2, status)
+	assembler = P2StatusAssembler(2)
+	for frame in reversed(frames):
+		complete = assembler.add_frame(frame)
+	if not complete or assembler.data != status:
+		raise TestException("Status assembled from reversed frames is %s" % bytes(assembler.data))
+	print("Status assembled from frames out of order [OK]")
+	return True
+
+
+# A header announcing only itself is an empty status, complete as soon as the header arrives
+def test_single_frame_status():
+	assembler = P2StatusAssembler(2)
+	frames = status_frames(2, b"")
+	if frames[0][3] != 1 or not assembler.add_frame(frames[0]):
+		raise TestException("A single frame status is not complete after its header")
+	if assembler.data != b"":
+		raise TestException("A single frame status holds %s" % bytes(assembler.data))
+	print("A single frame status is complete after the header [OK]")
+	return True
+
+
+# A header announcing no frames is ignored, so the next valid header still starts the status
+def test_zero_frame_header():
+	status = bytes(range(5 + 6))
+	assembler = P2StatusAssembler(2)
+	if assembler.add_frame([2, 0, 1, 0, 0, 0, 0, 0]):
+		raise TestException("A header announcing 0 frames completed the status")
+	for frame in status_frames(2, status):
+		complete = assembler.add_frame(frame)
+	if not complete or assembler.data != status:
+		raise TestException("Status after a 0 frame header is %s" % bytes(assembler.data))
+	print("A header announcing 0 frames is ignored [OK]")
+	return True
+
+
+if __name__ == "__main__":
+	print("Running All Tests")
+	results = {}
+	for test in [test_out_of_order_status, test_single_frame_status, test_zero_frame_header]:
+		try:
+			results[test.__name__] = test()
+		except TestException:
+			results[test.__name__] = False
+
+	print("\n\nTest Results: ")
+	for test, result in results.items():
+		indicator = "[FAIL]"
+		if result:
+			indicator = "[TRUE]"
+
+		print("%s %s" % (test, indicator))
+	sys.exit(0 if all(results.values()) else 1)
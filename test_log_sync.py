@@ -0,0 +1,141 @@
+import sys
+import tempfile
+import time
+
+from spparser.SpLogStore import SpLogStore
+from wstcan.SimulatedBMS import SimulatedBMS, SimulatedBus
+from wstcan.WSTCan import WSTCan
+
+
+class TestException(Exception):
+	def __init__(self, message):
+		self.message = message
+		print("[FAIL]", message)
+		super().__init__(self.message)
+
+
+# Incremental log sync (WSTCan.syncLog/syncLogProtocol2 with SpLogStore) against a simulated battery, as the tests need
+# to add records to the battery log, let it wrap and reset it. The log is sent slowly enough (about 1 s for 300
+# records) that the rest of a stopped download is still arriving when the next query is sent.
+class LogSyncTester:
+	def __init__(self):
+		self.battery = SimulatedBMS(log_records=300)
+		self.battery.log_capacity = 300
+		self.wstcan = WSTCan(transport=SimulatedBus([self.battery], frame_time=0.0005))
+		self.store = SpLogStore(tempfile.mkdtemp())
+		self.test_results = {}
+
+	def run_tests(self):
+		tests_to_run = [
+			self.test_first_sync,
+			self.test_new_records,
+			self.test_query_after_stopped_sync,
+			self.test_query_after_stopped_sync_protocol2,
+			self.test_wrapped_log,
+			self.test_fully_wrapped_log,
+			self.test_reset_log]
+		self.wstcan.open_session()
+		try:
+			for test in tests_to_run:
+				print("Running test: %s" % test.__name__)
+				try:
+					self.test_results[test.__name__] = test()
+				except TestException:
+					self.test_results[test.__name__] = False
+		finally:
+			self.wstcan.close_session()
+		return self.test_results
+
+	def stored_records(self):
+		records = self.store.load(self.battery.serial)
+		if len(set(tuple(record) for record in records)) != len(records):
+			raise TestException("The store holds duplicated records")
+		return records
+
+	def sync(self, expected_new_records):
+		new_records = self.wstcan.syncLog(self.store, serial=self.battery.serial)
+		if new_records != self.battery.log[:expected_new_records]:
+			raise TestException("Synced %s records, expected the %s newest" % (len(new_records), expected_new_records))
+		return new_records
+
+	def test_first_sync(self):
+		self.sync(300)
+		if self.stored_records() != self.battery.log:
+			raise TestException("The store does not hold the log")
+		print("First sync stored the whole log [OK]")
+		return True
+
+	def test_new_records(self):
+		stored_records = self.stored_records()
+		self.battery.add_log_records(3)
+		start = time.monotonic()
+		self.sync(3)
+		duration = time.monotonic() - start
+		if self.stored_records() != self.battery.log[:3] + stored_records:
+			raise TestException("The new records were not stored in front of the old ones")
+		print("Synced 3 new records in %.2f s [OK]" % duration)
+		return True
+
+	def test_query_after_stopped_sync(self):
+		self.battery.add_log_records(1)
+		self.sync(1)
+		serial = self.wstcan.getSerial("hex")
+		if serial != self.battery.serial:
+			raise TestException("getSerial after a sync returned %s instead of %s" % (serial, self.battery.serial))
+		print("The rest of the log was dropped before the next query [OK]")
+		return True
+
+	def test_query_after_stopped_sync_protocol2(self):
+		self.battery.add_log_records(1)
+		new_records = self.wstcan.syncLogProtocol2(self.store, 2, serial=self.battery.serial)
+		if new_records != self.battery.log[:1]:
+			raise TestException("Synced %s records over protocol 2, expected 1" % len(new_records))
+		status = self.wstcan.get_status_as_dict(2)
+		if status['serial'][0] != self.battery.serial:
+			raise TestException("Status after a protocol 2 sync has serial %s" % status['serial'][0])
+		print("The rest of the protocol 2 log was dropped before the next query [OK]")
+		return True
+
+	# The BMS dropped its oldest records, but the newest stored ones are still in the log
+	def test_wrapped_log(self):
+		stored_records = self.stored_records()
+		self.battery.add_log_records(20)
+		self.sync(20)
+		if self.stored_records() != self.battery.log[:20] + stored_records:
+			raise TestException("The store does not hold the 20 new records followed by the old ones")
+		print("A wrapped log added only the new records [OK]")
+		return True
+
+	# More records were logged than the BMS holds, so no stored record is left in the log
+	def test_fully_wrapped_log(self):
+		stored_records = self.stored_records()
+		self.battery.add_log_records(400)
+		self.sync(300)
+		if self.stored_records() != self.battery.log + stored_records:
+			raise TestException("The store does not hold the whole new log followed by the old records")
+		print("A fully wrapped log was added in front of the old records [OK]")
+		return True
+
+	def test_reset_log(self):
+		stored_records = self.stored_records()
+		self.battery.log = []
+		self.battery.add_log_records(5)
+		self.sync(5)
+		if self.stored_records() != self.battery.log + stored_records:
+			raise TestException("The store does not hold the new log followed by the old records")
+		print("A reset log was added in front of the old records [OK]")
+		return True
+
+
+if __name__ == "__main__":
+	print("Running All Tests")
+	results = LogSyncTester().run_tests()
+
+	print("\n\nTest Results: ")
+	for test, result in results.items():
+		indicator = "[FAIL]"
+		if result:
+			indicator = "[TRUE]"
+
+		print("%s %s" % (test, indicator))
+	sys.exit(0 if all(results.values()) else 1)
@@ -0,0 +1,87 @@
+import sys
+import time
+
+from wstcan.RackPoller import RackPoller
+from wstcan.SimulatedBMS import SimulatedBMS, SimulatedBus
+from wstcan.WSTCan import WSTCan
+
+
+class TestException(Exception):
+	def __init__(self, message):
+		self.message = message
+		print("[FAIL]", message)
+		super().__init__(self.message)
+
+
+# RackPoller against a simulated rack of 4 batteries. Node 6 is polled too, but no battery answers for it.
+class RackPollerTester:
+	def __init__(self):
+		batteries = [SimulatedBMS(node_id=node_id, serial="%06d" % (200000 + node_id)) for node_id in range(2, 6)]
+		self.wstcan = WSTCan(transport=SimulatedBus(batteries, latency=0.01, frame_time=0.0005))
+		self.node_ids = list(range(2, 7))
+		self.test_results = {}
+
+	def run_tests(self):
+		tests_to_run = [
+			self.test_read_snapshot,
+			self.test_background_polling]
+		for test in tests_to_run:
+			print("Running test: %s" % test.__name__)
+			try:
+				self.test_results[test.__name__] = test()
+			except TestException:
+				self.test_results[test.__name__] = False
+		return self.test_results
+
+	def check_snapshot(self, snapshot):
+		if sorted(snapshot) != self.node_ids[:-1]:
+			raise TestException("Snapshot holds nodes %s" % sorted(snapshot))
+		for node_id, status in snapshot.items():
+			if status['serial'][0] != "%06d" % (200000 + node_id):
+				raise TestException("Node %s has serial %s" % (node_id, status['serial'][0]))
+
+	def test_read_snapshot(self):
+		rack = RackPoller(self.wstcan, node_ids=self.node_ids, timeout=0.2)
+		self.check_snapshot(rack.read_snapshot())
+		if rack.missing_nodes != [6]:
+			raise TestException("Missing nodes are %s" % rack.missing_nodes)
+		if rack.latest() is not None:
+			raise TestException("read_snapshot added the snapshot to the history")
+		print("One rack refresh read all answering nodes [OK]")
+		return True
+
+	# the background thread, session handling and history come from TelemetryPoller
+	def test_background_polling(self):
+		updates = []
+		rack = RackPoller(self.wstcan, node_ids=self.node_ids, rate=4, timeout=0.2,
+											on_update=lambda node_id, status: updates.append(node_id))
+		with rack:
+			if not self.wstcan.session_active:
+				raise TestException("The poller did not open a session")
+			time.sleep(0.9)
+		if rack.is_running() or self.wstcan.session_active:
+			raise TestException("The poller did not stop or did not close its session")
+		history = rack.history()
+		if len(history) < 2 or rack.samples_taken != len(history) or rack.failed_samples:
+			raise TestException("History holds %s snapshots after %s cycles, %s failed" % (
+				len(history), rack.samples_taken, rack.failed_samples))
+		for timestamp, snapshot in history:
+			self.check_snapshot(snapshot)
+		if rack.latest() != history[-1] or sorted(set(updates)) != self.node_ids[:-1]:
+			raise TestException("latest() or on_update don't match the history")
+		print("Polled the rack %s times in the background [OK]" % len(history))
+		return True
+
+
+if __name__ == "__main__":
+	print("Running All Tests")
+	results = RackPollerTester().run_tests()
+
+	print("\n\nTest Results: ")
+	for test, result in results.items():
+		indicator = "[FAIL]"
+		if result:
+			indicator = "[TRUE]"
+
+		print("%s %s" % (test, indicator))
+	sys.exit(0 if all(results.values()) else 1)
@@ -0,0 +1,102 @@
+import socket
+import sys
+import time
+
+from pcanbasic.PCANBasic import TPCANMsg, PCAN_MESSAGE_STANDARD, PCAN_ERROR_OK, PCAN_USBBUS1, PCAN_BAUD_250K
+from wstcan.CanReceiver import CanReceiver
+from wstcan.SocketCanTransport import SocketCanTransport, CAN_FRAME, SO_TIMESTAMPING, SCM_TIMESTAMPING
+
+
+class TestException(Exception):
+	def __init__(self, message):
+		self.message = message
+		print("[FAIL]", message)
+		super().__init__(self.message)
+
+
+# Stands in for the raw CAN socket of a SocketCanTransport channel. recvmsg returns the queued frames with an
+# SO_TIMESTAMPING control message, like the kernel does.
+class FakeCanSocket:
+	def __init__(self):
+		self.frames = []  # (can_id, data, software timestamp, hardware timestamp)
+
+	def recvmsg(self, bufsize, ancbufsize):
+		if not self.frames:
+			raise BlockingIOError()
+		can_id, data, software, hardware = self.frames.pop(0)
+		timestamps = SCM_TIMESTAMPING.pack(int(software), int(software % 1 * 1e9), 0, 0, int(hardware),
+																			 int(hardware % 1 * 1e9))
+		return CAN_FRAME.pack(can_id, len(data), bytes(data)), [(socket.SOL_SOCKET, SO_TIMESTAMPING, timestamps)], 0, None
+
+	def fileno(self):
+		return -1
+
+
+def received_frame(transport, timeout=1):
+	receiver = CanReceiver(transport, PCAN_USBBUS1, idle_sleep=0.001)
+	receiver.start()
+	try:
+		return receiver.get(0x00D, timeout=timeout)
+	finally:
+		receiver.stop()
+
+
+# The frames the background receiver queues carry the receive time from the socket's ancillary data, the hardware
+# timestamp when there is one and the kernel software timestamp otherwise.
+def test_ancillary_timestamps():
+	transport = SocketCanTransport("can0")
+	fake_socket = FakeCanSocket()
+	transport._sockets[PCAN_USBBUS1.value] = fake_socket
+	for software, hardware in [(1700000000.123456, 5000.250001), (1700000001.654321, 0)]:
+		fake_socket.frames.append((0x00D, [2, 0, 1, 17, 0, 0, 0, 0], software, hardware))
+		frame = received_frame(transport)
+		expected = hardware if hardware else software
+		if frame is None or abs(frame.timestamp - expected) > 1e-6:
+			raise TestException("Frame timestamp is %s, expected %s" % (frame and frame.timestamp, expected))
+	print("Frame timestamps come from the socket's ancillary data [OK]")
+	return True
+
+
+# Frames written and read back on a real interface (eg. vcan0) get the kernel receive time
+def test_interface_timestamps(interface):
+	transport = SocketCanTransport(interface, receive_own_frames=True)
+	if transport.Initialize(PCAN_USBBUS1, PCAN_BAUD_250K) != PCAN_ERROR_OK:
+		raise TestException("Could not open %s" % interface)
+	try:
+		msg = TPCANMsg()
+		msg.ID = 0x00D
+		msg.LEN = 8
+		msg.MSGTYPE = PCAN_MESSAGE_STANDARD
+		sent = time.time()
+		transport.Write(PCAN_USBBUS1, msg)
+		frame = received_frame(transport)
+		if frame is None or abs(frame.timestamp - sent) > 0.5:
+			raise TestException("Frame timestamp is %s, sent at %s" % (frame and frame.timestamp, sent))
+	finally:
+		transport.Uninitialize(PCAN_USBBUS1)
+	print("Frames on %s have kernel timestamps [OK]" % interface)
+	return True
+
+
+# Pass an interface name (eg. vcan0) to also test on a real SocketCAN interface.
+if __name__ == "__main__":
+	print("Running All Tests")
+	results = {}
+	try:
+		results["test_ancillary_timestamps"] = test_ancillary_timestamps()
+	except TestException:
+		results["test_ancillary_timestamps"] = False
+	if len(sys.argv) > 1:
+		try:
+			results["test_interface_timestamps"] = test_interface_timestamps(sys.argv[1])
+		except TestException:
+			results["test_interface_timestamps"] = False
+
+	print("\n\nTest Results: ")
+	for test, result in results.items():
+		indicator = "[FAIL]"
+		if result:
+			indicator = "[TRUE]"
+
+		print("%s %s" % (test, indicator))
+	sys.exit(0 if all(results.values()) else 1)
@@ -0,0 +1,26 @@
+import sys
+
+from wstcan.SimulatedBMS import SimulatedBMS, SimulatedBus
+from wstcan_protocol_tester.WSTProtocolTester import WSTProtocolTester, TestException
+
+# Run with --simulated to test against a SimulatedBus where the answer to an SP write pauses 70 ms after its first frame
+# instead of a battery. Writes the serial number the battery already has.
+if __name__ == "__main__":
+	print("Running All Tests")
+	transport = None
+	if "--simulated" in sys.argv:
+		battery = SimulatedBMS()
+		battery.sp_write_reply_pause = 0.07
+		transport = SimulatedBus([battery], latency=0.05, frame_time=0.005)
+	wst_protocol_tester = WSTProtocolTester(transport=transport)
+	tests_to_run = [
+		"test_sp_write_reply_drained"]
+	results = wst_protocol_tester.run_tests(tests_to_run)
+
+	print("\n\nTest Results: ")
+	for test, result in results.items():
+		indicator = "[FAIL]"
+		if result:
+			indicator = "[TRUE]"
+
+		print("%s %s" % (test, indicator))
@@ -0,0 +1,255 @@
+import asyncio
+import time
+
+from wstcan.CanReceiver import CanFrameQueues
+from wstcan.FrameAssembly import SpPackageAssembler, P2StatusAssembler
+from wstcan.WSTCan import WSTCan, SP_FRAME_GROUP, ZERO_8BYTE_FRAME
+
+
+# asyncio front end for WSTCan. One reader task drains the PCAN channel and sorts the frames per CAN-ID and per node id
+# (like CanReceiver, but on the event loop instead of a thread), so requests to several nodes can be in flight at once.
+# SP queries share the 0x001-0x003 IDs and are therefore still done one at a time.
+#
+# 	async with AsyncWSTCan() as bms:
+# 		statuses = await asyncio.gather(bms.read_status(2), bms.read_status(3))
+#
+# The channel is kept open in a WSTCan session while started. Don't use the blocking WSTCan read methods on the same
+# WSTCan object at the same time, as they would steal frames from the reader task.
+class AsyncWSTCan:
+	def __init__(self, wstcan=None, poll_interval=0.002, event_timeout=0.1, reply_timeout=1.0, frame_spacing=None,
+							 **wstcan_kwargs):
+		self.wstcan = wstcan if wstcan is not None else WSTCan(**wstcan_kwargs)
+		self.poll_interval = poll_interval  # time to sleep when the driver queue is empty and there is no receive event
+		self.event_timeout = event_timeout  # max time to wait for the receive event before reading again anyway
+		self.reply_timeout = reply_timeout  # default seconds to wait for the next frame of a reply
+		self.frame_spacing = frame_spacing  # pause between the frames of an SP command. None follows the WSTCan bitrate
+		self.frames = None
+		self._condition = None
+		self._sp_lock = None
+		self._parameter_lock = None
+		self._node_locks = {}
+		self._reader_task = None
+		self._use_fd = True
+		self._opened_session = False
+
+	async def start(self):
+		if self._reader_task is not None:
+			return
+		if self.wstcan.receiver_running():
+			raise Exception("AsyncWSTCan cannot share the channel with a running CanReceiver thread")
+		if not self.wstcan.session_active:
+			if not self.wstcan.open_session():
+				raise Exception("Could not initialize the PCAN channel")
+			self._opened_session = True
+		if self.wstcan.pending_log_transfers:
+			# the rest of a log download stopped early. Read it before the reader task would sort it into the queues
+			await asyncio.get_event_loop().run_in_executor(None, self.wstcan.flushLogTransfers)
+		self.frames = CanFrameQueues()
+		self.frames.set_group(self.wstcan.sp_can_ids, SP_FRAME_GROUP)
+		self.frames.route_by_node_id(self.wstcan.protocol_2_ids[1])
+		self._condition = asyncio.Condition()
+		self._sp_lock = asyncio.Lock()
+		self._parameter_lock = asyncio.Lock()
+		self._node_locks = {}
+		self._reader_task = asyncio.ensure_future(self._read_frames())
+
+	async def stop(self):
+		if self._reader_task is not None:
+			self._reader_task.cancel()
+			try:
+				await self._reader_task
+			except asyncio.CancelledError:
+				pass
+			self._reader_task = None
+		if self._opened_session:
+			self.wstcan.close_session()
+			self._opened_session = False
+
+	async def __aenter__(self):
+		await self.start()
+		return self
+
+	async def __aexit__(self, exc_type, exc_value, traceback):
+		await self.stop()
+		return False
+
+	def _node_lock(self, node_id):
+		if node_id not in self._node_locks:
+			self._node_locks[node_id] = asyncio.Lock()
+		return self._node_locks[node_id]
+
+	async def _read_frames(self):
+		while True:
+			if self.wstcan.session_needs_reinit:
+				self.wstcan.initializePCAN()  # reinitializes the session channel
+			received = False
+			while True:
+				msg = self.wstcan.readFrame()
+				if not msg:
+					break
+				self.frames.put(msg)
+				received = True
+			if received:
+				async with self._condition:
+					self._condition.notify_all()
+			await self._wait_for_driver()
+
+	# Wait for the receive event descriptor to become readable. On Windows (no descriptor) or when the event loop can't
+	# watch descriptors, we poll with short sleeps instead.
+	async def _wait_for_driver(self):
+		receive_event = self.wstcan.receive_event
+		fd = receive_event.fileno() if self._use_fd and receive_event.attach() else None
+		if fd is None:
+			await asyncio.sleep(self.poll_interval)
+			return
+		loop = asyncio.get_event_loop()
+		readable = asyncio.Event()
+		try:
+			loop.add_reader(fd, readable.set)
+		except (NotImplementedError, OSError, ValueError):
+			self._use_fd = False
+			await asyncio.sleep(self.poll_interval)
+			return
+		try:
+			await asyncio.wait_for(readable.wait(), self.event_timeout)
+		except asyncio.TimeoutError:
+			pass
+		finally:
+			loop.remove_reader(fd)
+
+	async def _get(self, key, node_id=None, timeout=None, match=None):
+		timeout = self.reply_timeout if timeout is None else timeout
+		deadline = time.monotonic() + timeout
+		async with self._condition:
+			while True:
+				frame = self.frames.pop(key, node_id, match)
+				if frame is not None:
+					return frame
+				remaining = deadline - time.monotonic()
+				if remaining <= 0:
+					return None
+				try:
+					await asyncio.wait_for(self._condition.wait(), remaining)
+				except asyncio.TimeoutError:
+					pass
+
+	async def _send_sp(self, command):
+		if len(command) > 8:
+			frames = self.wstcan.splitIntoFrames(command)
+		else:
+			frames = [list(command)]
+		spacing = self.wstcan.spFrameSpacing() if self.frame_spacing is None else self.frame_spacing
+		self.wstcan.writeCANFrame(0x001, ZERO_8BYTE_FRAME)
+		await asyncio.sleep(spacing)
+		for frame in frames:
+			self.wstcan.writeCANFrame(0x002, frame)
+			await asyncio.sleep(spacing)
+		self.wstcan.writeCANFrame(0x003, ZERO_8BYTE_FRAME)
+
+	async def _read_package(self, timeout=None):
+		assembler = SpPackageAssembler()
+		while True:
+			frame = await self._get(SP_FRAME_GROUP, timeout=timeout)
+			if frame is None:
+				return False
+			if assembler.add_frame(frame.ID, frame.DATA):
+				return assembler.package(dataOnly=False)
+
+	async def query_bms(self, command, expected_packages=1, data_only=True, timeout=None):
+		"""
+		Send an SP command and wait for the response. Same results as WSTCan.queryBMS.
+		:arguments
+			command: the command payload to send to the BMS
+			expected_packages: number of packages the BMS answers with
+			data_only: strip the package header and checksum
+			timeout: seconds to wait for each frame. Defaults to reply_timeout
+		:returns
+			the response, a list of responses when expected_packages > 1 or False when nothing valid was received
+		"""
+		async with self._sp_lock:
+			self.frames.clear(SP_FRAME_GROUP)
+			await self._send_sp(command)
+			responses = []
+			for i in range(expected_packages):
+				response = await self._read_package(timeout)
+				if response and len(response) > 6 and list(command)[:3] == response[:3]:
+					responses.append(response[6:response[3] + 2] if data_only else response)
+				elif self.wstcan.debugging:
+					print("query bms response: %s " % response)
+		if len(responses) == 0:
+			return False
+		if expected_packages == 1:
+			return responses[0]
+		return responses
+
+	async def get_log(self, include_stats=False, data_only=True, timeout=None):
+		log_array = []
+		async with self._sp_lock:
+			self.frames.clear(SP_FRAME_GROUP)
+			await self._send_sp(self.wstcan.logCommand)
+			log_frame = await self._read_package(timeout)
+			while log_frame and len(log_frame) > 8:
+				if log_frame[5] != 0x09 or include_stats:
+					log_array.append(log_frame[6:39] if data_only else log_frame)
+				log_frame = await self._read_package(timeout)
+		return log_array
+
+	async def read_status(self, node_id, timeout=None):
+		node_id = int(node_id)
+		receive_id = self.wstcan.protocol_2_ids[1]
+		async with self._node_lock(node_id):
+			self.frames.clear(receive_id, node_id=node_id)
+			self.wstcan.writeCANFrame(self.wstcan.protocol_2_ids[0], [0x01, node_id, 0x00, 0x00, 0x00, 0x00, 0x00, 0x01])
+			assembler = P2StatusAssembler(node_id)
+			while True:
+				frame = await self._get(receive_id, node_id=node_id, timeout=timeout)
+				if frame is None:
+					raise Exception("ERROR 102: Could not read status data P2")
+				if assembler.add_frame(frame.DATA):
+					return assembler.data
+
+	# Parameter replies are [0xBD, node_id, 0, parameter_number, ...], so they land in the 0xBD node queue. Only the
+	# reply from node_id for parameter_number is accepted. Anything else in that queue is dropped, like a late reply to
+	# an earlier request that timed out. One parameter request is in flight at a time.
+	async def _parameter_request(self, node_id, parameter_number, payload, timeout=None):
+		node_id = int(node_id)
+		receive_id = self.wstcan.protocol_2_ids[1]
+		timeout = self.reply_timeout if timeout is None else timeout
+		async with self._node_lock(node_id):
+			async with self._parameter_lock:
+				self.frames.clear(receive_id, node_id=0xBD)
+				self.wstcan.writeCANFrame(self.wstcan.protocol_2_ids[0], payload)
+				deadline = time.monotonic() + timeout
+				while True:
+					remaining = deadline - time.monotonic()
+					if remaining <= 0:
+						return False
+					frame = await self._get(receive_id, node_id=0xBD, timeout=remaining)
+					if frame is None:
+						return False
+					if frame.DATA[1] == node_id and frame.DATA[3] == parameter_number:
+						return frame.DATA
+
+	async def read_custom_parameter(self, node_id, parameter_number, timeout=None):
+		response = await self._parameter_request(
+			node_id, parameter_number, self.wstcan.customParameterReadPayload(node_id, parameter_number), timeout)
+		return self.wstcan.customParameterValue(response) if response else False
+
+	async def write_custom_parameter(self, node_id, parameter_number, data, timeout=None):
+		payload = self.wstcan.customParameterWritePayload(node_id, parameter_number, data)
+		response = await self._parameter_request(node_id, parameter_number, payload, timeout)
+		return self.wstcan.customParameterValue(response) if response else False
+
+	async def read_custom_parameter_short_int(self, node_id, parameter_number, timeout=None):
+		assert 30 >= parameter_number >= 1
+		payload = self.wstcan.customParameterReadPayload(node_id, parameter_number, short_int=True)
+		response = await self._parameter_request(node_id, parameter_number, payload, timeout)
+		return self.wstcan.customParameterValue(response, short_int=True) if response else False
+
+	async def write_custom_parameter_short_int(self, node_id, parameter_number, data, timeout=None):
+		if not 0 <= data <= 65535:
+			raise Exception("Cannot write a value not within 0<=VALUE<=65535")
+		assert 30 >= parameter_number >= 1
+		payload = self.wstcan.customParameterWritePayload(node_id, parameter_number, data, short_int=True)
+		response = await self._parameter_request(node_id, parameter_number, payload, timeout)
+		return self.wstcan.customParameterValue(response, short_int=True) if response else False
@@ -0,0 +1,121 @@
+import threading
+
+from pcanbasic.PCANBasic import PCAN_ERROR_OK, PCAN_MESSAGE_FILTER, PCAN_FILTER_CLOSE, PCAN_MODE_STANDARD
+
+
+def cover_ranges(ranges):
+	"""
+	Merge CAN-ID ranges into the fewest ranges accepting the same IDs.
+	:arguments
+		ranges: iterable of [from_id, to_id]
+	:returns
+		sorted list of (from_id, to_id) without overlapping or adjacent ranges
+	"""
+	merged = []
+	for from_id, to_id in sorted((r[0], r[1]) for r in ranges):
+		if merged and from_id <= merged[-1][1] + 1:
+			if to_id > merged[-1][1]:
+				merged[-1] = (merged[-1][0], to_id)
+		else:
+			merged.append((from_id, to_id))
+	return merged
+
+
+def ranges_cover(cover, ranges):
+	# True if every range lies inside one range of cover (a cover_ranges result)
+	for from_id, to_id in ranges:
+		if not any(c[0] <= from_id and to_id <= c[1] for c in cover):
+			return False
+	return True
+
+
+# Keeps track of the acceptance filter programmed in the driver, so the filter is only touched when a needed CAN-ID is
+# not accepted yet. Closing the filter and adding the ranges again costs driver calls and drops the frames that arrive
+# in between, which used to happen on every read.
+#
+# The needed IDs are the base ranges (always received) plus the ranges required by operations, by owner name. Missing
+# ranges are added to the programmed filter without closing it. Ranges that are no longer needed are left open until
+# the channel is initialized again (reset), as the readers ignore frames they don't wait for anyway.
+# Call reset whenever the channel is (re)initialized or uninitialized, as the driver opens the filter again with it.
+class CanFilterManager:
+	def __init__(self, pcan, channel, mode=PCAN_MODE_STANDARD):
+		self.pcan = pcan
+		self.channel = channel
+		self.mode = mode
+		self.base_ranges = []
+		self.required = {}  # owner -> list of [from_id, to_id]
+		self.programmed = None  # cover_ranges of the ranges in the driver. None when the driver filter is open/unknown
+		self.driver_calls = 0  # SetValue/FilterMessages calls made, for diagnostics
+		self.last_error = None
+		self._lock = threading.RLock()
+
+	def set_base(self, ranges):
+		with self._lock:
+			self.base_ranges = [list(r) for r in ranges]
+
+	def require(self, owner, ranges):
+		with self._lock:
+			self.required[owner] = [list(r) for r in ranges]
+
+	def release(self, owner):
+		with self._lock:
+			self.required.pop(owner, None)
+
+	def reset(self):
+		with self._lock:
+			self.programmed = None
+
+	def needed_ranges(self):
+		with self._lock:
+			ranges = list(self.base_ranges)
+			for owner_ranges in self.required.values():
+				ranges.extend(owner_ranges)
+			return cover_ranges(ranges)
+
+	def update(self):
+		"""
+		Make the driver accept all needed ranges.
+		:returns
+			PCAN_ERROR_OK, or the driver error (also kept in last_error)
+		"""
+		with self._lock:
+			needed = self.needed_ranges()
+			if self.programmed is None:
+				return self.program(needed)
+			if ranges_cover(self.programmed, needed):
+				return PCAN_ERROR_OK
+			missing = [r for r in needed if not ranges_cover(self.programmed, [r])]
+			for from_id, to_id in missing:
+				result = self._filter_messages(from_id, to_id)
+				if result != PCAN_ERROR_OK:
+					self.programmed = None  # partly added. Program it from scratch next time
+					return result
+			self.programmed = cover_ranges(self.programmed + missing)
+			return PCAN_ERROR_OK
+
+	# Close the filter and program exactly the needed ranges, dropping ranges that are no longer needed.
+	def compact(self):
+		with self._lock:
+			return self.program(self.needed_ranges())
+
+	def program(self, ranges):
+		with self._lock:
+			self.programmed = None
+			self.driver_calls += 1
+			result = self.pcan.SetValue(self.channel, PCAN_MESSAGE_FILTER, PCAN_FILTER_CLOSE)
+			if result != PCAN_ERROR_OK:
+				self.last_error = result
+				return result
+			for from_id, to_id in ranges:
+				result = self._filter_messages(from_id, to_id)
+				if result != PCAN_ERROR_OK:
+					return result
+			self.programmed = list(ranges)
+			return PCAN_ERROR_OK
+
+	def _filter_messages(self, from_id, to_id):
+		self.driver_calls += 1
+		result = self.pcan.FilterMessages(self.channel, from_id, to_id, self.mode)
+		if result != PCAN_ERROR_OK:
+			self.last_error = result
+		return result
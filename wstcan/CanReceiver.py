@@ -0,0 +1,230 @@
+import collections
+import threading
+import time
+
+from pcanbasic.PCANBasic import PCAN_ERROR_OK, PCAN_ERROR_QRCVEMPTY
+
+# A received frame. DATA always holds all 8 data bytes as a normal list, like the old read loops returned them.
+# timestamp is the receive time in seconds given by the driver when there is one (see timestamp_seconds), otherwise
+# time.monotonic() when the frame was queued.
+CanFrame = collections.namedtuple("CanFrame", ["ID", "LEN", "DATA", "timestamp", "sequence"])
+
+
+# Seconds of a TPCANTimestamp, or None for an empty one. The clock depends on the transport: the PCAN driver counts from
+# system start, SocketCanTransport gives the hardware or kernel receive time (time.time() for kernel timestamps).
+def timestamp_seconds(timestamp):
+	microseconds = timestamp.micros + 1000 * (timestamp.millis + 0x100000000 * timestamp.millis_overflow)
+	if microseconds == 0:
+		return None
+	return microseconds / 1000000
+
+
+# Received frames sorted into queues. Frames are queued per CAN-ID (or per group of CAN-IDs that must keep their
+# relative order, like the SP 0x001-0x003 frames). CAN-IDs registered with route_by_node_id are additionally split per
+# node id (DATA[0]), so a reader waiting for one node never throws away the frames of another node.
+# Not thread safe on its own. CanReceiver and AsyncWSTCan guard it with their own lock/condition.
+class CanFrameQueues:
+	def __init__(self, max_queued_frames=1024):
+		self.max_queued_frames = max_queued_frames  # per queue. Oldest frames are dropped when full.
+		self.groups = {}
+		self.node_routed_ids = set()
+		self._queues = {}
+		self._sequence = 0
+
+	# frames from all can_ids in a group share one queue, so their relative order is kept.
+	def set_group(self, can_ids, group):
+		for can_id in can_ids:
+			self.groups[can_id] = group
+
+	# split the frames of can_id into one queue per node id (DATA[0])
+	def route_by_node_id(self, can_id, enabled=True):
+		if enabled:
+			self.node_routed_ids.add(can_id)
+		else:
+			self.node_routed_ids.discard(can_id)
+
+	def route_key(self, can_id, data):
+		group = self.groups.get(can_id, can_id)
+		if can_id in self.node_routed_ids:
+			return group, data[0]
+		return group, None
+
+	# queue a TPCANMsg (or anything with ID, LEN and DATA) and return it as a CanFrame
+	def put(self, msg, timestamp=None):
+		data = list(msg.DATA)
+		self._sequence += 1
+		frame = CanFrame(msg.ID, msg.LEN, data, time.monotonic() if timestamp is None else timestamp, self._sequence)
+		key = self.route_key(msg.ID, data)
+		queue = self._queues.get(key)
+		if queue is None:
+			queue = collections.deque(maxlen=self.max_queued_frames)
+			self._queues[key] = queue
+		queue.append(frame)
+		return frame
+
+	# sequence number of the newest queued frame. Frames queued later have a higher sequence.
+	def last_sequence(self):
+		return self._sequence
+
+	# key is either a CAN-ID or a group name given to set_group.
+	def _candidate_queues(self, key, node_id):
+		group = self.groups.get(key, key)
+		queues = []
+		for (queue_group, queue_node_id), queue in self._queues.items():
+			if queue_group != group:
+				continue
+			if node_id is not None and queue_node_id is not None and queue_node_id != node_id:
+				continue
+			queues.append(queue)
+		return queues
+
+	@staticmethod
+	def _accepts(frame, only_id, node_id, match):
+		if only_id is not None and frame.ID != only_id:
+			return False
+		if node_id is not None and frame.DATA[0] != node_id:
+			return False
+		if match is not None and not match(frame):
+			return False
+		return True
+
+	def has_frame(self, key, node_id=None):
+		only_id = key if self.groups.get(key, key) != key else None
+		for queue in self._candidate_queues(key, node_id):
+			for frame in queue:
+				if self._accepts(frame, only_id, node_id, None):
+					return True
+		return False
+
+	# remove and return the oldest frame for a CAN-ID or group, or None.
+	def pop(self, key, node_id=None, match=None):
+		only_id = key if self.groups.get(key, key) != key else None  # a single CAN-ID inside a group
+		best_queue = None
+		best_index = None
+		best_frame = None
+		for queue in self._candidate_queues(key, node_id):
+			for index, frame in enumerate(queue):
+				if not self._accepts(frame, only_id, node_id, match):
+					continue
+				if best_frame is None or frame.sequence < best_frame.sequence:
+					best_queue, best_index, best_frame = queue, index, frame
+				break  # frames in a queue are in order, so the first hit is the oldest in that queue
+		if best_frame is not None:
+			del best_queue[best_index]
+		return best_frame
+
+	def clear(self, key=None, node_id=None):
+		if key is None:
+			self._queues.clear()
+			return
+		only_id = key if self.groups.get(key, key) != key else None
+		for queue in self._candidate_queues(key, node_id):
+			if node_id is None and only_id is None:
+				queue.clear()
+				continue
+			for frame in list(queue):
+				if self._accepts(frame, only_id, node_id, None):
+					queue.remove(frame)
+
+
+# Background receiver that drains a PCAN channel continuously and sorts the frames into CanFrameQueues.
+class CanReceiver:
+	def __init__(self, pcan, channel, max_queued_frames=1024, idle_sleep=0.001, error_sleep=0.05, on_error=None,
+							 receive_event=None, event_timeout=0.1):
+		self.pcan = pcan
+		self.channel = channel
+		self.on_error = on_error  # called with the PCAN status when a read fails with anything but an empty queue
+		self.receive_event = receive_event  # ReceiveEvent to sleep on while the driver queue is empty
+		self.event_timeout = event_timeout  # max time to wait for the receive event before reading again anyway
+		self.idle_sleep = idle_sleep  # time to sleep when the driver queue is empty and there is no receive event
+		self.error_sleep = error_sleep  # time to wait when the channel reports an error (eg. not initialized)
+		self.frames = CanFrameQueues(max_queued_frames)
+		self.last_error = None
+		self._condition = threading.Condition()
+		self._running = False
+		self._thread = None
+
+	def start(self):
+		if self.is_running():
+			return
+		self._running = True
+		self._thread = threading.Thread(target=self._run, name="CanReceiver", daemon=True)
+		self._thread.start()
+
+	def stop(self, timeout=1):
+		self._running = False
+		if self._thread is not None:
+			self._thread.join(timeout)
+			self._thread = None
+		with self._condition:
+			self._condition.notify_all()
+
+	def is_running(self):
+		return self._running and self._thread is not None and self._thread.is_alive()
+
+	def set_group(self, can_ids, group):
+		with self._condition:
+			self.frames.set_group(can_ids, group)
+
+	def route_by_node_id(self, can_id, enabled=True):
+		with self._condition:
+			self.frames.route_by_node_id(can_id, enabled)
+
+	def _run(self):
+		while self._running:
+			read_result = self.pcan.Read(self.channel)
+			if read_result[0] == PCAN_ERROR_OK:
+				with self._condition:
+					self.frames.put(read_result[1], timestamp=timestamp_seconds(read_result[2]))
+					self._condition.notify_all()
+			elif read_result[0] == PCAN_ERROR_QRCVEMPTY:
+				self._wait_for_frames()
+			else:
+				# typically the channel is not initialized (yet). We keep trying until stopped.
+				self.last_error = read_result[0]
+				if self.on_error is not None:
+					self.on_error(read_result[0])
+				time.sleep(self.error_sleep)
+
+	def _wait_for_frames(self):
+		if self.receive_event is not None:
+			self.receive_event.wait(self.event_timeout, fallback_sleep=self.idle_sleep)
+		else:
+			time.sleep(self.idle_sleep)
+
+	def get(self, key, node_id=None, timeout=1.0, match=None):
+		"""
+		Get the oldest received frame for a CAN-ID or group and remove it from the queue.
+		:arguments
+			key: CAN-ID or group name
+			node_id: only return frames where DATA[0] is node_id
+			timeout: seconds to wait for a frame
+			match: optional function taking a CanFrame and returning True if it should be returned
+		:returns
+			a CanFrame or None if nothing arrived before the timeout
+		"""
+		deadline = time.monotonic() + timeout
+		with self._condition:
+			while True:
+				frame = self.frames.pop(key, node_id, match)
+				if frame is not None:
+					return frame
+				remaining = deadline - time.monotonic()
+				if remaining <= 0:
+					return None
+				self._condition.wait(remaining)
+
+	# Wait until a frame for a CAN-ID or group is queued, without removing it. Returns False on timeout.
+	def wait_for_frame(self, key, node_id=None, timeout=1.0):
+		deadline = time.monotonic() + timeout
+		with self._condition:
+			while not self.frames.has_frame(key, node_id):
+				remaining = deadline - time.monotonic()
+				if remaining <= 0:
+					return False
+				self._condition.wait(remaining)
+			return True
+
+	def clear(self, key=None, node_id=None):
+		with self._condition:
+			self.frames.clear(key, node_id)
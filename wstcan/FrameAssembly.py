@@ -0,0 +1,76 @@
+# Assemblers that build SP packages and protocol 2 status data from single CAN frames, independent of where the frames
+# come from (PCAN polling, the background receiver or the asyncio reader).
+
+
+# An SP package is sent as one 0x001 frame, a number of 0x002 frames carrying the package and one 0x003 frame.
+class SpPackageAssembler:
+	def __init__(self):
+		self.data = []
+		self.rcv001 = False
+		self.rcv002 = False
+		self.complete = False
+
+	# returns True when the package is complete
+	def add_frame(self, can_id, data):
+		if can_id == 0x001:
+			self.rcv001 = True
+		elif can_id == 0x002 and self.rcv001:
+			self.rcv002 = True
+			self.data.extend(data)
+		elif can_id == 0x003 and self.rcv002:
+			self.complete = True
+		return self.complete
+
+	def package(self, dataOnly=True, offset_start=0, offset_end=0):
+		if dataOnly:
+			return self.data[6 + offset_start:self.data[3] + 2 + offset_end]
+		return self.data
+
+
+# Protocol 2 status from one node. Frame 0 is a header with the number of frames in DATA[3]. Frame 1 carries 5 data
+# bytes in DATA[2:7] and the following frames 6 bytes in DATA[1:7]. The frame index is in DATA[7].
+# Each frame is written straight into a preallocated bytearray at the offset of its index, so frames may arrive out of
+# order or twice. The status is complete as soon as the header and every data frame it announces have arrived. data is
+# then trimmed (in place) to the status length. A header announcing a single frame completes an empty status at once.
+class P2StatusAssembler:
+	MAX_LENGTH = 5 + 253 * 6  # DATA[3] of the header is one byte
+
+	def __init__(self, node_id):
+		self.node_id = node_id
+		self.total_frames = 0
+		self.data = bytearray(self.MAX_LENGTH)
+		self.length = 0  # status length, known from the header
+		self.complete = False
+		self._received = bytearray(256)  # 1 at the index of every data frame received
+		self._frames_received = 0
+
+	# returns True when all frames have been received
+	def add_frame(self, data):
+		if self.complete or data[0] != self.node_id:
+			return self.complete
+		index = data[7]
+		if index == 0:
+			# a header announcing no frames at all (not even itself) is invalid and ignored, so a later valid header can
+			# still start the status
+			if data[1] != 0 or data[2] != 1 or self.total_frames or data[3] == 0:
+				return False
+			self.total_frames = data[3]
+			if self.total_frames == 1:
+				# the header is the only frame: an empty status, complete right away
+				del self.data[:]
+				self.complete = True
+				return True
+			self.length = 5 + (self.total_frames - 2) * 6
+		elif not self._received[index]:
+			self._received[index] = 1
+			self._frames_received += 1
+			if index == 1:
+				self.data[0:5] = data[2:7]
+			else:
+				offset = 5 + (index - 2) * 6
+				self.data[offset:offset + 6] = data[1:7]
+		if self.total_frames and self._frames_received >= self.total_frames - 1 \
+			and self._received.count(1, 1, self.total_frames) == self.total_frames - 1:
+			del self.data[self.length:]
+			self.complete = True
+		return self.complete
@@ -0,0 +1,241 @@
+import bisect
+import collections
+import struct
+
+try:
+	import numpy  # optional. Only needed for decode_columns
+except ImportError:
+	numpy = None
+
+# Layout of the protocol 2 status data (readStatus), as (name, struct format) with None as name for unused bytes. Multi
+# byte values are big endian. The cell voltages (one word per cell from byte 24, ending at the first 0) sit between the
+# header and the tail.
+_STATUS_HEADER = [
+	('pack_voltage', 'H'), ('charge_current', 'H'), ('discharge_current', 'H'), ('soc', 'B'), ('charge_time_left', 'B'),
+	('remaining_capacity', 'H'), ('soh', 'B'), ('firmware_version', 'B'), ('full_capacity', 'H'), ('cycles', 'H'),
+	('status_code', 'H'), ('cell_1_temperature', 'b'), ('cell_2_temperature', 'b'), (None, '2x'),
+	('mosfet_temperature', 'b'), ('ambient_temperature', 'b')]
+CELL_VOLTAGES_OFFSET = 24
+MAX_CELLS = 24  # byte 72 is the CP8 value
+_STATUS_TAIL_OFFSET = 72
+_STATUS_TAIL = [
+	('cp8', 'B'), (None, '2x'), ('alarm_code', 'B'), (None, '2x'), ('heating', 'B'), ('heating_enabled', 'B'), (None, 'x'),
+	('serial', '3s')]
+STATUS_MIN_LENGTH = 84  # up to the end of the serial number
+
+
+def _compile_layout(layout):
+	return struct.Struct('>' + ''.join(fmt for name, fmt in layout)), [name for name, fmt in layout if name is not None]
+
+
+_STATUS_HEADER_STRUCT = _compile_layout(_STATUS_HEADER)
+_STATUS_TAIL_STRUCT = _compile_layout(_STATUS_TAIL)
+_CELL_VOLTAGES_STRUCT = struct.Struct('>%dH' % MAX_CELLS)
+
+# The status flag is the highest of these values not above the status code, the alarm flag likewise for the alarm byte
+_STATUS_FLAGS = [(0x0000, 'Idle'), (0x0001, 'Discharge'), (0x0002, 'Charge'), (0x0004, 'OV'), (0x0008, 'UV'),
+								 (0x0010, 'COC'), (0x0020, 'DOC'), (0x0040, 'DOT'), (0x0080, 'DUT'), (0x0200, 'SC'), (0x0400, 'COT'),
+								 (0x0800, 'CUT')]
+_STATUS_FLAG_CODES = [code for code, flag in _STATUS_FLAGS]
+_ALARM_FLAGS = [(0x00, 'Unbalanced'), (0x02, 'Cell or Pack OV'), (0x04, 'Cell or Pack UV'), (0x08, 'Charge Current High'),
+								(0x10, 'Discharge Current High'), (0x20, 'Any over temperature'), (0x40, 'Any under temperature'),
+								(0x80, 'Over temperature charge')]
+_ALARM_FLAG_BY_CODE = [[flag for code, flag in _ALARM_FLAGS if code <= alarm_code][-1] for alarm_code in range(256)]
+
+_CP8_TEXTS = {0: 'CP8 OFF', 1: 'CP8 ON', 2: 'OV Cycle', 3: 'OV Lifetime', 4: 'UV Cycle', 5: 'UV Lifetime',
+							6: '300mV Cell Diff', 7: '<2.65V/2.35V', 8: '>4.35V/3.8V', 9: 'SC Cycle', 10: 'SC Lifetime', 11: 'DOC Cycle',
+							12: 'DOC Lifetime', 13: 'COC Cycle', 14: 'COC Lifetime', 15: 'DOT Cycle', 16: 'DOT Lifetime',
+							17: 'DUT Cycle', 18: 'DUT Lifetime', 19: 'COT Cycle', 20: 'COT Lifetime', 21: 'CUT Cycle',
+							22: 'CUT Lifetime'}
+_CP8_TEXTS.update(dict((value + 100, "Cascaded CP8: %s" % text) for value, text in list(_CP8_TEXTS.items())))
+
+_PROBE_NOTE_UNIT = "C - Please notice that not all BMS's have this probe. It will show 0C in case it is not present!"
+_CELL_VOLTAGE_NAMES = ['Cell ' + str(cell) + " Voltage: " for cell in range(1, MAX_CELLS + 1)]
+_CELL_VOLTAGE_KEYS = [name.lower().replace(" ", "_") for name in _CELL_VOLTAGE_NAMES]
+
+# Decoded protocol 2 status. Voltages in V, currents in A, capacities in Ah, temperatures in C, cell voltages in mV.
+# charge_time_left (hours) is None when the battery is not charging. heating and heating_enabled are booleans.
+P2Status = collections.namedtuple("P2Status", [
+	'serial', 'firmware_version', 'pack_voltage', 'charge_current', 'discharge_current', 'soc', 'charge_time_left',
+	'full_capacity', 'remaining_capacity', 'soh', 'cycles', 'status_code', 'status_flags', 'cell_1_temperature',
+	'cell_2_temperature', 'mosfet_temperature', 'ambient_temperature', 'cell_voltages', 'cp8', 'cp8_text', 'alarm_code',
+	'alarm_flags', 'heating', 'heating_enabled'])
+
+# numpy layout of the first STATUS_MIN_LENGTH bytes, for decode_columns
+_STATUS_DTYPE_FIELDS = [
+	('pack_voltage', '>u2'), ('charge_current', '>u2'), ('discharge_current', '>u2'), ('soc', 'u1'),
+	('charge_time_left', 'u1'), ('remaining_capacity', '>u2'), ('soh', 'u1'), ('firmware_version', 'u1'),
+	('full_capacity', '>u2'), ('cycles', '>u2'), ('status_code', '>u2'), ('cell_1_temperature', 'i1'),
+	('cell_2_temperature', 'i1'), ('_reserved_20', 'u1', (2,)), ('mosfet_temperature', 'i1'),
+	('ambient_temperature', 'i1'), ('cell_voltages', '>u2', (MAX_CELLS,)), ('cp8', 'u1'), ('_reserved_73', 'u1', (2,)),
+	('alarm_code', 'u1'), ('_reserved_76', 'u1', (2,)), ('heating', 'u1'), ('heating_enabled', 'u1'),
+	('_reserved_80', 'u1'), ('serial', 'u1', (3,))]
+
+
+def status_flags(status_code):
+	return [_STATUS_FLAGS[bisect.bisect_right(_STATUS_FLAG_CODES, status_code) - 1][1]]
+
+
+def alarm_flags(alarm_code):
+	return [_ALARM_FLAG_BY_CODE[alarm_code]]
+
+
+# Decodes the status data of readStatus with precompiled structs into a P2Status, and gives the getStatus list and
+# get_status_as_dict views of it.
+class P2StatusDecoder:
+	def decode(self, status_data):
+		"""
+		:arguments
+			status_data: status data from readStatus (bytes-like or list of ints, at least STATUS_MIN_LENGTH bytes)
+		:returns
+			P2Status
+		"""
+		if not isinstance(status_data, (bytes, bytearray, memoryview)):
+			status_data = bytes(status_data)
+		if len(status_data) < STATUS_MIN_LENGTH:
+			raise Exception("Status data is %s bytes, expected at least %s" % (len(status_data), STATUS_MIN_LENGTH))
+		header = _STATUS_HEADER_STRUCT[0].unpack_from(status_data)
+		cp8, alarm_code, heating, heating_enabled, serial = _STATUS_TAIL_STRUCT[0].unpack_from(status_data,
+																																												 _STATUS_TAIL_OFFSET)
+		cell_voltages = _CELL_VOLTAGES_STRUCT.unpack_from(status_data, CELL_VOLTAGES_OFFSET)
+		if 0 in cell_voltages:
+			cell_voltages = cell_voltages[:cell_voltages.index(0)]
+		pack_voltage, charge_current, discharge_current, soc, charge_time_left, remaining_capacity, soh, \
+			firmware_version, full_capacity, cycles, status_code, cell_1_temperature, cell_2_temperature, \
+			mosfet_temperature, ambient_temperature = header
+		return P2Status(
+			serial=serial.hex(),
+			firmware_version=firmware_version / 10,
+			pack_voltage=pack_voltage / 10,
+			charge_current=charge_current / 10,
+			discharge_current=discharge_current / 10,
+			soc=soc,
+			charge_time_left=charge_time_left / 10 if charge_current > 0 else None,
+			full_capacity=float(full_capacity),
+			remaining_capacity=float(remaining_capacity),
+			soh=soh,
+			cycles=cycles,
+			status_code=status_code,
+			status_flags=status_flags(status_code),
+			cell_1_temperature=cell_1_temperature,
+			cell_2_temperature=cell_2_temperature,
+			mosfet_temperature=mosfet_temperature,
+			ambient_temperature=ambient_temperature,
+			cell_voltages=cell_voltages,
+			cp8=cp8,
+			cp8_text=_CP8_TEXTS.get(cp8, "Unkown CP8 Value: %s" % cp8),
+			alarm_code=alarm_code,
+			alarm_flags=alarm_flags(alarm_code),
+			heating=heating == 1,
+			heating_enabled=heating_enabled == 1)
+
+	def status_list(self, status):
+		"""
+		The [name, value, unit] list of getStatus.
+		Cell 2, Mosfet and Ambient are shown as the unsigned byte there, like getStatus always did.
+		"""
+		status_list = [
+			['Serial', status.serial, ''],
+			['Firmware Version', status.firmware_version, ''],
+			['Pack Voltage', status.pack_voltage, "V"],
+			['Charge Current', status.charge_current, 'A'],
+			['Discharge Current', status.discharge_current, 'A'],
+			['SoC', status.soc, '%'],
+			['Estimated Charge Time Left', status.charge_time_left, 'H'] if status.charge_time_left is not None else
+			['Estimated Charge Time Left', "Not Charging", ''],
+			['Full Capacity', status.full_capacity, 'Ah'],
+			['Remaining Capacity', status.remaining_capacity, 'Ah'],
+			['SoH', status.soh, '%'],
+			['Cycles', status.cycles, '  - @80% DoD Cycles'],
+			['Status Flags', status.status_flags, ''],
+			['Cell 1', status.cell_1_temperature, 'C'],
+			['Cell 2', status.cell_2_temperature & 0xFF, _PROBE_NOTE_UNIT if status.cell_2_temperature == 0 else 'C'],
+			['Mosfet', status.mosfet_temperature & 0xFF, _PROBE_NOTE_UNIT if status.mosfet_temperature == 0 else 'C'],
+			['Ambient', status.ambient_temperature & 0xFF, _PROBE_NOTE_UNIT if status.ambient_temperature == 0 else 'C']]
+		for cell, cell_voltage in enumerate(status.cell_voltages):
+			status_list.append([_CELL_VOLTAGE_NAMES[cell], cell_voltage, "mV"])
+		status_list.append(['CP8 Flags', status.cp8_text, ''])
+		status_list.append(['Alarm Flags', status.alarm_flags, ''])
+		status_list.append(['Heating System', 'Enabled' if status.heating_enabled else 'Disabled', ''])
+		status_list.append(['Currently Heating', 'True' if status.heating else 'False', ''])
+		return status_list
+
+	# {name: [value, unit]} of get_status_as_dict: the names of status_list in lower case with spaces as _
+	def status_dict(self, status):
+		status_dict = {
+			'serial': [status.serial, ''],
+			'firmware_version': [status.firmware_version, ''],
+			'pack_voltage': [status.pack_voltage, "V"],
+			'charge_current': [status.charge_current, 'A'],
+			'discharge_current': [status.discharge_current, 'A'],
+			'soc': [status.soc, '%'],
+			'estimated_charge_time_left': [status.charge_time_left, 'H'] if status.charge_time_left is not None else
+			["Not Charging", ''],
+			'full_capacity': [status.full_capacity, 'Ah'],
+			'remaining_capacity': [status.remaining_capacity, 'Ah'],
+			'soh': [status.soh, '%'],
+			'cycles': [status.cycles, '  - @80% DoD Cycles'],
+			'status_flags': [status.status_flags, ''],
+			'cell_1': [status.cell_1_temperature, 'C'],
+			'cell_2': [status.cell_2_temperature & 0xFF, _PROBE_NOTE_UNIT if status.cell_2_temperature == 0 else 'C'],
+			'mosfet': [status.mosfet_temperature & 0xFF, _PROBE_NOTE_UNIT if status.mosfet_temperature == 0 else 'C'],
+			'ambient': [status.ambient_temperature & 0xFF, _PROBE_NOTE_UNIT if status.ambient_temperature == 0 else 'C']}
+		for cell, cell_voltage in enumerate(status.cell_voltages):
+			status_dict[_CELL_VOLTAGE_KEYS[cell]] = [cell_voltage, "mV"]
+		status_dict['cp8_flags'] = [status.cp8_text, '']
+		status_dict['alarm_flags'] = [status.alarm_flags, '']
+		status_dict['heating_system'] = ['Enabled' if status.heating_enabled else 'Disabled', '']
+		status_dict['currently_heating'] = ['True' if status.heating else 'False', '']
+		return status_dict
+
+	def decode_columns(self, status_snapshots):
+		"""
+		Decode many status snapshots at once with numpy. Gives the values of decode as one array per field.
+		:arguments
+			status_snapshots: list of status data from readStatus
+		:returns
+			dict of field name: numpy array. cell_voltages is an (n, MAX_CELLS) array, 0 after the last cell. serial is
+			the serial of decode as an integer, or -1 if it has hex digits above 9. status_flags, alarm_flags and cp8_text
+			are left out. charge_time_left is NaN when not charging. heating and heating_enabled are booleans.
+		"""
+		if numpy is None:
+			raise Exception("numpy is required to decode status snapshots as columns")
+		buffer = bytearray()
+		for status_data in status_snapshots:
+			if len(status_data) < STATUS_MIN_LENGTH:
+				raise Exception("Status data is %s bytes, expected at least %s" % (len(status_data), STATUS_MIN_LENGTH))
+			buffer += bytes(status_data[:STATUS_MIN_LENGTH])
+		records = numpy.frombuffer(bytes(buffer), dtype=numpy.dtype(_STATUS_DTYPE_FIELDS))
+
+		cell_voltages = records['cell_voltages'].astype(numpy.uint16)
+		# everything from the first 0 on is not a cell
+		cell_voltages[numpy.cumsum(cell_voltages == 0, axis=1) > 0] = 0
+		serial_bytes = records['serial'].astype(numpy.int64)
+		high_nibbles = serial_bytes >> 4
+		low_nibbles = serial_bytes & 0x0F
+		serial = ((high_nibbles * 10 + low_nibbles) * numpy.array([10000, 100, 1])).sum(axis=1)
+
+		columns = {}
+		columns['serial'] = numpy.where(numpy.all((high_nibbles < 10) & (low_nibbles < 10), axis=1), serial, -1)
+		columns['firmware_version'] = records['firmware_version'] / 10
+		columns['pack_voltage'] = records['pack_voltage'] / 10
+		columns['charge_current'] = records['charge_current'] / 10
+		columns['discharge_current'] = records['discharge_current'] / 10
+		columns['soc'] = records['soc']
+		columns['charge_time_left'] = numpy.where(records['charge_current'] > 0, records['charge_time_left'] / 10, numpy.nan)
+		columns['full_capacity'] = records['full_capacity'].astype(numpy.float64)
+		columns['remaining_capacity'] = records['remaining_capacity'].astype(numpy.float64)
+		columns['soh'] = records['soh']
+		columns['cycles'] = records['cycles']
+		columns['status_code'] = records['status_code']
+		columns['cell_1_temperature'] = records['cell_1_temperature']
+		columns['cell_2_temperature'] = records['cell_2_temperature']
+		columns['mosfet_temperature'] = records['mosfet_temperature']
+		columns['ambient_temperature'] = records['ambient_temperature']
+		columns['cell_voltages'] = cell_voltages
+		columns['cell_count'] = numpy.count_nonzero(cell_voltages, axis=1)
+		columns['cp8'] = records['cp8']
+		columns['alarm_code'] = records['alarm_code']
+		columns['heating'] = records['heating'] == 1
+		columns['heating_enabled'] = records['heating_enabled'] == 1
+		return columns
@@ -0,0 +1,88 @@
+import time
+
+from wstcan.FrameAssembly import P2StatusAssembler
+from wstcan.TelemetryPoller import TelemetryPoller
+
+
+# Reads the protocol 2 status of every node in a rack at once. The status request goes out to all nodes in one burst
+# and the interleaved replies are sorted into one P2StatusAssembler per node by the node id in DATA[0], so a rack
+# refresh takes about as long as the slowest node instead of the sum of all nodes.
+#
+# A snapshot is {node_id: status} with the nodes that answered within timeout. Nodes that did not answer are in
+# missing_nodes of the last cycle. status is parsed like get_status_as_dict, or the raw status data with parse=False.
+# The background thread, the session and the history are those of TelemetryPoller, with a snapshot as the sample.
+#
+# 	rack = RackPoller(wstcan, node_ids=range(2, 18))
+# 	snapshot = rack.read_snapshot()
+# 	for node_id, status in rack.iter_cycle():  # per node, as soon as its status is complete
+# 		...
+# 	rack.start(rate=2)  # or poll in the background and use rack.latest() / rack.history()
+class RackPoller(TelemetryPoller):
+	def __init__(self, wstcan, node_ids=None, rate=1.0, timeout=0.3, parse=True, capacity=600, on_update=None,
+							 start_receiver=True):
+		super().__init__(wstcan, rate=rate, capacity=capacity, parse=parse, start_receiver=start_receiver)
+		self.node_ids = None if node_ids is None else [int(node_id) for node_id in node_ids]  # None: scan on first use
+		self.timeout = timeout  # seconds to wait for the replies of one cycle
+		self.on_update = on_update  # optional function(node_id, status) called for every completed node
+		self.missing_nodes = []
+		self.cycles = 0
+
+	def discover_nodes(self):
+		self.node_ids = self.wstcan.getAvailableNodeIDs(pipelined=True)
+		return self.node_ids
+
+	def iter_cycle(self, node_ids=None):
+		"""
+		Request the status of all nodes and yield them as they complete. missing_nodes is set when the cycle ends.
+		:arguments
+			node_ids: nodes to read. Defaults to the poller's node ids
+		:returns
+			generator of (node_id, status)
+		"""
+		if node_ids is None:
+			node_ids = self.node_ids if self.node_ids is not None else self.discover_nodes()
+		wstcan = self.wstcan
+		wstcan.initializePCAN()
+		assemblers = {}
+		wstcan.emptyQueue(can_ids=[wstcan.protocol_2_ids[1]])
+		for node_id in node_ids:
+			assemblers[node_id] = P2StatusAssembler(node_id)
+			wstcan.writeCANFrame(wstcan.protocol_2_ids[0], [0x01, node_id, 0x00, 0x00, 0x00, 0x00, 0x00, 0x01])
+		pending = len(assemblers)
+		deadline = time.monotonic() + self.timeout
+		try:
+			while pending > 0:
+				remaining = deadline - time.monotonic()
+				if remaining <= 0:
+					break
+				data = wstcan.readP2Frame(remaining)
+				if data is None:
+					break
+				assembler = assemblers.get(data[0])
+				if assembler is None or assembler.complete:
+					continue
+				if assembler.add_frame(data):
+					pending -= 1
+					status = self.parse_status(assembler.data) if self.parse else assembler.data
+					if self.on_update is not None:
+						self.on_update(assembler.node_id, status)
+					yield assembler.node_id, status
+		finally:
+			self.missing_nodes = [node_id for node_id, assembler in assemblers.items() if not assembler.complete]
+			wstcan.uninitializePCAN()
+
+	def parse_status(self, status_data):
+		decoder = self.wstcan.p2_status_decoder
+		return decoder.status_dict(decoder.decode(status_data))
+
+	# One rack refresh. Returns {node_id: status} of the nodes that answered. Unlike poll_once, the snapshot is not added
+	# to the history and errors are raised.
+	def read_snapshot(self, node_ids=None):
+		snapshot = {}
+		for node_id, status in self.iter_cycle(node_ids):
+			snapshot[node_id] = status
+		self.cycles += 1
+		return snapshot
+
+	def read_sample(self):
+		return self.read_snapshot()
@@ -0,0 +1,87 @@
+import ctypes
+import platform
+import select
+import time
+
+from pcanbasic.PCANBasic import PCAN_ERROR_OK, PCAN_RECEIVE_EVENT
+
+
+# Wraps the PCAN receive event, so readers can sleep until the driver has queued a frame instead of polling with sleeps.
+# Linux: GetValue(PCAN_RECEIVE_EVENT) returns a file descriptor, which is readable while frames are in the queue.
+# Windows: an auto reset event is created and handed to the driver with SetValue(PCAN_RECEIVE_EVENT).
+# When no event can be registered (channel not initialized, old driver, other platforms) wait() falls back to sleeping.
+class ReceiveEvent:
+	def __init__(self, pcan, channel):
+		self.pcan = pcan
+		self.channel = channel
+		self.is_windows = platform.system() == 'Windows'
+		self.enabled = True
+		self._fd = None
+		self._handle = None
+		self._attach_failed = False
+
+	def available(self):
+		return self._fd is not None or self._handle is not None
+
+	def fileno(self):
+		return self._fd
+
+	def attach(self):
+		if self.available():
+			return True
+		if not self.enabled or self._attach_failed:
+			return False
+		try:
+			if self.is_windows:
+				kernel32 = ctypes.windll.kernel32
+				handle = kernel32.CreateEventW(None, False, False, None)
+				if handle and self.pcan.SetValue(self.channel, PCAN_RECEIVE_EVENT, handle) == PCAN_ERROR_OK:
+					self._handle = handle
+				elif handle:
+					kernel32.CloseHandle(handle)
+			else:
+				result = self.pcan.GetValue(self.channel, PCAN_RECEIVE_EVENT)
+				if result[0] == PCAN_ERROR_OK and result[1] > 0:
+					self._fd = result[1]
+		except Exception:
+			pass
+		if not self.available():
+			self._attach_failed = True  # don't ask the driver again until the channel is reinitialized
+		return self.available()
+
+	def detach(self):
+		if self._handle is not None:
+			try:
+				self.pcan.SetValue(self.channel, PCAN_RECEIVE_EVENT, 0)
+				ctypes.windll.kernel32.CloseHandle(self._handle)
+			except Exception:
+				pass
+		self._handle = None
+		self._fd = None
+
+	# Must be called whenever the channel is (re)initialized or uninitialized, as the driver drops the event with it.
+	def reset(self):
+		self.detach()
+		self._attach_failed = False
+
+	def wait(self, timeout, fallback_sleep=None):
+		"""
+		Wait until the driver signals a received frame.
+		:arguments
+			timeout: max seconds to wait for the event
+			fallback_sleep: seconds to sleep instead when no event is available. Defaults to timeout.
+		:returns
+			True if the event was signalled, False on timeout or when sleeping instead.
+		"""
+		if self.attach():
+			try:
+				if self._fd is not None:
+					readable, _, _ = select.select([self._fd], [], [], timeout)
+					return len(readable) > 0
+				if self._handle is not None:
+					return ctypes.windll.kernel32.WaitForSingleObject(self._handle, int(timeout * 1000)) == 0
+			except (OSError, ValueError):
+				# the descriptor went away with the channel. Sleep this time and register again next time.
+				self.reset()
+		time.sleep(timeout if fallback_sleep is None else fallback_sleep)
+		return False
@@ -0,0 +1,229 @@
+import collections
+import heapq
+import threading
+import time
+
+from pcanbasic.PCANBasic import TPCANMsg, TPCANTimestamp, PCAN_MESSAGE_STANDARD, PCAN_ERROR_OK, PCAN_ERROR_QRCVEMPTY, \
+	PCAN_ERROR_INITIALIZE, PCAN_ERROR_ILLPARAMTYPE
+
+# One frame of a CAN trace. timestamp is in seconds from the start of the trace, direction is "Rx" or "Tx".
+TraceFrame = collections.namedtuple("TraceFrame", ["timestamp", "direction", "ID", "DATA"])
+
+TRACE_HEADER = "# WSTCan CAN trace: seconds direction id(hex) length data(hex)"
+
+
+# Trace files have one frame per line, eg. "0.012345 Tx 002 8 EA D1 01 04 FF 02 F9 F5". Lines starting with # are
+# comments.
+def load_trace(file_path):
+	frames = []
+	with open(file_path, "r") as f:
+		for line in f:
+			line = line.strip()
+			if len(line) == 0 or line.startswith("#"):
+				continue
+			fields = line.split()
+			length = int(fields[3])
+			data = [int(value, 16) for value in fields[4:4 + length]]
+			frames.append(TraceFrame(float(fields[0]), fields[1].capitalize(), int(fields[2], 16), data))
+	return frames
+
+
+def save_trace(frames, file_path):
+	with open(file_path, "w") as f:
+		f.write(TRACE_HEADER + "\n")
+		for frame in frames:
+			f.write(format_trace_frame(frame) + "\n")
+
+
+def format_trace_frame(frame):
+	data = " ".join("%02X" % value for value in frame.DATA)
+	return ("%.6f %s %03X %d %s" % (frame.timestamp, frame.direction, frame.ID, len(frame.DATA), data)).rstrip()
+
+
+# Driver stand-in with the PCANBasic methods WSTCan uses, which plays back a recorded trace instead of talking to
+# hardware. Pass it to WSTCan(transport=ReplayTransport("trace.txt")).
+#
+# The trace is split into steps at every Tx frame. Writing a frame matches it against the next recorded Tx frame and
+# releases the Rx frames that followed it in the trace to Read. Rx frames before the first Tx are released when the
+# channel is initialized. speed=None releases the frames at once, otherwise with the recorded delays divided by speed
+# (speed=10 replays ten times faster than recorded).
+# A write that does not match the next recorded Tx frame is looked up further ahead in the trace, skipping the steps
+# in between, or ignored when not found. With strict=True it raises an Exception instead.
+class ReplayTransport:
+	def __init__(self, trace, speed=None, strict=False):
+		if isinstance(trace, str) or hasattr(trace, "__fspath__"):
+			trace = load_trace(trace)
+		self.speed = speed
+		self.strict = strict
+		self.leading_frames, self.steps = self.split_steps(trace)
+		self.position = 0  # index of the next step in steps
+		self.initialized = False
+		self.started = False
+		self.written_frames = 0
+		self.unmatched_writes = 0
+		self.skipped_steps = 0
+		self._pending = []  # heap of (release time, sequence, TraceFrame)
+		self._sequence = 0
+		self._lock = threading.Lock()
+
+	# Split a trace in the Rx frames before the first Tx frame and steps of (Tx frame, [Rx frames after it]).
+	@staticmethod
+	def split_steps(trace):
+		leading_frames = []
+		steps = []
+		for frame in trace:
+			if frame.direction == "Tx":
+				steps.append((frame, []))
+			elif len(steps) == 0:
+				leading_frames.append(frame)
+			else:
+				steps[-1][1].append(frame)
+		return leading_frames, steps
+
+	def finished(self):
+		with self._lock:
+			return self.position >= len(self.steps) and len(self._pending) == 0
+
+	def rewind(self):
+		with self._lock:
+			self.position = 0
+			self.started = False
+			self._pending = []
+			if self.initialized:
+				self._start()
+
+	def _start(self):
+		self.started = True
+		first_timestamp = self.leading_frames[0].timestamp if self.leading_frames else 0
+		self._release(self.leading_frames, first_timestamp)
+
+	def _release(self, frames, reference_timestamp):
+		now = time.monotonic()
+		for frame in frames:
+			delay = 0 if self.speed is None else max(frame.timestamp - reference_timestamp, 0) / self.speed
+			self._sequence += 1
+			heapq.heappush(self._pending, (now + delay, self._sequence, frame))
+
+	@staticmethod
+	def _same_frame(recorded, msg):
+		return recorded.ID == msg.ID and list(recorded.DATA) == list(msg.DATA)[:msg.LEN]
+
+	def _match_step(self, msg):
+		for index in range(self.position, len(self.steps)):
+			if self._same_frame(self.steps[index][0], msg):
+				return index
+			if self.strict:
+				raise Exception("Replay: wrote %03X %s, but the trace has %03X %s" % (
+					msg.ID, list(msg.DATA)[:msg.LEN], self.steps[index][0].ID, self.steps[index][0].DATA))
+		if self.strict:
+			raise Exception("Replay: wrote %03X %s after the end of the trace" % (msg.ID, list(msg.DATA)[:msg.LEN]))
+		return None
+
+	# PCANBasic interface
+
+	def Initialize(self, Channel, Btr0Btr1, *args):
+		with self._lock:
+			self.initialized = True
+			if not self.started:
+				self._start()
+		return PCAN_ERROR_OK
+
+	def Uninitialize(self, Channel):
+		with self._lock:
+			self.initialized = False
+			self._pending = []  # the driver drops the received frames with the channel
+		return PCAN_ERROR_OK
+
+	def Reset(self, Channel):
+		with self._lock:
+			self._pending = []
+		return PCAN_ERROR_OK
+
+	def GetStatus(self, Channel):
+		return PCAN_ERROR_OK if self.initialized else PCAN_ERROR_INITIALIZE
+
+	def Read(self, Channel):
+		msg = TPCANMsg()
+		timestamp = TPCANTimestamp()
+		with self._lock:
+			if not self.initialized:
+				return PCAN_ERROR_INITIALIZE, msg, timestamp
+			if len(self._pending) == 0 or self._pending[0][0] > time.monotonic():
+				return PCAN_ERROR_QRCVEMPTY, msg, timestamp
+			frame = heapq.heappop(self._pending)[2]
+		msg.ID = frame.ID
+		msg.MSGTYPE = PCAN_MESSAGE_STANDARD
+		msg.LEN = len(frame.DATA)
+		for i, value in enumerate(frame.DATA):
+			msg.DATA[i] = value
+		microseconds = int(frame.timestamp * 1000000)
+		timestamp.millis = (microseconds // 1000) & 0xFFFFFFFF
+		timestamp.micros = microseconds % 1000
+		return PCAN_ERROR_OK, msg, timestamp
+
+	def Write(self, Channel, MessageBuffer):
+		with self._lock:
+			if not self.initialized:
+				return PCAN_ERROR_INITIALIZE
+			self.written_frames += 1
+			index = self._match_step(MessageBuffer)
+			if index is None:
+				self.unmatched_writes += 1
+				return PCAN_ERROR_OK
+			self.skipped_steps += index - self.position
+			tx_frame, rx_frames = self.steps[index]
+			self.position = index + 1
+			self._release(rx_frames, tx_frame.timestamp)
+		return PCAN_ERROR_OK
+
+	def FilterMessages(self, Channel, FromID, ToID, Mode):
+		return PCAN_ERROR_OK  # a trace only holds frames that already passed the filters when it was recorded
+
+	def GetValue(self, Channel, Parameter):
+		return PCAN_ERROR_ILLPARAMTYPE, 0  # no receive event. WSTCan falls back to short sleeps
+
+	def SetValue(self, Channel, Parameter, Buffer):
+		return PCAN_ERROR_OK
+
+	def GetErrorText(self, Error, Language=0):
+		return PCAN_ERROR_OK, ("Replay transport error 0x%X" % Error).encode("ascii")
+
+
+# Wraps a transport (normally the PCANBasic driver) and records every frame read and written, for replay with
+# ReplayTransport. All other calls go straight to the wrapped transport.
+#
+# 	recorder = RecordingTransport(default_transport())
+# 	wstcan = WSTCan(transport=recorder)
+# 	...
+# 	recorder.save("trace.txt")
+class RecordingTransport:
+	def __init__(self, transport):
+		self.transport = transport
+		self.frames = []
+		self.start_time = time.monotonic()
+		self._lock = threading.Lock()
+
+	def __getattr__(self, name):
+		return getattr(self.transport, name)
+
+	def _record(self, direction, msg):
+		frame = TraceFrame(time.monotonic() - self.start_time, direction, msg.ID, list(msg.DATA)[:msg.LEN])
+		with self._lock:
+			self.frames.append(frame)
+
+	def Read(self, Channel):
+		result = self.transport.Read(Channel)
+		if result[0] == PCAN_ERROR_OK:
+			self._record("Rx", result[1])
+		return result
+
+	def Write(self, Channel, MessageBuffer):
+		result = self.transport.Write(Channel, MessageBuffer)
+		if result == PCAN_ERROR_OK:
+			self._record("Tx", MessageBuffer)
+		return result
+
+	def save(self, file_path):
+		with self._lock:
+			frames = list(self.frames)
+		save_trace(frames, file_path)
@@ -0,0 +1,427 @@
+import heapq
+import threading
+import time
+
+from pcanbasic.PCANBasic import TPCANMsg, TPCANTimestamp, PCAN_MESSAGE_STANDARD, PCAN_ERROR_OK, PCAN_ERROR_QRCVEMPTY, \
+	PCAN_ERROR_INITIALIZE, PCAN_ERROR_ILLPARAMTYPE, PCAN_BAUD_125K, PCAN_BAUD_250K, PCAN_BAUD_500K, PCAN_BAUD_1M
+
+_PCAN_BAUDRATES = {PCAN_BAUD_125K.value: 125, PCAN_BAUD_250K.value: 250, PCAN_BAUD_500K.value: 500,
+									 PCAN_BAUD_1M.value: 1000}
+_BMS_BAUDRATE_COMMANDS = {0x10: 125, 0x20: 250, 0x30: 500, 0x40: 1000}  # byte 6 of the 0xBC baudrate command
+
+# Length of the raw SP parameter replies, see SpParser.parse_sp_parameters
+_SP_PARAMETER_LENGTHS = {0x07: 128, 0x0B: 96, 0x0D: 96, 0x70: 64, 0x6E: 32}
+
+
+def _xor(values):
+	checksum = 0
+	for value in values:
+		checksum ^= value
+	return checksum
+
+
+def _bcd(value):
+	return ((value // 10) << 4) | (value % 10)
+
+
+# One simulated battery. Holds the state the SP and protocol 2 replies are built from. Change the attributes to change
+# what the battery reports, eg. bms.cell_voltages[0] = 3100 or bms.current = -1500.
+class SimulatedBMS:
+	def __init__(self, node_id=2, serial="123456", cells=16, model_field="WST-SIM-1234000010CCF0001", log_records=50,
+							 bms_model="BMS-SIM-01", firmware_version=21, baudrate=250):
+		self.node_id = node_id  # protocol 2 node id
+		self.serial = serial  # up to 6 digits, as written with WSTCan.writeSerialNumber
+		self.model_field = model_field
+		self.production_date = [22, 6, 15]  # [YY, MM, DD]
+		self.bms_model = bms_model
+		self.firmware_version = firmware_version
+		self.baudrate = baudrate  # kbit/s. The battery only answers on a channel initialized with the same baudrate
+		self.boot_mode = False
+		self.sp_write_reply_pause = 0.0  # seconds between the first and the other frames of the answer to an SP write
+		self.cell_voltages = [3300 + i for i in range(cells)]  # mV
+		self.cell_temperatures = [25, 26]  # deg C
+		self.mos_temperature = 30
+		self.ambient_temperature = 22
+		self.current = 0  # 10 mA. Negative when discharging
+		self.soc = 80
+		self.soh = 100
+		self.cycles = 12
+		self.design_capacity = 100000  # mAh
+		self.full_capacity = 98000
+		self.shunt_resistor = 50  # 0.01 mOhm
+		self.balancing_flags = 0  # bit 0 is cell 1
+		self.status_flags = [0, 0, 0, 0]  # current status bytes 3-6, see SpParser.possible_status_codes
+		self.custom_parameters = {n: 0 for n in range(1, 31)}  # protocol 2 custom parameters
+		self.custom_parameters[8] = 1
+		self.sp_parameters = {}  # SP parameter command: raw reply data. Missing commands reply with zeros
+		for command, length in _SP_PARAMETER_LENGTHS.items():
+			self.sp_parameters[command] = [0] * length
+		self.sp_parameters[0x07][1:5] = [99, 215, 9, 46]  # OCC1 100A, OV 4.15V with 1s delay, UV 3.0V
+		self.log_statistics = [[0] * 33, [0] * 33]  # the two statistics records sent before the log
+		self.log = [self.log_record(i) for i in range(log_records)]  # 33 byte records, newest first
+		self.log_capacity = max(log_records, 1000)  # the oldest records are dropped when more are logged
+		self._logged_records = log_records
+
+	# A log record with made up values. Record 0 is the newest.
+	def log_record(self, age):
+		minutes = 59 - age % 60
+		hours = 23 - (age // 60) % 24
+		day = 28 - (age // 1440) % 28
+		record = [age % 256, _bcd(22), _bcd(6), _bcd(day), _bcd(hours), _bcd(minutes), 0]
+		record += list((5280).to_bytes(2, 'big')) + list((3290).to_bytes(2, 'big')) + list((3310).to_bytes(2, 'big'))
+		record += list((-250 if age % 2 else 150).to_bytes(2, 'big', signed=True))
+		record += [65, 66, self.soc]
+		record += list((self.full_capacity * self.soc // 100).to_bytes(4, 'big')) + list(self.cycles.to_bytes(2, 'big'))
+		record += [0, 0, 0, 1 if age % 2 else 2, 0, self.soh, 70, 1, 2]
+		return record
+
+	# Log count new records, like the BMS does while running, and drop the oldest records beyond log_capacity
+	def add_log_records(self, count=1):
+		for i in range(count):
+			self._logged_records += 1
+			self.log.insert(0, self.log_record(self._logged_records))
+		del self.log[self.log_capacity:]
+
+	def p2_ids(self):
+		# CP4 bit 6 moves protocol 2 to the 0x68E/0x68D ids
+		if self.custom_parameters[4] & 0x40:
+			return [0x68E, 0x68D]
+		return [0x00E, 0x00D]
+
+	def pack_voltage(self):
+		return sum(self.cell_voltages)  # mV
+
+	# SP replies
+
+	def voltage_status(self):
+		data = [len(self.cell_voltages), len(self.cell_temperatures) + 2, len(self.cell_voltages)]
+		for cell_voltage in self.cell_voltages:
+			data += list(int(cell_voltage).to_bytes(2, 'big'))
+		return data
+
+	def current_status(self):
+		status_byte = 0x30  # mos and ambient probe present
+		if self.current < 0:
+			status_byte |= 0x01
+		elif self.current > 0:
+			status_byte |= 0x02
+		data = [status_byte] + list(abs(int(self.current)).to_bytes(2, 'big')) + list(self.status_flags)
+		data.append(len(self.cell_temperatures) + 2)
+		data += [temperature + 40 for temperature in self.cell_temperatures]
+		data += [self.mos_temperature + 40, self.ambient_temperature + 40]
+		data += list(int(self.shunt_resistor).to_bytes(2, 'big'))
+		data += list(int(self.balancing_flags).to_bytes(3, 'big'))
+		data += [self.firmware_version, 0x06, 0x00]  # both mosfets on, no failures
+		return data
+
+	def power_status(self):
+		def word(value):
+			return list(int(value).to_bytes(2, 'big'))
+
+		def split_long(value):
+			high, low = divmod(int(value), 65536)
+			return [0] + word(high) + [0] + word(low)
+
+		remaining_capacity = self.full_capacity * self.soc // 100
+		data = [0, self.soc, 0] + word(self.cycles)
+		data += split_long(self.design_capacity) + split_long(self.full_capacity) + split_long(remaining_capacity)
+		data += [0] + word(0xFFFF) + [0] + word(0xFFFF) + [0] + word(5) + word(48)
+		data += [0] * 7
+		data += word(self.pack_voltage() // 10) + word(max(self.cell_voltages)) + word(min(self.cell_voltages))
+		data += [0x0D, 1, 0x4E]  # extended frame, hardware version 1, TI front end
+		return data
+
+	def sp_custom_parameters(self):
+		data = []
+		for n in range(1, 9):
+			data += list((self.custom_parameters[n] * 100).to_bytes(2, 'big', signed=True))
+		return data
+
+	@staticmethod
+	def sp_is_write(command, data):
+		return command in (0x10, 0x12) or (command == 0x0F and len(data) > 0 and data[0] == 0x02)
+
+	def sp_reply(self, command, data):
+		"""
+		The reply data of an SP command.
+		:arguments
+			command: command byte (byte 5 of the package)
+			data: the command data (between the command byte and the checksum)
+		:returns
+			list of reply payloads. Each is sent as one package. None for commands that are not answered.
+		"""
+		if command == 0x02:
+			return [self.voltage_status()]
+		if command == 0x03:
+			return [self.current_status()]
+		if command == 0x04:
+			return [self.power_status()]
+		if command == 0x01:
+			return [[len(self.bms_model)] + list(self.bms_model.encode("ascii"))]
+		if command == 0x11:
+			return [[len(self.serial)] + list(self.serial.encode("ascii"))]
+		if command == 0x30:
+			date = [self.production_date[0] - 15, self.production_date[1] - 1, self.production_date[2] - 1]
+			return [[len(self.model_field)] + list(self.model_field.encode("ascii")) + date]
+		if command == 0x28:
+			return [self.sp_custom_parameters()]
+		if command in self.sp_parameters:
+			return [self.sp_parameters[command]]
+		if command == 0x0F:
+			if len(data) > 0 and data[0] == 0x02:  # write cell voltage calibration
+				return [[]]
+			raw = [0, 0, len(self.cell_voltages)]
+			for cell_voltage in self.cell_voltages:
+				raw += list(int(cell_voltage).to_bytes(2, 'big'))
+			return [raw]
+		if command == 0x12:  # write model field and date
+			length = data[0]
+			self.model_field = bytes(data[1:1 + length]).decode("ascii")
+			self.production_date = [data[1 + length] + 15, data[2 + length] + 1, data[3 + length] + 1]
+			return [[]]
+		if command == 0x10:  # write serial number
+			self.serial = bytes(data[1:1 + data[0]]).decode("ascii")
+			return [[]]
+		return None
+
+	# Protocol 2 replies. Returns a list of 8 byte frames, sent on the protocol 2 receive id.
+
+	def status_data(self):
+		data = [0] * 95
+		data[0:2] = list((self.pack_voltage() // 100).to_bytes(2, 'big'))
+		current = abs(int(self.current)) // 10
+		data[2:4] = list((current if self.current > 0 else 0).to_bytes(2, 'big'))
+		data[4:6] = list((current if self.current < 0 else 0).to_bytes(2, 'big'))
+		data[6] = self.soc
+		data[8:10] = list((self.full_capacity * self.soc // 100000).to_bytes(2, 'big'))
+		data[10] = self.soh
+		data[11] = self.firmware_version
+		data[12:14] = list((self.full_capacity // 1000).to_bytes(2, 'big'))
+		data[14:16] = list(self.cycles.to_bytes(2, 'big'))
+		data[16:18] = [0, 1 if self.current < 0 else 2 if self.current > 0 else 0]
+		data[18:20] = [(temperature & 0xFF) for temperature in (self.cell_temperatures + [0, 0])[:2]]
+		data[22] = self.mos_temperature & 0xFF
+		data[23] = self.ambient_temperature & 0xFF
+		for i, cell_voltage in enumerate(self.cell_voltages[:23]):
+			data[24 + i * 2:26 + i * 2] = list(int(cell_voltage).to_bytes(2, 'big'))
+		data[72] = self.custom_parameters[8]
+		serial = self.serial.zfill(6)
+		data[80] = len(serial)
+		data[81:84] = list(bytes.fromhex(serial))
+		return data
+
+	def status_frames(self):
+		data = self.status_data()
+		frames = [[self.node_id, 0, 1, 17, 0, 0, 0, 0], [self.node_id, 0] + data[0:5] + [1]]
+		for k in range(2, 17):
+			offset = 5 + (k - 2) * 6
+			frames.append([self.node_id] + data[offset:offset + 6] + [k])
+		return frames
+
+	def log_frames(self):
+		frames = []
+		for record in self.log:
+			frames.append([self.node_id, 0, 0, 0, 0, record[0], 0, 0])
+			frames.append([self.node_id, 0] + record[1:6] + [1])
+			for k in range(2, 6):
+				offset = 6 + (k - 2) * 6
+				frames.append([self.node_id] + record[offset:offset + 6] + [k])
+			frames.append([self.node_id] + record[30:33] + [0, 0, 0, 6])
+		return frames
+
+	def serial_frame(self):
+		serial = self.serial.zfill(6)
+		return [0x02, len(serial)] + list(bytes.fromhex(serial)) + [0] * (6 - len(serial) // 2)
+
+	def custom_parameter_frame(self, parameter_number):
+		value = self.custom_parameters.get(parameter_number, 0)
+		return [0xBD, self.node_id, 0, parameter_number, 0, (value >> 8) & 0xFF, 0x04, value & 0xFF]
+
+	def p2_reply(self, data):
+		if data[0] == 0x02:
+			return [self.serial_frame()]
+		if data[1] != self.node_id:
+			return []
+		if data[0] == 0x01:
+			return self.status_frames()
+		if data[0] == 0x04:
+			return self.log_frames()
+		if data[0] == 0xBD:
+			parameter_number = data[3]
+			if data[7] == 0x40:
+				self.custom_parameters[parameter_number] = 1 if (parameter_number == 8 and data[4] == 255) else data[4]
+			elif data[7] == 0x80:
+				self.custom_parameters[parameter_number] = data[2] * 256 + data[4]
+			return [self.custom_parameter_frame(parameter_number)]
+		return []
+
+
+# PCANBasic stand-in with simulated batteries on the bus, for load tests and benchmarks without hardware.
+# Pass it to WSTCan(transport=SimulatedBus([SimulatedBMS(node_id=2), SimulatedBMS(node_id=3, serial="123457")])).
+#
+# SP commands (0x001-0x003) are answered by the first battery, as SP has no addressing. Protocol 2 requests are answered
+# by the battery with the node id in DATA[1]. The replies are readable latency seconds after the request, with
+# frame_time seconds between the frames of a reply.
+# Every channel has its own receive queue, so one bus can serve several WSTCan objects (eg. a WSTCanPool) at the same
+# time. All channels see the same batteries.
+class SimulatedBus:
+	def __init__(self, batteries=None, latency=0.001, frame_time=0.0):
+		self.batteries = batteries if batteries is not None else [SimulatedBMS()]
+		self.latency = latency
+		self.frame_time = frame_time
+		self.requests = 0
+		self._channels = {}
+		self._sequence = 0
+		self._lock = threading.Lock()
+
+	def _channel(self, channel):
+		key = getattr(channel, "value", channel)
+		if key not in self._channels:
+			self._channels[key] = {'initialized': False, 'baudrate': 250, 'pending': [], 'sp_data': None}
+		return self._channels[key]
+
+	# pause is added before all frames but the first
+	def _send(self, state, frames, can_id=None, pause=0.0):
+		due = time.monotonic() + self.latency
+		for i, frame in enumerate(frames):
+			frame_id, data = (can_id, frame) if can_id is not None else frame
+			self._sequence += 1
+			heapq.heappush(state['pending'], (due + i * self.frame_time + (pause if i > 0 else 0), self._sequence, frame_id,
+																				data))
+
+	def _sp_package(self, state, package):
+		if len(package) < 8 or package[0] not in (0xEA, 0xEB):
+			return
+		package = package[:package[3] + 4]
+		if len(package) < 6 or _xor(package[3:-2]) != package[-2]:
+			return
+		battery = self._listening_batteries(state)[:1]
+		if len(battery) == 0:
+			return
+		battery = battery[0]
+		self.requests += 1
+		if package[0] == 0xEB:  # firmware version in boot mode
+			if battery.boot_mode:
+				self._sp_send(state, [[0xEB, 0x01, 0x01, 0x04, 0x90, 255]])
+			return
+		if battery.boot_mode:
+			return
+		if package[5] == 0x08:  # log: statistics, one package per record and a short package at the end
+			packages = [[0xEA, 0xD1, package[2], 37, 0, 0x09] + record for record in battery.log_statistics]
+			packages += [[0xEA, 0xD1, package[2], 37, 0, 0x08] + record for record in battery.log]
+			packages.append([0xEA, 0xD1, package[2], 4, 0, 0x08])
+			self._sp_send(state, packages)
+			return
+		replies = battery.sp_reply(package[5], package[6:-2])
+		if replies is not None:
+			pause = battery.sp_write_reply_pause if battery.sp_is_write(package[5], package[6:-2]) else 0.0
+			self._sp_send(state, [[0xEA, 0xD1, package[2], len(reply) + 4, 0, package[5]] + reply for reply in replies],
+										pause)
+
+	def _sp_send(self, state, packages, pause=0.0):
+		frames = []
+		for package in packages:
+			package = package + [_xor(package[3:]), 0xF5]
+			frames.append((0x001, [0] * 8))
+			for i in range(0, len(package), 8):
+				frames.append((0x002, (package[i:i + 8] + [0] * 8)[:8]))
+			frames.append((0x003, [0] * 8))
+		self._send(state, frames, pause=pause)
+
+	def _listening_batteries(self, state):
+		return [battery for battery in self.batteries if battery.baudrate == state['baudrate']]
+
+	def _p2_request(self, state, can_id, data):
+		if data[0] == 0xBC and data[1] == 0xFF:  # baudrate change, for all batteries
+			for battery in self._listening_batteries(state):
+				battery.baudrate = _BMS_BAUDRATE_COMMANDS.get(data[6], battery.baudrate)
+			return
+		for battery in self._listening_batteries(state):
+			send_id, receive_id = battery.p2_ids()
+			if send_id != can_id:
+				continue
+			frames = battery.p2_reply(data)
+			if frames:
+				self.requests += 1
+				self._send(state, frames, receive_id)
+
+	# PCANBasic interface
+
+	def Initialize(self, Channel, Btr0Btr1, *args):
+		with self._lock:
+			state = self._channel(Channel)
+			state['initialized'] = True
+			state['baudrate'] = _PCAN_BAUDRATES.get(getattr(Btr0Btr1, "value", Btr0Btr1), 250)
+		return PCAN_ERROR_OK
+
+	def Uninitialize(self, Channel):
+		with self._lock:
+			state = self._channel(Channel)
+			state['initialized'] = False
+			state['pending'] = []
+			state['sp_data'] = None
+		return PCAN_ERROR_OK
+
+	# Clears the frames received so far. Frames the batteries send later still arrive, as on a real bus.
+	def Reset(self, Channel):
+		with self._lock:
+			state = self._channel(Channel)
+			now = time.monotonic()
+			state['pending'] = [frame for frame in state['pending'] if frame[0] > now]
+			heapq.heapify(state['pending'])
+		return PCAN_ERROR_OK
+
+	def GetStatus(self, Channel):
+		with self._lock:
+			return PCAN_ERROR_OK if self._channel(Channel)['initialized'] else PCAN_ERROR_INITIALIZE
+
+	def Read(self, Channel):
+		msg = TPCANMsg()
+		timestamp = TPCANTimestamp()
+		with self._lock:
+			state = self._channel(Channel)
+			if not state['initialized']:
+				return PCAN_ERROR_INITIALIZE, msg, timestamp
+			pending = state['pending']
+			if len(pending) == 0 or pending[0][0] > time.monotonic():
+				return PCAN_ERROR_QRCVEMPTY, msg, timestamp
+			due, sequence, frame_id, data = heapq.heappop(pending)
+		msg.ID = frame_id
+		msg.MSGTYPE = PCAN_MESSAGE_STANDARD
+		msg.LEN = 8
+		for i, value in enumerate(data):
+			msg.DATA[i] = value
+		microseconds = int(due * 1000000)
+		timestamp.millis = (microseconds // 1000) & 0xFFFFFFFF
+		timestamp.micros = microseconds % 1000
+		return PCAN_ERROR_OK, msg, timestamp
+
+	def Write(self, Channel, MessageBuffer):
+		data = list(MessageBuffer.DATA)[:MessageBuffer.LEN]
+		with self._lock:
+			state = self._channel(Channel)
+			if not state['initialized']:
+				return PCAN_ERROR_INITIALIZE
+			if MessageBuffer.ID == 0x001:
+				state['sp_data'] = []
+			elif MessageBuffer.ID == 0x002 and state['sp_data'] is not None:
+				state['sp_data'] += data
+			elif MessageBuffer.ID == 0x003 and state['sp_data'] is not None:
+				package = state['sp_data']
+				state['sp_data'] = None
+				self._sp_package(state, package)
+			elif len(data) == 8:
+				self._p2_request(state, MessageBuffer.ID, data)
+		return PCAN_ERROR_OK
+
+	def FilterMessages(self, Channel, FromID, ToID, Mode):
+		return PCAN_ERROR_OK
+
+	def GetValue(self, Channel, Parameter):
+		return PCAN_ERROR_ILLPARAMTYPE, 0  # no receive event. WSTCan falls back to short sleeps
+
+	def SetValue(self, Channel, Parameter, Buffer):
+		return PCAN_ERROR_OK
+
+	def GetErrorText(self, Error, Language=0):
+		return PCAN_ERROR_OK, ("Simulated bus error 0x%X" % Error).encode("ascii")
@@ -0,0 +1,351 @@
+import errno
+import select
+import socket
+import struct
+import subprocess
+import threading
+import time
+
+from pcanbasic.PCANBasic import TPCANMsg, TPCANTimestamp, PCAN_MESSAGE_STANDARD, PCAN_MESSAGE_EXTENDED, \
+	PCAN_MESSAGE_RTR, PCAN_MODE_EXTENDED, PCAN_ERROR_OK, PCAN_ERROR_QRCVEMPTY, PCAN_ERROR_QXMTFULL, \
+	PCAN_ERROR_INITIALIZE, PCAN_ERROR_ILLPARAMTYPE, PCAN_ERROR_ILLPARAMVAL, PCAN_ERROR_ILLHW, PCAN_ERROR_UNKNOWN, \
+	PCAN_ERROR_BUSOFF, PCAN_ERROR_BUSPASSIVE, PCAN_ERROR_BUSHEAVY, PCAN_RECEIVE_EVENT, PCAN_MESSAGE_FILTER, \
+	PCAN_FILTER_CLOSE, PCAN_FILTER_OPEN, PCAN_USBBUS1, PCAN_USBBUS9, PCAN_BAUD_1M, PCAN_BAUD_800K, PCAN_BAUD_500K, \
+	PCAN_BAUD_250K, PCAN_BAUD_125K, PCAN_BAUD_100K, PCAN_BAUD_50K, PCAN_BAUD_20K, PCAN_BAUD_10K
+
+# linux/can.h and linux/can/raw.h. The socket module only has these on Linux builds.
+AF_CAN = getattr(socket, "AF_CAN", 29)
+CAN_RAW = getattr(socket, "CAN_RAW", 1)
+SOL_CAN_RAW = getattr(socket, "SOL_CAN_RAW", 101)
+CAN_RAW_FILTER = getattr(socket, "CAN_RAW_FILTER", 1)
+CAN_RAW_ERR_FILTER = getattr(socket, "CAN_RAW_ERR_FILTER", 2)
+CAN_EFF_FLAG = 0x80000000
+CAN_RTR_FLAG = 0x40000000
+CAN_ERR_FLAG = 0x20000000
+CAN_SFF_MASK = 0x000007FF
+CAN_EFF_MASK = 0x1FFFFFFF
+
+# error frame classes (linux/can/error.h)
+CAN_ERR_CRTL = 0x00000004
+CAN_ERR_BUSOFF = 0x00000040
+CAN_ERR_RESTARTED = 0x00000100
+CAN_ERR_CRTL_RX_WARNING = 0x04
+CAN_ERR_CRTL_TX_WARNING = 0x08
+CAN_ERR_CRTL_RX_PASSIVE = 0x10
+CAN_ERR_CRTL_TX_PASSIVE = 0x20
+CAN_ERR_CRTL_ACTIVE = 0x40
+
+# struct can_frame: can_id, len, 3 padding bytes, 8 data bytes
+CAN_FRAME = struct.Struct("=IB3x8s")
+CAN_FILTER = struct.Struct("=II")
+
+# SO_TIMESTAMPING (linux/net_tstamp.h). The control message holds 3 timespecs: software, (deprecated), raw hardware.
+SO_TIMESTAMPING = getattr(socket, "SO_TIMESTAMPING", 37)
+SOF_TIMESTAMPING_RX_HARDWARE = 1 << 2
+SOF_TIMESTAMPING_RX_SOFTWARE = 1 << 3
+SOF_TIMESTAMPING_SOFTWARE = 1 << 4
+SOF_TIMESTAMPING_RAW_HARDWARE = 1 << 6
+SCM_TIMESTAMPING = struct.Struct("@6l")
+
+_BITRATES = {PCAN_BAUD_1M.value: 1000000, PCAN_BAUD_800K.value: 800000, PCAN_BAUD_500K.value: 500000,
+						 PCAN_BAUD_250K.value: 250000, PCAN_BAUD_125K.value: 125000, PCAN_BAUD_100K.value: 100000,
+						 PCAN_BAUD_50K.value: 50000, PCAN_BAUD_20K.value: 20000, PCAN_BAUD_10K.value: 10000}
+
+
+def _key(value):
+	return getattr(value, "value", value)
+
+
+# Interface name for a PCAN channel handle when none is configured: PCAN_USBBUS1 is can0, PCAN_USBBUS2 is can1, ...
+def default_interface(channel):
+	channel = _key(channel)
+	if PCAN_USBBUS1.value <= channel < PCAN_USBBUS1.value + 8:
+		return "can%d" % (channel - PCAN_USBBUS1.value)
+	if PCAN_USBBUS9.value <= channel < PCAN_USBBUS9.value + 8:
+		return "can%d" % (channel - PCAN_USBBUS9.value + 8)
+	return None
+
+
+def range_filters(from_id, to_id, extended=False):
+	"""
+	Smallest set of kernel id/mask filters accepting exactly the CAN-IDs from_id..to_id.
+	:returns
+		list of (can_id, can_mask)
+	"""
+	id_mask = CAN_EFF_MASK if extended else CAN_SFF_MASK
+	flags = CAN_EFF_FLAG if extended else 0
+	filters = []
+	can_id = from_id
+	while can_id <= to_id:
+		# largest aligned block starting at can_id that does not go past to_id
+		size = 1
+		while can_id % (size * 2) == 0 and can_id + size * 2 - 1 <= to_id and size * 2 <= id_mask + 1:
+			size *= 2
+		# EFF_FLAG in the mask so standard filters don't match extended frames and the other way around
+		filters.append((can_id | flags, (id_mask & ~(size - 1)) | CAN_EFF_FLAG))
+		can_id += size
+	return filters
+
+
+# Driver stand-in with the PCANBasic methods WSTCan uses, talking to Linux SocketCAN interfaces through raw AF_CAN
+# sockets instead of the PCAN-Basic library. Pass it to WSTCan(transport=SocketCanTransport("can0")).
+#
+# interfaces is one interface name for every channel, or a dict of PCAN channel handle to interface name. By default
+# PCAN_USBBUS1 is can0, PCAN_USBBUS2 is can1 and so on.
+# The message filters are set as kernel filters on the socket, so frames WSTCan doesn't listen to never reach Python.
+# GetValue(PCAN_RECEIVE_EVENT) returns the socket, so ReceiveEvent sleeps in select until a frame arrives.
+# Frames get the hardware receive timestamp when the adapter supports it, otherwise the kernel software timestamp.
+#
+# The bitrate is a setting of the interface, eg. "ip link set can0 up type can bitrate 250000". With
+# set_bitrate=True Initialize sets it with ip link, which needs root (or CAP_NET_ADMIN). Without it the baudrate
+# given to Initialize is ignored. vcan interfaces have no bitrate:
+# 	ip link add dev vcan0 type vcan && ip link set vcan0 up
+class SocketCanTransport:
+	def __init__(self, interfaces=None, set_bitrate=False, receive_own_frames=False):
+		self.interfaces = interfaces
+		self.set_bitrate = set_bitrate
+		self.receive_own_frames = receive_own_frames  # frames written on this socket are read back too
+		self._sockets = {}  # channel -> socket
+		self._filters = {}  # channel -> None (open) or list of (from_id, to_id, extended)
+		self._bus_status = {}  # channel -> PCAN status from the last error frames
+		self._hardware_timestamps = {}  # channel -> True when SO_TIMESTAMPING could be enabled
+		self._lock = threading.Lock()
+
+	def interface(self, channel):
+		if isinstance(self.interfaces, str):
+			return self.interfaces
+		if self.interfaces is not None:
+			for key, name in self.interfaces.items():
+				if _key(key) == _key(channel):
+					return name
+			return None
+		return default_interface(channel)
+
+	def _socket(self, channel):
+		return self._sockets.get(_key(channel))
+
+	def _configure_bitrate(self, interface, baudrate):
+		bitrate = _BITRATES.get(_key(baudrate))
+		if bitrate is None:
+			raise Exception("No SocketCAN bitrate for PCAN baudrate 0x%X" % _key(baudrate))
+		subprocess.check_call(["ip", "link", "set", interface, "down"])
+		subprocess.check_call(["ip", "link", "set", interface, "type", "can", "bitrate", str(bitrate)])
+		subprocess.check_call(["ip", "link", "set", interface, "up"])
+
+	def _enable_timestamps(self, can_socket):
+		flags = SOF_TIMESTAMPING_RX_HARDWARE | SOF_TIMESTAMPING_RAW_HARDWARE | SOF_TIMESTAMPING_RX_SOFTWARE | \
+			SOF_TIMESTAMPING_SOFTWARE
+		try:
+			can_socket.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPING, flags)
+			return True
+		except OSError:
+			return False
+
+	def _apply_filters(self, channel):
+		can_socket = self._socket(channel)
+		if can_socket is None:
+			return PCAN_ERROR_INITIALIZE
+		ranges = self._filters.get(_key(channel))
+		if ranges is None:
+			filters = [(0, 0)]  # mask 0 matches every frame
+		else:
+			filters = []
+			for from_id, to_id, extended in ranges:
+				filters.extend(range_filters(from_id, to_id, extended))
+		try:
+			# no filters at all closes the socket for data frames
+			can_socket.setsockopt(SOL_CAN_RAW, CAN_RAW_FILTER, b"".join(CAN_FILTER.pack(*f) for f in filters))
+		except OSError:
+			return PCAN_ERROR_ILLPARAMVAL
+		return PCAN_ERROR_OK
+
+	def _update_bus_status(self, channel, can_id, data):
+		status = self._bus_status.get(_key(channel), PCAN_ERROR_OK)
+		if can_id & CAN_ERR_BUSOFF:
+			status = PCAN_ERROR_BUSOFF
+		elif can_id & CAN_ERR_RESTARTED:
+			status = PCAN_ERROR_OK
+		elif can_id & CAN_ERR_CRTL:
+			if data[1] & (CAN_ERR_CRTL_RX_PASSIVE | CAN_ERR_CRTL_TX_PASSIVE):
+				status = PCAN_ERROR_BUSPASSIVE
+			elif data[1] & (CAN_ERR_CRTL_RX_WARNING | CAN_ERR_CRTL_TX_WARNING):
+				status = PCAN_ERROR_BUSHEAVY
+			elif data[1] & CAN_ERR_CRTL_ACTIVE:
+				status = PCAN_ERROR_OK
+		self._bus_status[_key(channel)] = status
+
+	@staticmethod
+	def _timestamp(ancillary_data):
+		for level, cmsg_type, cmsg_data in ancillary_data:
+			if level == socket.SOL_SOCKET and cmsg_type == SO_TIMESTAMPING and len(cmsg_data) >= SCM_TIMESTAMPING.size:
+				values = SCM_TIMESTAMPING.unpack_from(cmsg_data)
+				if values[4] or values[5]:
+					return values[4] + values[5] / 1e9  # raw hardware timestamp
+				if values[0] or values[1]:
+					return values[0] + values[1] / 1e9
+		return time.time()
+
+	# PCANBasic interface
+
+	def Initialize(self, Channel, Btr0Btr1, *args):
+		interface = self.interface(Channel)
+		if interface is None:
+			return PCAN_ERROR_ILLHW
+		with self._lock:
+			if self._socket(Channel) is not None:
+				return PCAN_ERROR_OK
+			try:
+				if self.set_bitrate and not interface.startswith("vcan"):
+					self._configure_bitrate(interface, Btr0Btr1)
+				can_socket = socket.socket(AF_CAN, socket.SOCK_RAW, CAN_RAW)
+			except (OSError, subprocess.CalledProcessError):
+				return PCAN_ERROR_ILLHW
+			try:
+				can_socket.bind((interface,))
+				can_socket.setsockopt(SOL_CAN_RAW, CAN_RAW_ERR_FILTER, struct.pack("=I", CAN_ERR_CRTL | CAN_ERR_BUSOFF |
+																																					 CAN_ERR_RESTARTED))
+				if self.receive_own_frames:
+					can_socket.setsockopt(SOL_CAN_RAW, getattr(socket, "CAN_RAW_RECV_OWN_MSGS", 4), 1)
+			except OSError:
+				can_socket.close()
+				return PCAN_ERROR_ILLHW
+			can_socket.setblocking(False)
+			self._hardware_timestamps[_key(Channel)] = self._enable_timestamps(can_socket)
+			self._sockets[_key(Channel)] = can_socket
+			self._filters[_key(Channel)] = None  # the PCAN driver also starts with the filter open
+			self._bus_status[_key(Channel)] = PCAN_ERROR_OK
+			return self._apply_filters(Channel)
+
+	def Uninitialize(self, Channel):
+		with self._lock:
+			can_socket = self._sockets.pop(_key(Channel), None)
+			if can_socket is None:
+				return PCAN_ERROR_INITIALIZE
+			can_socket.close()
+		return PCAN_ERROR_OK
+
+	# drops the frames waiting in the socket, like the driver empties its receive queue
+	def Reset(self, Channel):
+		can_socket = self._socket(Channel)
+		if can_socket is None:
+			return PCAN_ERROR_INITIALIZE
+		try:
+			while True:
+				can_socket.recv(CAN_FRAME.size)
+		except (BlockingIOError, OSError):
+			pass
+		self._bus_status[_key(Channel)] = PCAN_ERROR_OK
+		return PCAN_ERROR_OK
+
+	def GetStatus(self, Channel):
+		if self._socket(Channel) is None:
+			return PCAN_ERROR_INITIALIZE
+		return self._bus_status.get(_key(Channel), PCAN_ERROR_OK)
+
+	def Read(self, Channel):
+		msg = TPCANMsg()
+		timestamp = TPCANTimestamp()
+		can_socket = self._socket(Channel)
+		if can_socket is None:
+			return PCAN_ERROR_INITIALIZE, msg, timestamp
+		while True:
+			try:
+				frame, ancillary_data, _, _ = can_socket.recvmsg(CAN_FRAME.size, 1024)
+			except BlockingIOError:
+				return PCAN_ERROR_QRCVEMPTY, msg, timestamp
+			except OSError as e:
+				if e.errno == errno.ENETDOWN:
+					return PCAN_ERROR_BUSOFF, msg, timestamp
+				return PCAN_ERROR_UNKNOWN, msg, timestamp
+			if len(frame) < CAN_FRAME.size:
+				continue
+			can_id, length, data = CAN_FRAME.unpack(frame)
+			if can_id & CAN_ERR_FLAG:
+				self._update_bus_status(Channel, can_id, data)
+				continue
+			break
+		if can_id & CAN_EFF_FLAG:
+			msg.ID = can_id & CAN_EFF_MASK
+			msg.MSGTYPE = PCAN_MESSAGE_EXTENDED.value
+		else:
+			msg.ID = can_id & CAN_SFF_MASK
+			msg.MSGTYPE = PCAN_MESSAGE_STANDARD.value
+		if can_id & CAN_RTR_FLAG:
+			msg.MSGTYPE |= PCAN_MESSAGE_RTR.value
+		msg.LEN = min(length, 8)
+		for i in range(msg.LEN):
+			msg.DATA[i] = data[i]
+		microseconds = int(self._timestamp(ancillary_data) * 1000000)
+		milliseconds = microseconds // 1000
+		timestamp.millis = milliseconds & 0xFFFFFFFF
+		timestamp.millis_overflow = (milliseconds >> 32) & 0xFFFF
+		timestamp.micros = microseconds % 1000
+		return PCAN_ERROR_OK, msg, timestamp
+
+	def Write(self, Channel, MessageBuffer):
+		can_socket = self._socket(Channel)
+		if can_socket is None:
+			return PCAN_ERROR_INITIALIZE
+		message_type = _key(MessageBuffer.MSGTYPE)
+		if message_type & PCAN_MESSAGE_EXTENDED.value:
+			can_id = (MessageBuffer.ID & CAN_EFF_MASK) | CAN_EFF_FLAG
+		else:
+			can_id = MessageBuffer.ID & CAN_SFF_MASK
+		if message_type & PCAN_MESSAGE_RTR.value:
+			can_id |= CAN_RTR_FLAG
+		length = min(MessageBuffer.LEN, 8)
+		try:
+			can_socket.send(CAN_FRAME.pack(can_id, length, bytes(MessageBuffer.DATA)))
+		except (BlockingIOError, OSError) as e:
+			if isinstance(e, BlockingIOError) or e.errno == errno.ENOBUFS:
+				# the interface transmit queue is full. Wait briefly for room once before giving up
+				select.select([], [can_socket], [], 0.01)
+				try:
+					can_socket.send(CAN_FRAME.pack(can_id, length, bytes(MessageBuffer.DATA)))
+					return PCAN_ERROR_OK
+				except OSError:
+					return PCAN_ERROR_QXMTFULL
+			if e.errno == errno.ENETDOWN:
+				return PCAN_ERROR_BUSOFF
+			return PCAN_ERROR_UNKNOWN
+		return PCAN_ERROR_OK
+
+	# Adds the range to the kernel filters of the socket. Like the PCAN driver, the first range after the filter was
+	# opened replaces the open filter.
+	def FilterMessages(self, Channel, FromID, ToID, Mode):
+		if self._socket(Channel) is None:
+			return PCAN_ERROR_INITIALIZE
+		if FromID > ToID:
+			return PCAN_ERROR_ILLPARAMVAL
+		extended = _key(Mode) == PCAN_MODE_EXTENDED.value
+		with self._lock:
+			ranges = self._filters.get(_key(Channel)) or []
+			self._filters[_key(Channel)] = ranges + [(FromID, ToID, extended)]
+			return self._apply_filters(Channel)
+
+	def GetValue(self, Channel, Parameter):
+		if _key(Parameter) == PCAN_RECEIVE_EVENT.value:
+			can_socket = self._socket(Channel)
+			if can_socket is None:
+				return PCAN_ERROR_INITIALIZE, 0
+			return PCAN_ERROR_OK, can_socket.fileno()  # readable while frames are waiting
+		if _key(Parameter) == PCAN_MESSAGE_FILTER.value:
+			ranges = self._filters.get(_key(Channel))
+			return PCAN_ERROR_OK, PCAN_FILTER_OPEN if ranges is None else PCAN_FILTER_CLOSE
+		return PCAN_ERROR_ILLPARAMTYPE, 0
+
+	def SetValue(self, Channel, Parameter, Buffer):
+		if _key(Parameter) == PCAN_MESSAGE_FILTER.value:
+			if self._socket(Channel) is None:
+				return PCAN_ERROR_INITIALIZE
+			if Buffer not in (PCAN_FILTER_OPEN, PCAN_FILTER_CLOSE):
+				return PCAN_ERROR_ILLPARAMVAL
+			with self._lock:
+				self._filters[_key(Channel)] = None if Buffer == PCAN_FILTER_OPEN else []
+				return self._apply_filters(Channel)
+		if _key(Parameter) == PCAN_RECEIVE_EVENT.value:
+			return PCAN_ERROR_ILLPARAMTYPE  # the socket itself is the event. See GetValue
+		return PCAN_ERROR_OK
+
+	def GetErrorText(self, Error, Language=0):
+		return PCAN_ERROR_OK, ("SocketCAN transport error 0x%X" % Error).encode("ascii")
@@ -0,0 +1,189 @@
+import threading
+import time
+
+from spparser.SpParser import SpParser
+
+
+# Fixed size ring buffer of (timestamp, sample). All slots are allocated up front, so adding a sample never allocates
+# or copies the history. The lock is only held to store or copy slot references, so readers never hold up the writer.
+class TelemetryRingBuffer:
+	def __init__(self, capacity):
+		if capacity < 1:
+			raise Exception("Ring buffer capacity must be at least 1")
+		self.capacity = capacity
+		self._timestamps = [0.0] * capacity
+		self._samples = [None] * capacity
+		self._count = 0  # samples added in total. The next sample goes in slot _count % capacity
+		self._lock = threading.Lock()
+
+	def __len__(self):
+		return min(self._count, self.capacity)
+
+	def append(self, timestamp, sample):
+		with self._lock:
+			slot = self._count % self.capacity
+			self._timestamps[slot] = timestamp
+			self._samples[slot] = sample
+			self._count += 1
+
+	def clear(self):
+		with self._lock:
+			self._timestamps = [0.0] * self.capacity
+			self._samples = [None] * self.capacity
+			self._count = 0
+
+	# number of samples overwritten because the buffer was full
+	def overwritten(self):
+		return max(self._count - self.capacity, 0)
+
+	def latest(self):
+		with self._lock:
+			if self._count == 0:
+				return None
+			slot = (self._count - 1) % self.capacity
+			return self._timestamps[slot], self._samples[slot]
+
+	def history(self, since=None, max_samples=None):
+		"""
+		Copy of the stored samples, oldest first.
+		:arguments
+			since: only samples with a timestamp after this (time.time() seconds)
+			max_samples: only the newest max_samples samples
+		:returns
+			list of (timestamp, sample)
+		"""
+		with self._lock:
+			stored = min(self._count, self.capacity)
+			first = self._count - stored
+			timestamps = [self._timestamps[i % self.capacity] for i in range(first, self._count)]
+			samples = [self._samples[i % self.capacity] for i in range(first, self._count)]
+		history = list(zip(timestamps, samples))
+		if since is not None:
+			history = [entry for entry in history if entry[0] > since]
+		if max_samples is not None:
+			history = history[-max_samples:] if max_samples > 0 else []
+		return history
+
+
+# Samples a battery continuously in a background thread at a target rate and keeps the parsed samples in a
+# TelemetryRingBuffer. The channel is kept open in a WSTCan session while polling, so the queries don't reinitialize it.
+# Don't query the same WSTCan from other threads while the poller runs.
+# Subclasses poll something else by overriding read_sample (see RackPoller).
+#
+# SP: a sample is the voltage, current and power status, parsed like get_parsed_sp_status("realtime").
+# Protocol 2 (node_id given): a sample is readStatus of the node, parsed like getStatus into {name: [value, unit]}.
+#
+# 	poller = wstcan.start_telemetry(rate=5, capacity=36000)
+# 	timestamp, sample = poller.latest()
+# 	last_minute = poller.history(seconds=60)
+class TelemetryPoller:
+	def __init__(self, wstcan, rate=5.0, capacity=3600, node_id=None, parse=True, start_receiver=True):
+		self.wstcan = wstcan
+		self.rate = rate  # samples per second. The poller samples as fast as the battery answers if it can't keep up.
+		self.node_id = node_id  # protocol 2 node id. None for SP
+		self.parse = parse  # False stores the raw response data instead of the parsed values
+		self.start_receiver = start_receiver  # use the background receiver for the session this poller opens
+		self.buffer = TelemetryRingBuffer(capacity)
+		self.samples_taken = 0
+		self.failed_samples = 0
+		self.last_error = None
+		self._sp_parser = SpParser()
+		self._running = False
+		self._thread = None
+		self._opened_session = False
+
+	def start(self, rate=None):
+		if rate is not None:
+			self.rate = rate
+		if self.is_running():
+			return
+		if not self.wstcan.session_active:
+			self.wstcan.open_session(start_receiver=self.start_receiver)
+			self._opened_session = True
+		self._running = True
+		self._thread = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+		self._thread.start()
+
+	def stop(self, timeout=5):
+		self._running = False
+		if self._thread is not None:
+			self._thread.join(timeout)
+			self._thread = None
+		if self._opened_session:
+			self.wstcan.close_session()
+			self._opened_session = False
+
+	def is_running(self):
+		return self._running and self._thread is not None and self._thread.is_alive()
+
+	def __enter__(self):
+		self.start()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.stop()
+		return False
+
+	def _run(self):
+		period = 1.0 / self.rate
+		next_sample_time = time.monotonic()
+		while self._running:
+			self.poll_once()
+			next_sample_time += period
+			delay = next_sample_time - time.monotonic()
+			if delay > 0:
+				time.sleep(delay)
+			else:
+				next_sample_time = time.monotonic()  # behind. Don't try to catch up with a burst of samples
+
+	# Take one sample and add it to the buffer. Returns the sample, or None if the battery did not answer.
+	def poll_once(self):
+		timestamp = time.time()
+		try:
+			sample = self.read_sample()
+		except Exception as e:
+			sample = None
+			self.last_error = e
+		if sample is None:
+			self.failed_samples += 1
+			return None
+		self.buffer.append(timestamp, sample)
+		self.samples_taken += 1
+		return sample
+
+	def read_sample(self):
+		if self.node_id is not None:
+			status_data = self.wstcan.readStatus(self.node_id)
+			if not self.parse:
+				return status_data
+			decoder = self.wstcan.p2_status_decoder
+			return decoder.status_dict(decoder.decode(status_data))
+
+		voltage_status = self.wstcan.getVoltageStatus()
+		current_status = self.wstcan.getCurrentStatus()
+		power_status = self.wstcan.getPowerStatus()
+		if not voltage_status or not current_status or not power_status:
+			return None
+		if not self.parse:
+			return {'voltage_status': voltage_status, 'current_status': current_status, 'power_status': power_status}
+		return {
+			'parsed_voltage_status': self._sp_parser.parse_voltage_status(voltage_status),
+			'parsed_current_status': self._sp_parser.parse_current_status(current_status),
+			'parsed_power_status': self._sp_parser.parse_power_status(power_status)
+		}
+
+	# (timestamp, sample) of the newest sample or None
+	def latest(self):
+		return self.buffer.latest()
+
+	def history(self, seconds=None, max_samples=None):
+		"""
+		The buffered samples, oldest first.
+		:arguments
+			seconds: only the samples of the last seconds
+			max_samples: only the newest max_samples samples
+		:returns
+			list of (timestamp, sample). timestamp is time.time() at the start of the sample.
+		"""
+		since = None if seconds is None else time.time() - seconds
+		return self.buffer.history(since=since, max_samples=max_samples)
@@ -1,10 +1,19 @@
 # SEE CHANGELOG FILE
+import copy
+import functools
 import random
 import string
 
 # CANbus lib
 from pcanbasic.PCANBasic import *  ## PCAN-Basic library import
 from spparser.SpParser import SpParser
+from wstcan.CanFilterManager import CanFilterManager
+from wstcan.CanReceiver import CanReceiver
+from wstcan.FrameAssembly import SpPackageAssembler, P2StatusAssembler
+from wstcan.P2StatusDecoder import P2StatusDecoder
+from wstcan.RackPoller import RackPoller
+from wstcan.ReceiveEvent import ReceiveEvent
+from wstcan.TelemetryPoller import TelemetryPoller
 
 import time
 from datetime import datetime
@@ -16,10 +25,14 @@ from pathlib import Path
 import xlsxwriter
 
 # Variables for use with pcanAPI
-PCANBasic = PCANBasic()
+_PCANBasicDriver = PCANBasic
+PCANBasic = None  # the shared PCAN-Basic driver. Loaded by default_transport on first use, not on import.
 PCANHANDLE = PCAN_USBBUS1
 ZERO_8BYTE_FRAME = [0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
 EMPTY_FRAME = []
+SP_FRAME_GROUP = "sp"  # receiver group for the SP 0x001, 0x002 and 0x003 frames, which must be read in order
+# read/write results that mean the channel has to be reinitialized before it can be used again in a session.
+SESSION_REINIT_ERRORS = PCAN_ERROR_BUSOFF | PCAN_ERROR_INITIALIZE | PCAN_ERROR_ILLHANDLE | PCAN_ERROR_ILLOPERATION
 
 _SP_MODEL_TO_WST_MODEL_NAME_TABLE = {
 
@@ -124,8 +137,38 @@ _POSSIBLESTATUSCODES = [
 ]
 
 
+# The PCAN-Basic driver, loaded the first time it is needed. Loading fails when the PCAN library is not installed.
+def default_transport():
+	global PCANBasic
+	if PCANBasic is None:
+		PCANBasic = _PCANBasicDriver()
+	return PCANBasic
+
+
+# Keeps the identity replies (see identity_commands) for the duration of a readout that asks for the same identity data
+# several times, also outside a session. The replies are dropped when the outermost such call returns, unless the cache
+# was already enabled by open_session.
+def _identity_cached(method):
+	@functools.wraps(method)
+	def wrapper(self, *args, **kwargs):
+		if self.identity_cache_enabled:
+			return method(self, *args, **kwargs)
+		self.identity_cache_enabled = True
+		try:
+			return method(self, *args, **kwargs)
+		finally:
+			self.identity_cache_enabled = False
+			self.clear_identity_cache()
+
+	return wrapper
+
+
 class WSTCan:
-	def __init__(self, debugging=False, baudrate=250):
+	# channel is the PCAN channel handle (PCAN_USBBUS1, PCAN_USBBUS2, ...). Use one WSTCan object per channel.
+	# transport is anything with the PCANBasic methods, eg. a ReplayTransport or a SocketCanTransport. Defaults to the PCAN-Basic driver.
+	def __init__(self, debugging=False, baudrate=250, channel=PCANHANDLE, transport=None):
+		self.pcan = transport if transport is not None else default_transport()
+		self.channel = channel
 		self.baudrate = None
 		if os.path.isfile("baudrate.txt"):
 			try:
@@ -140,11 +183,27 @@ class WSTCan:
 			except:
 				pass
 		self.filters_ready = False
+		self.session_active = False
+		self.session_needs_reinit = False
+		self.session_started_receiver = False
 		self.debugging = debugging
 		self.timeout = 1
 		self.protocol_2_bluebotics_ids = [0x68E, 0x68D]
 		self.protocol_2_default_ids = [0x00E, 0x00D]
 		self.protocol_2_ids = [0x00E, 0x00D]
+		self.sp_can_ids = [0x001, 0x002, 0x003]
+		self.p2_status_decoder = P2StatusDecoder()
+		self.receiver = None
+		self.telemetry_poller = None
+		self.receive_event = ReceiveEvent(self.pcan, self.channel)
+		self.can_filters = CanFilterManager(self.pcan, self.channel)  # the acceptance filter programmed in the driver
+		self.min_receive_timeout = 0.010  # shortest time a read waits for the background receiver
+		# SP frame pacing is given in frame times at the current bitrate, so it scales with the baudrate.
+		self.bitrate = 250000
+		self.sp_frame_spacing = 4  # bus time of this many frames between two frames of an SP command/package
+		self.min_sp_frame_spacing = 0.001  # seconds. The BMS needs some time per frame, even at high bitrates
+		self.sp_package_response_timeout = 0.3  # max time to wait for the BMS to start answering a written package
+		self.sp_package_read_retries = 110  # readPackage retries after a package. Covers the old 300ms sleep + 250ms
 		self.voltageStatusCommand = bytes.fromhex("EAD10104FF02F9F5")
 		self.currentStatusCommand = bytes.fromhex("EAD10104FF03F8F5")
 		self.powerStatusCommand = bytes.fromhex("EAD10104FF04FFF5")
@@ -164,13 +223,52 @@ class WSTCan:
 		# add number of cells in next byte, then n, highbyte, lowbyte, (3 bytes per cell) with 0.1mv unit. see the docs
 		self.calibrate_cell_voltages_command_start = [0xEA, 0xD1, 0x01, 0x1E, 0xFF, 0x0F, 0x02]
 		self.get_raw_cell_voltages_command = bytes.fromhex("EAD10105FF0F00F5F5")
+		# Replies to these commands (model field, BMS model and serial) and the firmware version are cached while
+		# identity_cache_enabled is set, which is in a session and during the composite readouts like getModelString and
+		# get_battery_description. The cache is cleared on writes to them, reconnects and when a query fails.
+		self.identity_commands = [self.readModelnumberCommand, self.readBMSModelnumberCommand, self.serialCommand]
+		self.identity_cache_enabled = False
+		self.identity_cache = {}
+		# A log download stopped before the end of the log leaves the BMS sending the rest of it. The next command on the
+		# same protocol first reads and throws away the rest (see flushLogTransfers), so it doesn't end up in its reply.
+		self.pending_log_transfers = {}  # "sp"/"p2": (command CAN-IDs, reply key, reply CAN-IDs)
+		self.log_flush_quiet_time = 0.25  # the rest of the log has been sent when none of it arrived for this long
+		self.log_flush_timeout = 60  # max seconds to spend reading the rest of a log
 		self.setBaudrate(baudrate)
 		self.type = "CAN"
 
 	def set_protocol2_ids(self, send_id, recv_id):
 		self.protocol_2_ids = [send_id, recv_id]
+		if self.receiver is not None:
+			self.receiver.route_by_node_id(recv_id)
 		self.init_filters()
 
+	# Starts a background thread that drains the PCAN receive queue and sorts the frames per CAN-ID (and per node id for
+	# protocol 2). While it runs, all the read methods wait on those queues instead of polling PCANBasic.Read themselves.
+	def start_receiver(self):
+		if self.receiver is None:
+			self.receiver = CanReceiver(self.pcan, self.channel, on_error=self.check_bus_status,
+																	receive_event=self.receive_event)
+		self.receiver.set_group(self.sp_can_ids, SP_FRAME_GROUP)
+		self.receiver.route_by_node_id(self.protocol_2_ids[1])
+		self.receiver.start()
+
+	def stop_receiver(self):
+		if self.receiver is not None:
+			self.receiver.stop()
+
+	def receiver_running(self):
+		return self.receiver is not None and self.receiver.is_running()
+
+	# Sleep until the driver has received a frame, but at most timeout seconds. Falls back to a plain sleep when the
+	# driver has no receive event.
+	def wait_for_frames(self, timeout):
+		return self.receive_event.wait(timeout)
+
+	# Translate the old "number of empty polls" style timeouts to seconds for the background receiver.
+	def receive_timeout(self, polls, sleep_per_poll):
+		return max(polls * sleep_per_poll, self.min_receive_timeout)
+
 	#  returns current status if no param, otherwise set on or off.
 	def bluebotics_protocol_enabled(self, setstatus=None):
 		if setstatus is None:
@@ -237,54 +335,62 @@ class WSTCan:
 		assert baudrate in baudrate_dict.keys()
 
 		self.baudrate = baudrate_dict[baudrate]
+		self.bitrate = baudrate * 1000
+		self.clear_identity_cache()
+		if self.session_active:
+			self.session_needs_reinit = True  # the new baudrate is applied before the next query
 		if verbose:
 			print("baudrate set to %s" % baudrate)
 
 	def wakeBMS(self, ID=0x004, DATA=[0, 0, 0, 0, 0, 0, 0, 0], retries=2):
+		self.clear_identity_cache()
 		for i in range(retries):
 			print("Sending wake")
-			PCANBasic.Uninitialize(PCANHANDLE)
-			PCANBasic.Initialize(PCANHANDLE, self.baudrate)
+			self.pcan.Uninitialize(self.channel)
+			self.pcan.Initialize(self.channel, self.baudrate)
+			self.receive_event.reset()
+			self.can_filters.reset()
 			self.writeCANFrame(ID, DATA)
+		if self.session_active:
+			self.init_filters()
 
 	def wakeBMS2(self, ID=0x001, DATA=[]):
 		# print("Wake called")
 		if not self.isBatteryConnected():
+			self.clear_identity_cache()
 			for i in range(12):
-				PCANBasic.Uninitialize(PCANHANDLE)
-				PCANBasic.Initialize(PCANHANDLE, self.baudrate)
+				self.pcan.Uninitialize(self.channel)
+				self.pcan.Initialize(self.channel, self.baudrate)
+				self.receive_event.reset()
+				self.can_filters.reset()
 				self.writeCANFrame(ID, DATA)
-
+			if self.session_active:
+				self.init_filters()
+
+	# The IDs that are always received: SP (1-3), the configured protocol 2 receive id and 0x7C0.
+	def base_can_filters(self):
+		return [
+			[1, 3],
+			[self.protocol_2_ids[1], self.protocol_2_ids[1]],  # We use the configured can_id to receive protocol 2
+			[0x7C0, 0x7C0]
+		]
+
+	# Make sure the driver accepts the base IDs and extra_can_filter ([from_id, to_id]). The filter manager only calls
+	# the driver when one of them is not accepted yet, so this is cheap to call before every read.
 	def init_filters(self, extra_can_filter=[]):
-		# print("extra_can_filter set to %s" % extra_can_filter)
-		#  The message filter is closed first to ensure the reception of the new range of IDs.
-		#
-		result = PCANBasic.SetValue(PCANHANDLE, PCAN_MESSAGE_FILTER, PCAN_FILTER_CLOSE)
+		self.can_filters.set_base(self.base_can_filters())
+		if len(extra_can_filter) > 0:
+			self.can_filters.require("extra", [extra_can_filter])
+		else:
+			self.can_filters.release("extra")
+		result = self.can_filters.update()
 		if result != PCAN_ERROR_OK:
 			# An error occurred, get a text describing the error and show it
 			#
-			result = PCANBasic.GetErrorText(result)
+			result = self.pcan.GetErrorText(result)
 			print(result[1])
-		else:
-			# The message filter is configured to receive the IDs 2,3,4 and 5 on the PCAN-USB, Channel 1
-			#
-			can_filters = [
-				[1, 3],
-				[self.protocol_2_ids[1], self.protocol_2_ids[1]],  # We use the configured can_id to receive protocol 2
-				[0x7C0, 0x7C0]
-			]
-			if len(extra_can_filter) > 0:
-				can_filters.append(extra_can_filter)
-			for can_filter in can_filters:
-				result = PCANBasic.FilterMessages(PCANHANDLE, can_filter[0], can_filter[1], PCAN_MODE_STANDARD)
-				if result != PCAN_ERROR_OK:
-					# An error occurred, get a text describing the error and show it
-					#
-					result = PCANBasic.GetErrorText(result)
-					print(result[1])
-				else:
-					# print("Filter successfully configured.")
-					pass
+			return False
+		return True
 
 	def uninitialize(self):
 		self.uninitializePCAN()
@@ -292,17 +398,76 @@ class WSTCan:
 	def initialize(self, baudrate="Deprecated - use setBaudrate method"):
 		return self.initializePCAN()
 
+	# Session mode: the channel and the filters are opened once and kept open across all queries until close_session.
+	# initializePCAN and uninitializePCAN do nothing in a session, except reinitializing after a detected bus error.
+	# Can also be used as a context manager: with WSTCan() as wstcan: ...
+	# cache_identity keeps the model, serial and firmware replies for the session (see identity_commands).
+	def open_session(self, start_receiver=False, cache_identity=True):
+		self.session_active = True
+		self.identity_cache_enabled = cache_identity
+		result = self.reinitializePCAN()
+		if start_receiver and not self.receiver_running():
+			self.start_receiver()
+			self.session_started_receiver = True
+		return result
+
+	def close_session(self):
+		if self.session_started_receiver:
+			self.stop_receiver()
+			self.session_started_receiver = False
+		self.session_active = False
+		self.session_needs_reinit = False
+		self.identity_cache_enabled = False
+		self.clear_identity_cache()
+		self.uninitializePCAN()
+
+	def __enter__(self):
+		self.open_session()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close_session()
+		return False
+
+	def reinitializePCAN(self):
+		self.clear_identity_cache()  # another battery may be connected after a reconnect
+		self.pcan.Uninitialize(self.channel)
+		result = self.pcan.Initialize(self.channel, self.baudrate)
+		self.receive_event.reset()
+		self.can_filters.reset()
+		if result != PCAN_ERROR_OK:
+			if self.debugging:
+				print("debug message after failed reinit: %s " % str(self.pcan.GetErrorText(result)[1]))
+			return False
+		self.init_filters()
+		self.filters_ready = True
+		self.session_needs_reinit = False
+		return True
+
+	# Mark the session channel for reinitialization if a read or write reported bus off or a lost channel.
+	def check_bus_status(self, status):
+		if self.session_active and (status & SESSION_REINIT_ERRORS):
+			self.session_needs_reinit = True
+
 	def uninitializePCAN(self):
+		if self.session_active:
+			return
 		self.filters_ready = False
-		PCANBasic.Uninitialize(PCANHANDLE)
+		self.pcan.Uninitialize(self.channel)
+		self.receive_event.reset()
+		self.can_filters.reset()
 
 	def initializePCAN(self, baudrate="Deprecated - use setBaudrate method"):
 		self.debugging = False
+		if self.session_active:
+			if self.session_needs_reinit:
+				return self.reinitializePCAN()
+			return True
 		# time.sleep(0.05)
 		# print("initializing")
 		if self.debugging:
 			print("initializing")
-		result = PCANBasic.GetStatus(PCANHANDLE)
+		result = self.pcan.GetStatus(self.channel)
 		if result == PCAN_ERROR_OK:
 			if self.debugging:
 				print("Get status: OK")
@@ -310,20 +475,21 @@ class WSTCan:
 		else:
 			if self.debugging:
 				print("Get status: NOT OK, reinitializing")
-			PCANBasic.Uninitialize(PCANHANDLE)
-			result = PCANBasic.Initialize(PCANHANDLE, self.baudrate)
+			self.pcan.Uninitialize(self.channel)
+			result = self.pcan.Initialize(self.channel, self.baudrate)
+			self.receive_event.reset()
+			self.can_filters.reset()
 			if result != PCAN_ERROR_OK:
 				# An error occurred, get a text describing the error and show it
 				#
-				result = PCANBasic.GetErrorText(result)
+				result = self.pcan.GetErrorText(result)
 				if self.debugging:
 					print("debug message after failed reinit: %s " % str(result[1]))
 				return False
 			else:
 				# self.wakeBMS()
-				if not self.filters_ready:
-					self.init_filters()
-					self.filters_ready = True
+				self.init_filters()  # the driver opened the filter again
+				self.filters_ready = True
 				return True
 
 	def getStatusCodeDescAbbrArray(self):
@@ -401,9 +567,8 @@ class WSTCan:
 				outputSerials.append(serial)
 		return outputSerials
 
-	def sendSPPackage(self, dataArray):
-
-		# Construct the frames from the data
+	# Split an SP package into zero padded 8 byte frames for the 0x002 ID
+	def splitIntoFrames(self, dataArray):
 		dataArray = list(dataArray)  # convert to normal list
 		frames = []
 		while len(dataArray) > 0:
@@ -415,25 +580,70 @@ class WSTCan:
 					frame.append(0)
 			frames.append(frame)
 			del dataArray[:8]
+		return frames
+
+	# Seconds between two frames of an SP command. A standard frame with 8 data bytes is at most ~135 bits with stuffing.
+	def spFrameSpacing(self):
+		return max(self.sp_frame_spacing * 135 / self.bitrate, self.min_sp_frame_spacing)
+
+	# response_timeout is the max time to wait for the BMS to start answering after the package is written. The answer
+	# is then read and thrown away until no SP frame arrived for response_timeout, so the tail of a late multi-frame
+	# answer can't end up in the next query. Use 0 when the answer is read right after, like queryBMS does.
+	def sendSPPackage(self, dataArray, response_timeout=None):
+
+		# Construct the frames from the data
+		frames = self.splitIntoFrames(dataArray)
+		spacing = self.spFrameSpacing()
 
 		self.writeCANFrame(0x001, ZERO_8BYTE_FRAME)
-		time.sleep(0.001)
+		time.sleep(spacing)
 
 		for frame in frames:
 			self.writeCANFrame(0x002, frame)
-			time.sleep(0.003)
+			time.sleep(spacing)
 
 		self.writeCANFrame(0x003, ZERO_8BYTE_FRAME)
-		time.sleep(0.3)
-
+		if response_timeout is None:
+			response_timeout = self.sp_package_response_timeout
+		if response_timeout > 0:
+			self.discardSPResponse(response_timeout)
 	def sendSPCommand(self, command):
+		spacing = self.spFrameSpacing()
 		self.writeCANFrame(0x001, ZERO_8BYTE_FRAME)
-		time.sleep(0.005)
+		time.sleep(spacing)
 
 		self.writeCANFrame(0x002, command)
-		time.sleep(0.005)
+		time.sleep(spacing)
 		self.writeCANFrame(0x003, ZERO_8BYTE_FRAME)
-		time.sleep(0.005)
+
+	# Read and throw away SP frames until none arrived for quiet_time seconds. Waits at most timeout seconds for the
+	# first frame, quiet_time defaults to timeout. Without the background receiver all other frames are thrown away too.
+	# Returns True if an SP frame was received.
+	def discardSPResponse(self, timeout, quiet_time=None):
+		return self.discardFrames(SP_FRAME_GROUP, self.sp_can_ids, timeout, timeout if quiet_time is None else quiet_time)
+
+	# Read and throw away the frames of key (a CAN-ID or receiver group) with the CAN-IDs can_ids until none arrived for
+	# quiet_time seconds, but at most max_time seconds. Waits at most timeout seconds for the first frame. Without the
+	# background receiver all other frames are thrown away too. Returns True if a frame was received.
+	def discardFrames(self, key, can_ids, timeout, quiet_time, max_time=None):
+		start = time.monotonic()
+		end = None if max_time is None else start + max_time
+		deadline = start + timeout
+		received = False
+		while True:
+			remaining = (deadline if end is None else min(deadline, end)) - time.monotonic()
+			if remaining <= 0:
+				return received
+			if self.receiver_running():
+				frame_received = self.receiver.get(key, timeout=remaining) is not None
+			else:
+				frame = self.readFrame()
+				if not frame:
+					self.wait_for_frames(min(remaining, 0.005))
+				frame_received = bool(frame) and frame.ID in can_ids
+			if frame_received:
+				received = True
+				deadline = time.monotonic() + quiet_time
 
 	def queryBMS(self, command, timeout=1, verbose=False, dataOnly=True, expectedPackages=1):
 		""" Send a command and receives a response from a BMS SP Style
@@ -445,15 +655,22 @@ class WSTCan:
 				:returns:
 						A bytearray with the response
 		"""
+		cache_key = None
+		if self.identity_cache_enabled and command in self.identity_commands:
+			cache_key = (bytes(command), dataOnly, expectedPackages)
+			if cache_key in self.identity_cache:
+				return copy.deepcopy(self.identity_cache[cache_key])
 		self.initializePCAN()
-		self.emptyQueue()  # Make sure the receive buffer is empty before trying new communication.
+		self.emptyQueue(can_ids=self.sp_can_ids)  # Make sure the receive buffer is empty before trying new communication.
+		read_retries = 50
 		if len(command) > 8:
-			self.sendSPPackage(command)
+			self.sendSPPackage(command, response_timeout=0)
+			read_retries = self.sp_package_read_retries
 		else:
 			self.sendSPCommand(command)
 		responseArray = []
 		for i in range(expectedPackages):
-			response = self.readPackage(dataOnly=False)
+			response = self.readPackage(retries=read_retries, dataOnly=False)
 
 			commandByteList = list(command)
 			if response and len(response) > 6 and commandByteList[:3] == response[:3]:
@@ -467,17 +684,24 @@ class WSTCan:
 				if self.debugging:
 					print("query bms response: %s " % response)
 		# print("commandByteList: %s" % commandByteList)
-		self.emptyQueue()
+		self.emptyQueue(can_ids=self.sp_can_ids)
 		self.uninitializePCAN()
 		if len(responseArray) > 0:
 
 			if expectedPackages == 1:
-				return responseArray[0]
+				result = responseArray[0]
 			else:
-				return responseArray
+				result = responseArray
+			if cache_key is not None:
+				self.identity_cache[cache_key] = copy.deepcopy(result)
+			return result
 		else:
+			self.clear_identity_cache()  # no answer. The battery may have been disconnected
 			return False
 
+	def clear_identity_cache(self):
+		self.identity_cache = {}
+
 	def queryBMSProtocol1(self, ID, payload=None, timeout=1, verbose=False, dataOnly=True):
 		""" Send a command and receives a response from a BMS SP Style
 				:arguments
@@ -489,7 +713,7 @@ class WSTCan:
 						A bytearray with the response
 		"""
 		self.initializePCAN()
-		self.init_filters(extra_can_filter=[0x000, 0x7FF])
+		self.init_filters()  # the reply comes on protocol_2_ids[1], which is always accepted
 		self.sendWSTCommand(ID, payload)
 		response = self.readWSTFrame(ID)
 		self.emptyQueue()
@@ -517,6 +741,8 @@ class WSTCan:
 			self.writeCANFrame(ID, bytes.fromhex(""))
 
 	def writeCANFrame(self, ID, payload):
+		if self.pending_log_transfers:
+			self.flushLogTransfers(ID)
 		# Check contents of message and do whatever is needed. As a
 		# simple test, print it (in real life, you would
 		# suitably update the GUI's display in a richer fashion).
@@ -528,22 +754,42 @@ class WSTCan:
 		# We get so much data as the Len of the message
 		for i in range(CANMsg.LEN):
 			CANMsg.DATA[i] = payload[i]
-		result = PCANBasic.Write(PCANHANDLE, CANMsg)
-		if result != PCAN_ERROR_OK:
+		result = self.pcan.Write(self.channel, CANMsg)
+		if result != PCAN_ERROR_OK and self.session_active:
+			self.reinitializePCAN()
+			self.pcan.Write(self.channel, CANMsg)
+		elif result != PCAN_ERROR_OK:
 			# print("error in canwrite")
-			# print(PCANBasic.GetErrorText(result))
-			PCANBasic.Uninitialize(PCANHANDLE)
-			PCANBasic.Initialize(PCANHANDLE, self.baudrate)
-			PCANBasic.Write(PCANHANDLE, CANMsg)
+			# print(self.pcan.GetErrorText(result))
+			self.pcan.Uninitialize(self.channel)
+			self.pcan.Initialize(self.channel, self.baudrate)
+			self.receive_event.reset()
+			self.can_filters.reset()
+			self.pcan.Write(self.channel, CANMsg)
+
+	# Read and throw away the rest of the log transfers stopped early, for the protocol a command sent on command_id
+	# uses (or all of them when command_id is None).
+	def flushLogTransfers(self, command_id=None):
+		for protocol, (command_ids, key, can_ids) in list(self.pending_log_transfers.items()):
+			if command_id is not None and command_id not in command_ids:
+				continue
+			del self.pending_log_transfers[protocol]
+			self.discardFrames(key, can_ids, self.log_flush_quiet_time, self.log_flush_quiet_time,
+												 max_time=self.log_flush_timeout)
 
 	def read_expected_frame(self, expectedID=0x001, timeout=10, sleepTime=0.050, verbose=False, fast=False):
-		self.init_filters(extra_can_filter=[expectedID, expectedID])
+		self.can_filters.require("expected_frame", [[expectedID, expectedID]])
+		self.init_filters()
+		if self.receiver_running():
+			pollTime = sleepTime if fast else sleepTime + 0.01
+			frame = self.receiver.get(expectedID, timeout=self.receive_timeout(timeout, pollTime))
+			return frame.DATA if frame else None
 		incomming_data_bundle = []
 		while timeout > 0:
 			timeout -= 1
-			readResult = PCANBasic.Read(PCANHANDLE)
+			readResult = self.pcan.Read(self.channel)
 			if verbose:
-				print(PCANBasic.GetErrorText(readResult[0]))
+				print(self.pcan.GetErrorText(readResult[0]))
 			# print(readResult[0])
 			if readResult[0] == PCAN_ERROR_OK:
 				if not fast:
@@ -555,23 +801,29 @@ class WSTCan:
 						incomming_data_bundle.append(readResult[1].DATA[i])
 					return incomming_data_bundle
 			elif readResult[0] == PCAN_ERROR_QRCVEMPTY:
-				if not fast:
-					time.sleep(0.01)
+				# wake as soon as the next frame arrives instead of always sleeping the full period.
+				self.wait_for_frames(sleepTime if fast else sleepTime + 0.01)
 				if self.debugging:
 					print("empty queue - skipping cycle")
-			time.sleep(sleepTime)
+			else:
+				self.check_bus_status(readResult[0])
+				time.sleep(sleepTime)
 		return None
 
 	def readWSTFrame(self, expectedID="will be overwritten below", timeout=10, sleepTime=0.050, verbose=False,
 									 fast=False):
-		self.init_filters(extra_can_filter=[expectedID, expectedID])
 		expectedID = self.protocol_2_ids[1]
+		self.init_filters()
+		if self.receiver_running():
+			pollTime = sleepTime if fast else sleepTime + 0.01
+			frame = self.receiver.get(expectedID, timeout=self.receive_timeout(timeout, pollTime))
+			return frame.DATA if frame else None
 		incomming_data_bundle = []
 		while timeout > 0:
 			timeout -= 1
-			readResult = PCANBasic.Read(PCANHANDLE)
+			readResult = self.pcan.Read(self.channel)
 			if verbose:
-				print(PCANBasic.GetErrorText(readResult[0]))
+				print(self.pcan.GetErrorText(readResult[0]))
 			# print(readResult[0])
 			if readResult[0] == PCAN_ERROR_OK:
 				if not fast:
@@ -583,22 +835,27 @@ class WSTCan:
 						incomming_data_bundle.append(readResult[1].DATA[i])
 					return incomming_data_bundle
 			elif readResult[0] == PCAN_ERROR_QRCVEMPTY:
-				if not fast:
-					time.sleep(0.01)
+				# wake as soon as the next frame arrives instead of always sleeping the full period.
+				self.wait_for_frames(sleepTime if fast else sleepTime + 0.01)
 				if self.debugging:
 					print("empty queue - skipping cycle")
-			time.sleep(sleepTime)
+			else:
+				self.check_bus_status(readResult[0])
+				time.sleep(sleepTime)
 		return None
 
 	def readPackage(self, retries=50, dataOnly=True, offset_start=0, offset_end=0):
 		self.initializePCAN()
+		if self.receiver_running():
+			return self.readPackageFromReceiver(retries=retries, dataOnly=dataOnly, offset_start=offset_start,
+																					offset_end=offset_end)
 		debugging = False
 		incomming_data_bundle = []
 		rcv001 = False
 		rcv002 = False
 		while retries > 0:
 			retries -= 1
-			readResult = PCANBasic.Read(PCANHANDLE)
+			readResult = self.pcan.Read(self.channel)
 			if readResult[0] == PCAN_ERROR_OK:
 				retries += 1
 				# Process the received message
@@ -629,12 +886,13 @@ class WSTCan:
 						return incomming_data_bundle
 
 			elif readResult[0] == PCAN_ERROR_QRCVEMPTY:
-				time.sleep(0.005)
+				self.wait_for_frames(0.005)
 				if debugging:
 					print("empty queue - skipping cycle")
 			else:
+				self.check_bus_status(readResult[0])
 				if debugging:
-					print("readpackage error: " + str(PCANBasic.GetErrorText(readResult[0], 9)[1]))
+					print("readpackage error: " + str(self.pcan.GetErrorText(readResult[0], 9)[1]))
 				time.sleep(0.05)
 
 		# if we get beyond the while loop, we are out of time, and the package was not read correctly.
@@ -643,17 +901,42 @@ class WSTCan:
 		self.initializePCAN()
 		return False
 
-	def emptyQueue(self, verbose=False):
-		PCANBasic.Reset(PCANHANDLE)
+	# Same as readPackage, but waits on the background receiver. retries is the number of 5ms periods without frames.
+	def readPackageFromReceiver(self, retries=50, dataOnly=True, offset_start=0, offset_end=0):
+		assembler = SpPackageAssembler()
+		while True:
+			frame = self.receiver.get(SP_FRAME_GROUP, timeout=self.receive_timeout(retries, 0.005))
+			if frame is None:
+				break
+			if assembler.add_frame(frame.ID, frame.DATA):
+				return assembler.package(dataOnly=dataOnly, offset_start=offset_start, offset_end=offset_end)
+
+		if self.debugging:
+			print("Read Package retries")
+		return False
+
+	# can_ids limits the cleaning to those CAN-IDs when the background receiver is running. Without the receiver the
+	# whole PCAN queue is always emptied.
+	def emptyQueue(self, verbose=False, can_ids=None):
+		if self.receiver_running():
+			if can_ids is None:
+				self.receiver.clear()
+			else:
+				for can_id in can_ids:
+					self.receiver.clear(can_id)
+			return
+		self.pcan.Reset(self.channel)
 		while self.readFrame():
 			if self.debugging or verbose:
 				print("emptyQueue cleaning frame")
 
 	def readFrame(self):
-		readResult = PCANBasic.Read(PCANHANDLE)
+		readResult = self.pcan.Read(self.channel)
 		if readResult[0] == PCAN_ERROR_OK:
 			return readResult[1]
 		else:
+			if readResult[0] != PCAN_ERROR_QRCVEMPTY:
+				self.check_bus_status(readResult[0])
 			return False
 
 	def getVoltageStatus(self):
@@ -702,6 +985,7 @@ class WSTCan:
 		response = self.queryBMS(self.powerStatusCommand)
 		return response
 
+	@_identity_cached
 	def getBMSModelString(self, dataFormat="ascii", verbose=False, retries=10, spnaming=False):
 		self.initializePCAN()
 
@@ -769,6 +1053,7 @@ class WSTCan:
 
 		return self.getBMSSerialNumber(retries=retries - 1)  # return recursive functioncall to leverage retries
 
+	@_identity_cached
 	def getModelString(self, dataFormat="ascii", verbose=False, retries=5, noFilter=False):
 		if retries == 0:
 			return False
@@ -826,6 +1111,7 @@ class WSTCan:
 		package.append(self.calcXOR(package[3:]))
 		package.append(0xF5)
 		# print(arrayToHex(package))
+		self.clear_identity_cache()
 		self.sendSPPackage(package)
 		self.emptyQueue()
 
@@ -843,6 +1129,7 @@ class WSTCan:
 		package = list(bytes.fromhex(self.writeSerialNumberCommandPrefix % lengthAsHexString)) + package
 		package.append(self.calcXOR(package[3:]))
 		package.append(0xF5)
+		self.clear_identity_cache()
 		self.sendSPPackage(package)
 		self.emptyQueue()
 
@@ -980,23 +1267,116 @@ class WSTCan:
 		return logArray
 
 	def getLog(self, asarray=False, includeStats=False, dataOnly=True):
-		logArray = []
+		return list(self.iterLog(includeStats=includeStats, dataOnly=dataOnly))
+
+	def iterLog(self, includeStats=False, dataOnly=True, max_records=None, stop_before_date=None, progress=None,
+							drain=False, stop_at=None):
+		"""
+		Download the log and yield each record as soon as its package is received.
+		:arguments
+			includeStats: also yield the two statistics packages sent before the records
+			dataOnly: yield the 33 byte records instead of the full packages
+			max_records: stop after this many log records (statistics not counted)
+			stop_before_date: datetime. Stop at the first record dated before this. The BMS sends the newest record
+				first, so this gives the history since that date. Records with an invalid date don't stop the download.
+			progress: function called with the number of log records received so far, after each record
+			stop_at: function taking the 33 byte record. The download stops at the first record it returns True for.
+			drain: when max_records, stop_before_date or stop_at stop the download, read (and drop) the rest of the log
+				before returning. By default it returns right away and the rest of the log is read and dropped before the
+				next SP command instead (see flushLogTransfers), so it never ends up in the reply of a query. The BMS has
+				no command to stop sending the log, so that only saves time if there is other work in between.
+		:returns
+			a generator of records (or packages if dataOnly is False). Closing the generator before the log ends (eg.
+			break out of a for loop) returns right away, like drain=False.
+		"""
 		self.initializePCAN()
+		self.emptyQueue(can_ids=self.sp_can_ids)
 		self.sendSPCommand(self.logCommand)
-		time.sleep(0.050)
-		logFrame = self.readPackage(dataOnly=False)
-		while len(logFrame) > 8:
-			if (logFrame[5] == 0x09) and (includeStats == False):
-				logFrame = self.readPackage(dataOnly=False)  # read next frame
-				continue  # skip frame if we are not including stats
-			if dataOnly:
-				logArray.append(logFrame[6:39])
-			else:
-				logArray.append(logFrame)
-			logFrame = self.readPackage(dataOnly=False)
-		self.emptyQueue()
-		self.uninitializePCAN()
-		return logArray
+		records = 0
+		stopped_early = False  # stopped by max_records, stop_before_date or stop_at. Not set when the generator is closed
+		log_ended = False
+		try:
+			while True:
+				logFrame = self.readPackage(dataOnly=False)
+				if not logFrame or len(logFrame) <= 8:  # the log ends with a short package
+					log_ended = True
+					return
+				is_stats = logFrame[5] == 0x09
+				if not is_stats:
+					if max_records is not None and records >= max_records:
+						stopped_early = True
+						return
+					if stop_before_date is not None:
+						try:
+							record_date = SpParser.sp_log_datetime(logFrame[7:13])
+						except ValueError:
+							record_date = None
+						if record_date is not None and record_date < stop_before_date:
+							stopped_early = True
+							return
+					if stop_at is not None and stop_at(logFrame[6:39]):
+						stopped_early = True
+						return
+					records += 1
+				elif not includeStats:
+					continue  # skip frame if we are not including stats
+				if dataOnly:
+					yield logFrame[6:39]
+				else:
+					yield logFrame
+				if not is_stats:
+					if progress is not None:
+						progress(records)
+					if max_records is not None and records >= max_records:
+						stopped_early = True
+						return
+		finally:
+			if drain and stopped_early:
+				logFrame = self.readPackage(dataOnly=False)
+				while logFrame and len(logFrame) > 8:
+					logFrame = self.readPackage(dataOnly=False)
+			elif not log_ended:
+				self.pending_log_transfers["sp"] = (self.sp_can_ids, SP_FRAME_GROUP, self.sp_can_ids)
+			self.emptyQueue()
+			self.uninitializePCAN()
+
+	def syncLog(self, store, serial=None, newest_first=True, progress=None, drain=False):
+		"""
+		Add the log records that are not in the local store yet to it. Only the new records are stored and returned.
+		:arguments
+			store: SpLogStore
+			serial: key of the battery in the store. Read from the BMS when not given
+			newest_first: the BMS sends the newest record first, so reading stops at the first stored record.
+				If False the whole log is downloaded and the stored records are dropped.
+			progress: see iterLog
+			drain: see iterLog. By default the sync returns at the first stored record and the rest of the log is
+				dropped before the next SP command. With True it reads the rest of the log before returning.
+		:returns
+			the new records, in download order
+		"""
+		if serial is None:
+			serial = self.getSerial("hex")
+			if not serial:
+				raise Exception("Could not read the serial number of the battery")
+		known_records = store.known_records(serial)
+		if newest_first:
+			new_records = list(
+				self.iterLog(progress=progress, drain=drain, stop_at=lambda record: tuple(record) in known_records))
+		else:
+			new_records = self.newRecords(self.iterLog(progress=progress), store.load(serial))
+		store.merge(serial, new_records, newest_first=newest_first)
+		return new_records
+
+	# Records from an oldest first download that come after the newest stored record.
+	def newRecords(self, downloaded_records, stored_records):
+		downloaded_records = list(downloaded_records)
+		if len(stored_records) == 0:
+			return downloaded_records
+		newest_stored_record = list(stored_records[0])
+		for i in range(len(downloaded_records) - 1, -1, -1):
+			if list(downloaded_records[i]) == newest_stored_record:
+				return downloaded_records[i + 1:]
+		return downloaded_records
 
 	def getRawLogStats(self):
 		logStats = []
@@ -1026,13 +1406,18 @@ class WSTCan:
 			except:
 				return None
 		else:
+			if self.identity_cache_enabled and "firmware_version" in self.identity_cache:
+				return self.identity_cache["firmware_version"]
 			try:
 				self.initializePCAN()
 				response = self.getCurrentStatus()
 				if verbose:
 					print(response)
 				self.uninitializePCAN()
-				return response[13 + response[7]]  # firmware version byte is offset by temp probe count in byte 7.
+				firmware_version = response[13 + response[7]]  # firmware version byte is offset by temp probe count in byte 7.
+				if self.identity_cache_enabled:
+					self.identity_cache["firmware_version"] = firmware_version
+				return firmware_version
 			except:
 				return None
 
@@ -1075,8 +1460,12 @@ class WSTCan:
 
 	# Returns an array with two objects [serials, ids]
 	# each object has key values where key is the serials in the serials object and values are the corresponding ids. ITs reversed in the ids object.
-	def scanNodeIDs(self, verbose=False):
+	# pipelined=True sends the status requests to batch_size node ids at a time and sorts the replies by node id in one
+	# receive loop. A batch is done when all its nodes answered or nothing arrived for quiet_time seconds.
+	def scanNodeIDs(self, verbose=False, pipelined=False, batch_size=32, quiet_time=0.050):
 		self.initializePCAN()
+		if pipelined:
+			return self.scanNodeIDsPipelined(verbose=verbose, batch_size=batch_size, quiet_time=quiet_time)
 		time.sleep(1)
 		NODE_IDsToFind = len(self.getSerials())
 		if verbose:
@@ -1098,13 +1487,71 @@ class WSTCan:
 		return False
 		self.uninitializePCAN()
 
-	def getAvailableNodeIDs(self):
+	def scanNodeIDsPipelined(self, verbose=False, batch_size=32, quiet_time=0.050):
+		NODE_IDsToFind = len(self.getSerials())
+		if verbose:
+			print("Looking for %s ids" % NODE_IDsToFind)
+		self.initializePCAN()
+		serials = {}
+		ids = {}
+		node_ids = list(range(2, 256))
+		for batch_start in range(0, len(node_ids), batch_size):
+			assemblers = {}
+			self.emptyQueue(can_ids=[self.protocol_2_ids[1]])
+			for node_id in node_ids[batch_start:batch_start + batch_size]:
+				assemblers[node_id] = P2StatusAssembler(node_id)
+				self.writeCANFrame(self.protocol_2_ids[0], [0x01, node_id, 0x00, 0x00, 0x00, 0x00, 0x00, 0x01])
+			pending = len(assemblers)
+			while pending > 0:
+				data = self.readP2Frame(quiet_time)
+				if data is None:
+					break
+				assembler = assemblers.get(data[0])
+				if assembler is None or assembler.complete:
+					continue
+				if assembler.add_frame(data):
+					pending -= 1
+					try:
+						serial = self.serialFromStatusData(assembler.data)
+					except (IndexError, ValueError):
+						continue
+					if verbose:
+						print("serial %s has id %s" % (serial, assembler.node_id))
+					serials[serial] = assembler.node_id
+					ids[assembler.node_id] = serial
+					if len(ids) == NODE_IDsToFind:
+						self.uninitializePCAN()
+						return [serials, ids]
+		self.uninitializePCAN()
+		return False
+
+	# Next frame on the protocol 2 receive id from any node, or None if nothing arrived within timeout seconds.
+	def readP2Frame(self, timeout):
+		receive_id = self.protocol_2_ids[1]
+		if self.receiver_running():
+			frame = self.receiver.get(receive_id, timeout=max(timeout, self.min_receive_timeout))
+			return frame.DATA if frame else None
+		deadline = time.monotonic() + timeout
+		while True:
+			readResult = self.pcan.Read(self.channel)
+			if readResult[0] == PCAN_ERROR_OK:
+				if readResult[1].ID == receive_id:
+					return list(readResult[1].DATA)
+				continue
+			if readResult[0] != PCAN_ERROR_QRCVEMPTY:
+				self.check_bus_status(readResult[0])
+			remaining = deadline - time.monotonic()
+			if remaining <= 0:
+				return None
+			self.wait_for_frames(min(remaining, 0.005))
+
+	def getAvailableNodeIDs(self, pipelined=False):
 		retry_counter = 5
 		nodes = None
 		while retry_counter > 0:
 			retry_counter = retry_counter - 1
 			try:
-				nodes = self.scanNodeIDs()
+				nodes = self.scanNodeIDs(pipelined=pipelined)
 				if nodes:
 					break
 			except:
@@ -1114,65 +1561,45 @@ class WSTCan:
 			nodelist.append(nodeid)
 		return (nodelist)
 
+	# Status data of NODE_ID as a bytearray, reassembled by P2StatusAssembler. Frames may arrive out of order.
 	def readStatus(self, NODE_ID, retries=100, sleepTime=0.005, verbose=False, initialized=False):
 		if not initialized:
 			self.initializePCAN()
 		# request status from NODE_ID
 		NODE_ID = int(NODE_ID)
+		if self.receiver_running():
+			return self.readStatusFromReceiver(NODE_ID, retries=retries, sleepTime=sleepTime)
 		self.emptyQueue()
 		self.writeCANFrame(self.protocol_2_ids[0], [0x01, int(NODE_ID), 0x00, 0x00, 0x00, 0x00, 0x00, 0x01])
-		time.sleep(0.005)
-		data_bundle_incomplete = True
-
-		data_array = []
-		data_length = 0
-		total_frames = 0
-		while data_bundle_incomplete:
-			# print("NODE: %s - Retry %s " % (NODE_ID, retries))
-			readResult = PCANBasic.Read(PCAN_USBBUS1)
-			if readResult[0] != PCAN_ERROR_OK:
-				# print(PCANBasic.GetErrorText(readResult[0]))
-				pass
+		receive_id = self.protocol_2_ids[1]
+		assembler = P2StatusAssembler(NODE_ID)
+		while True:
+			readResult = self.pcan.Read(self.channel)
 			if readResult[0] == PCAN_ERROR_OK:
 				retries += 1
-				# Process the received message
-				#
-				if (readResult[1].ID == self.protocol_2_ids[1]
-					and readResult[1].DATA[0] == int(NODE_ID)
-					and readResult[1].DATA[1] == 0
-					and readResult[1].DATA[2] == 1
-					and readResult[1].DATA[7] == 0):
-					# we add one here, because SP made mistake in implementation. Will be fixed in next revision.
-					total_frames = readResult[1].DATA[3]
-					incomming_data_bundle = []
-
-				if (readResult[1].DATA[0] == NODE_ID
-					and readResult[1].DATA[7] == 1):
-					for i in range(2, 7):
-						data_array.append(readResult[1].DATA[i])
-
-				if (readResult[1].DATA[0] == NODE_ID
-					and readResult[1].DATA[7] > 1):
-					for i in range(1, 7):
-						data_array.append(readResult[1].DATA[i])
-
-				if (readResult[1].DATA[0] == NODE_ID
-					and readResult[1].DATA[7] == total_frames - 1):  #
-					data_bundle_incomplete = False
-					return (data_array)
-					frame_number = 1
-					while len(data_array) >= 8:
-						temp_array = []
-						for i in range(0, 8):
-							temp_array.append(data_array.pop(0))
-						frame_number += 1
-
-			time.sleep(sleepTime)
+				if readResult[1].ID == receive_id and assembler.add_frame(readResult[1].DATA):
+					return assembler.data
+			else:
+				self.check_bus_status(readResult[0])
+				self.wait_for_frames(sleepTime)
 			retries -= 1
 			if retries < 1:
 				raise Exception("ERROR 102: Could not read status data P2")
-		if not initialized:
-			self.uninitializePCAN()
+
+	# Same as readStatus, but waits on the background receiver for frames from NODE_ID only. Frames from other nodes
+	# stay in their own queues. retries is the number of sleepTime periods without frames before giving up.
+	def readStatusFromReceiver(self, NODE_ID, retries=100, sleepTime=0.005):
+		receive_id = self.protocol_2_ids[1]
+		self.receiver.clear(receive_id, node_id=NODE_ID)
+		self.writeCANFrame(self.protocol_2_ids[0], [0x01, NODE_ID, 0x00, 0x00, 0x00, 0x00, 0x00, 0x01])
+
+		assembler = P2StatusAssembler(NODE_ID)
+		while True:
+			frame = self.receiver.get(receive_id, node_id=NODE_ID, timeout=self.receive_timeout(retries, sleepTime))
+			if frame is None:
+				raise Exception("ERROR 102: Could not read status data P2")
+			if assembler.add_frame(frame.DATA):
+				return assembler.data
 
 	def getSerialP2(self, NODE_ID, verbose=False, retries=10, sleepTime=0.005, initialized=False):
 		if verbose:
@@ -1180,14 +1607,7 @@ class WSTCan:
 		try:
 			statusData = self.readStatus(NODE_ID, verbose=verbose, retries=retries, sleepTime=sleepTime,
 																	 initialized=initialized)
-			# Serial number
-			serial = ''
-			SERIAL_BEGIN_BYTE = 80
-			length = statusData[SERIAL_BEGIN_BYTE]
-			for i in range(1, 6):
-				serial = serial + "{:02x}".format(statusData[SERIAL_BEGIN_BYTE + i])
-				serial = serial[:length]
-			return int(serial)
+			return self.serialFromStatusData(statusData)
 		except Exception as e:
 			if verbose:
 				# raise e
@@ -1195,12 +1615,34 @@ class WSTCan:
 				print("Could not get serial")
 			return False
 
+	def serialFromStatusData(self, statusData):
+		# Serial number
+		serial = ''
+		SERIAL_BEGIN_BYTE = 80
+		length = statusData[SERIAL_BEGIN_BYTE]
+		for i in range(1, 6):
+			serial = serial + "{:02x}".format(statusData[SERIAL_BEGIN_BYTE + i])
+			serial = serial[:length]
+		return int(serial)
+
 	def get_status_as_dict(self, NODE_ID=2):
-		status_array = self.getStatus(NODE_ID=NODE_ID)
-		status_dict = {}
-		for data_point in status_array:
-			status_dict[data_point[0].lower().replace(" ", "_")] = data_point[1::]
-		return status_dict
+		status = self.get_status_record(NODE_ID)
+		if not status:
+			return {}
+		return self.p2_status_decoder.status_dict(status)
+
+	# Status of NODE_ID decoded into a P2Status record (see P2StatusDecoder), or False if the node did not answer.
+	def get_status_record(self, NODE_ID=2, retries=10, sleepTime=0.005):
+		try:
+			statusData = self.readStatus(NODE_ID, retries=retries, sleepTime=sleepTime)
+		except Exception:
+			return False
+		return self.p2_status_decoder.decode(statusData)
+
+	# Status of all nodes at once, requested in one burst: {node_id: status dict like get_status_as_dict}. Nodes that
+	# did not answer within timeout are left out. node_ids defaults to a scan of the bus. See RackPoller.
+	def get_rack_status(self, node_ids=None, timeout=0.3):
+		return RackPoller(self, node_ids=node_ids, timeout=timeout).read_snapshot()
 
 	def getStatus(self, NODE_ID, verbose=False, retries=10, sleepTime=0.005):
 		# print("get status for node: " + NODE_ID)
@@ -1210,184 +1652,11 @@ class WSTCan:
 			if verbose:
 				print("Could not get status")
 			return False
-		statusList = []
-
-		# Serial number
-		serial = ""
-		SERIAL_BEGIN_BYTE = 80
-		FIRST_SERIAL_BYTE = 81
-		for i in range(3):
-			serial = serial + "{:02x}".format(statusData[FIRST_SERIAL_BYTE + i])
-		statusList.append(['Serial', serial, ''])
-
-		# FW version
-		statusList.append(['Firmware Version', statusData[11] / 10, ''])
-		statusList.append(['Pack Voltage', (statusData[0] * 256 + statusData[1]) / 10, "V"])
-		statusList.append(['Charge Current', (statusData[2] * 256 + statusData[3]) / 10, 'A'])
-		statusList.append(['Discharge Current', (statusData[4] * 256 + statusData[5]) / 10, 'A'])
-		statusList.append(['SoC', statusData[6], '%'])
-		# we only show a rem charge if there is actual charge current - else it shows bogus value.
-		if (statusData[2] * 256 + statusData[3]) > 0:
-			statusList.append(['Estimated Charge Time Left', (statusData[7]) / 10, 'H'])
-		else:
-			statusList.append(['Estimated Charge Time Left', "Not Charging", ''])
-
-		# We calculate the resolution 1mAh or 10mAh
-		fullCapacity = statusData[12] * 256 + statusData[13]
-		remainingCapacity = statusData[8] * 256 + statusData[9]
-		capacityResolution = None
-		if fullCapacity > 65000:
-			capacityResolution = 10
-		else:
-			capacityResolution = 1
-		# we devide by 1000 to get Ah
-		statusList.append(['Full Capacity', (fullCapacity / 1), 'Ah'])
-		statusList.append(['Remaining Capacity', (remainingCapacity / 1), 'Ah'])
-		statusList.append(['SoH', statusData[10], '%'])
-
-		statusList.append(['Cycles', (statusData[14] * 256 + statusData[15]), '  - @80% DoD Cycles'])
-
-		##Status codes
-		status_index = [[0x0000, 'Idle'],
-										[0x0001, 'Discharge'],
-										[0x0002, 'Charge'],
-										[0x0004, 'OV'],
-										[0x0008, 'UV'],
-										[0x0010, 'COC'],
-										[0x0020, 'DOC'],
-										[0x0040, 'DOT'],
-										[0x0080, 'DUT'],
-										[0x0200, 'SC'],
-										[0x0400, 'COT'],
-										[0x0800, 'CUT']]
-		status_code_int = statusData[16] * 256 + statusData[17]
-		flags = []
-
-		for status_index_entry in reversed(
-			status_index):  # loop over all the possible status flags and assign as needed. Please notice that we can have multiple flags in one code!
-			if status_code_int >= status_index_entry[0]:
-				flags.append(status_index_entry[1])
-				if status_code_int == 0x0001 or status_code_int == 0x0002:  # if we are charging or discharging, then we cannot also be idle, so we break after this flag is added.
-					break
-				status_code_int = - status_index_entry[0]
-
-		statusList.append(['Status Flags', flags, ''])
-
-		##Temperatures
-		temp = statusData[18]
-		if temp > 127:
-			temp = (256 - temp) * (-1)
-		statusList.append(['Cell 1', temp, 'C'])
-
-		temp = statusData[19]
-		unit = 'C'
-		if temp == 0:
-			unit = "C - Please notice that not all BMS's have this probe. It will show 0C in case it is not present!"
-		if temp > 127:
-			temp = (256 - temp) * (-1)
-		statusList.append(['Cell 2', statusData[19], unit])
-
-		temp = statusData[22]
-		unit = 'C'
-		if temp == 0:
-			unit = "C - Please notice that not all BMS's have this probe. It will show 0C in case it is not present!"
-		if temp > 127:
-			temp = (256 - temp) * (-1)
-		statusList.append(['Mosfet', statusData[22], unit])
-
-		temp = statusData[23]
-		unit = 'C'
-		if temp == 0:
-			unit = "C - Please notice that not all BMS's have this probe. It will show 0C in case it is not present!"
-		if temp > 127:
-			temp = (256 - temp) * (-1)
-		statusList.append(['Ambient', statusData[23], unit])
-
-		# cells
-		cellVoltage = statusData[24] * 256 + statusData[25]
-		cellNumber = 0
-		while cellVoltage > 0:
-			if cellNumber > 100:
-				break
-			cellNumber += 1
-			cell_data = ['Cell ' + str(cellNumber) + " Voltage: ", cellVoltage, "mV"]
-			statusList.append(cell_data)
-			cellVoltage = statusData[24 + cellNumber * 2] * 256 + statusData[25 + cellNumber * 2]
-
-		# CP8
-		cp8_parser = {0: 'CP8 OFF',
-									1: 'CP8 ON',
-									2: 'OV Cycle',
-									3: 'OV Lifetime',
-									4: 'UV Cycle',
-									5: 'UV Lifetime',
-									6: '300mV Cell Diff',
-									7: '<2.65V/2.35V',
-									8: '>4.35V/3.8V',
-									9: 'SC Cycle',
-									10: 'SC Lifetime',
-									11: 'DOC Cycle',
-									12: 'DOC Lifetime',
-									13: 'COC Cycle',
-									14: 'COC Lifetime',
-									15: 'DOT Cycle',
-									16: 'DOT Lifetime',
-									17: 'DUT Cycle',
-									18: 'DUT Lifetime',
-									19: 'COT Cycle',
-									20: 'COT Lifetime',
-									21: 'CUT Cycle',
-									22: 'CUT Lifetime'}
-
-		# Add the cascade CP8 values to the parser
-		cp8_parser_enhanced = {}
-		for CP8Value, CP8Text in cp8_parser.items():
-			if CP8Value in [0, 1]:  # skip the off and on values
-				next
-			cp8_parser_enhanced[CP8Value] = CP8Text
-			cp8_parser_enhanced[CP8Value + 100] = "Cascaded CP8: %s" % CP8Text
-
-		cp8_parser = cp8_parser_enhanced  # reassign the new parser to the old variable
-
-		CP8ByteValue = statusData[72]  # get the CP8 value from the data
-		if CP8ByteValue in cp8_parser:
-			CPtext = cp8_parser[CP8ByteValue]
-		else:
-			CPtext = "Unkown CP8 Value: %s" % CP8ByteValue
-
-		statusList.append(['CP8 Flags', CPtext, ''])
-
-		# Alarms bitflags
-		alarm_index = [[0x00, 'Unbalanced'],
-									 [0x02, 'Cell or Pack OV'],
-									 [0x04, 'Cell or Pack UV'],
-									 [0x08, 'Charge Current High'],
-									 [0x10, 'Discharge Current High'],
-									 [0x20, 'Any over temperature'],
-									 [0x40, 'Any under temperature'],
-									 [0x80, 'Over temperature charge']]
-		alarm_flags = []
-		alarm_code_int = statusData[75]
-		for alarm_index_entry in reversed(alarm_index):
-			if alarm_code_int >= alarm_index_entry[0]:
-				alarm_flags.append(alarm_index_entry[1])
-				alarm_code_int = - alarm_index_entry[0]
-
-		statusList.append(['Alarm Flags', alarm_flags, ''])
-		# heating system
-		if statusData[79] == 1:
-			heating_string = 'Enabled'
-		else:
-			heating_string = 'Disabled'
+		return self.parseStatusData(statusData)
 
-		if statusData[78] == 1:
-			heating_status = 'True'
-		else:
-			heating_status = 'False'
-
-		statusList.append(['Heating System', heating_string, ''])
-		statusList.append(['Currently Heating', heating_status, ''])
-		return statusList
+	# Parse the status data of readStatus into [name, value, unit] entries.
+	def parseStatusData(self, statusData):
+		return self.p2_status_decoder.status_list(self.p2_status_decoder.decode(statusData))
 
 	def sendCommand(self, command, dataOnly=True, printCommand=False):
 		checksum = '{:02x}'.format(0x04 ^ 0xFF ^ command)
@@ -1402,32 +1671,64 @@ class WSTCan:
 		return response
 
 	def TestGetLogProtocol2(self, node_id):
+		return list(self.iterLogProtocol2(node_id))
+
+	# Yields the 33 byte log records of a protocol 2 node. stop_at and drain work like in iterLog: the rest of the log is
+	# only read before returning with drain=True after stop_at stopped the download. Otherwise it is read and dropped
+	# before the next protocol 2 command.
+	def iterLogProtocol2(self, node_id, stop_at=None, drain=False):
 
 		if node_id < 2 or 255 < node_id:
 			raise Exception("node_id not in range")
 
 		self.emptyQueue()
 		self.writeCANFrame(self.protocol_2_ids[0], [4, node_id, 0, 0, 0, 0, 1, 1])
-		log = []
 		logframe = []
 		readFrame = self.readWSTFrame()
-		while readFrame:
-			if readFrame[7] == 0:
-				# print("7 was 0")
-				logframe.append(readFrame[5])
-			if readFrame[7] == 1:
-				# print("7 was 1")
-				logframe = logframe + readFrame[2:7]
-			if readFrame[7] in [2, 3, 4, 5]:
-				# print("7 was 2-5")
-				logframe = logframe + readFrame[1:7]
-			if readFrame[7] == 6:
-				# print("7 was 6")
-				logframe = logframe + readFrame[1:4]
-				log.append(logframe)
-				logframe = []
-			readFrame = self.readWSTFrame()  # read next frame
-		return log
+		stopped_early = False
+		try:
+			while readFrame:
+				if readFrame[7] == 0:
+					# print("7 was 0")
+					logframe.append(readFrame[5])
+				if readFrame[7] == 1:
+					# print("7 was 1")
+					logframe = logframe + readFrame[2:7]
+				if readFrame[7] in [2, 3, 4, 5]:
+					# print("7 was 2-5")
+					logframe = logframe + readFrame[1:7]
+				if readFrame[7] == 6:
+					# print("7 was 6")
+					logframe = logframe + readFrame[1:4]
+					if stop_at is not None and stop_at(logframe):
+						stopped_early = True
+						return
+					yield logframe
+					logframe = []
+				readFrame = self.readWSTFrame()  # read next frame
+		finally:
+			if drain and stopped_early:
+				while readFrame:
+					readFrame = self.readWSTFrame()
+			elif readFrame:
+				self.pending_log_transfers["p2"] = (
+					[self.protocol_2_ids[0]], self.protocol_2_ids[1], [self.protocol_2_ids[1]])
+
+	# Protocol 2 version of syncLog. serial defaults to the serial reported by the node. As in syncLog, the sync returns at
+	# the first stored record unless drain is True.
+	def syncLogProtocol2(self, store, node_id, serial=None, newest_first=True, drain=False):
+		if serial is None:
+			serial = self.getSerialP2(node_id)
+			if not serial:
+				raise Exception("Could not read the serial number of node %s" % node_id)
+		known_records = store.known_records(serial)
+		if newest_first:
+			new_records = list(
+				self.iterLogProtocol2(node_id, drain=drain, stop_at=lambda record: tuple(record) in known_records))
+		else:
+			new_records = self.newRecords(self.iterLogProtocol2(node_id), store.load(serial))
+		store.merge(serial, new_records, newest_first=newest_first)
+		return new_records
 
 	def ParseAndSaveProtocol2LogToFile(self, log_array, filename, subdir="."):
 		filePath = Path(subdir, str(filename) + ".xlsx")
@@ -1622,43 +1923,55 @@ class WSTCan:
 				parameters[command] = self.sendCommand(command=command, dataOnly=dataOnly)
 		return parameters
 
+	# BD is for parameters. 0x04 0x10 reads a single byte parameter and 0x04 0x20 a short int parameter.
+	def customParameterReadPayload(self, node_id, parameterNumber, short_int=False):
+		return [0xBD, int(node_id), 0x00, int(parameterNumber), 0x00, 0x00, 0x04, 0x20 if short_int else 0x10]
+
+	# 0x04 0x40 writes a single byte parameter and 0x04 0x80 a short int parameter (high byte in 2, low byte in 4).
+	# The xor checksum of the other bytes goes to position 5.
+	def customParameterWritePayload(self, node_id, parameterNumber, data, short_int=False):
+		if short_int:
+			data_bytes = int(data).to_bytes(2, 'big')
+			payload = [0xBD, int(node_id), int(data_bytes[0]), int(parameterNumber), int(data_bytes[1]), 0x04, 0x80]
+		else:
+			payload = [0xBD, int(node_id), 0x00, int(parameterNumber), int(data), 0x04, 0x40]
+		checksum = 0
+		for byte in payload:
+			checksum = checksum ^ int(byte)
+		payload.insert(5, checksum)
+		return payload
+
+	# The value in a parameter reply. Single byte values are in byte 7, short ints have the high byte in 5 and low in 7.
+	def customParameterValue(self, response, short_int=False):
+		if short_int:
+			return SpParser().read_two_bytes_big_endian_from_array([response[5], response[7]], 0, True)
+		return int(response[7])
+
 	def readCustomParameter(self, node_id, parameterNumber):
 		# print("reading parameter %i from node_id: %i" % (parameterNumber, node_id))
-		# BD is for parameters
-		# 0x04 0x10 is the read command
-		payload = [0xBD, node_id, 0x00, parameterNumber, 0x00, 0x00, 0x04, 0x10]
+		payload = self.customParameterReadPayload(node_id, parameterNumber)
 		self.writeCANFrame(self.protocol_2_ids[0], payload)
 		time.sleep(0.3)
 		response = self.readWSTFrame()
 		if response:
-			data = response
-			#print("Response: %s" % data)
-			return int(data[7])
+			#print("Response: %s" % response)
+			return self.customParameterValue(response)
 		else:
 			# print("No response")
 			return False
 
 	def writeCustomParameter(self, node_id, parameterNumber, data):
 		# print("writing %i, to parameter #%i" % (data, parameterNumber))
-		payloadWithOutChecksum = [0xBD, int(node_id), 0x00, int(parameterNumber), int(data), 0x04, 0x40]
-		# print("payload no checksum %s" % payloadWithOutChecksum)
-		# calculate checksum and append
-		checksum = 0
-		for byte in payloadWithOutChecksum:
-			checksum = checksum ^ int(byte)
-		# insert checksum to position 5
-		payload = payloadWithOutChecksum
-		payload.insert(5, checksum)
+		payload = self.customParameterWritePayload(node_id, parameterNumber, data)
 		# print("payload to write: %s" % payload)
 		# write the frame
 		self.writeCANFrame(self.protocol_2_ids[0], payload)
 		time.sleep(0.3)
 		response = self.readWSTFrame()
-		data = response
 		if response:
-			# print("Response: %s" % data)
-			# print("Parameter #%i is now: %i" % (parameterNumber, data[7]))
-			return (data[7])
+			# print("Response: %s" % response)
+			# print("Parameter #%i is now: %i" % (parameterNumber, response[7]))
+			return self.customParameterValue(response)
 		else:
 			# print("No Response")
 			return False
@@ -1739,17 +2052,13 @@ class WSTCan:
 	def read_custom_parameter_short_int(self, node_id, parameter_number):
 		assert 30 >= parameter_number >= 1
 		# print("reading parameter %i from node_id: %i" % (parameterNumber, node_id))
-		# BD is for parameters
-		# 0x04 0x10 is the read command
-		payload = [0xBD, node_id, 0x00, parameter_number, 0x00, 0x00, 0x04, 0x20]
+		payload = self.customParameterReadPayload(node_id, parameter_number, short_int=True)
 		self.writeCANFrame(self.protocol_2_ids[0], payload)
 		time.sleep(0.5)
 		response = self.readWSTFrame()
 		if response:
 			# print("Response: %s" % data)
-			parser = SpParser()
-			result = parser.read_two_bytes_big_endian_from_array([response[5], response[7]], 0, True)
-			return result
+			return self.customParameterValue(response, short_int=True)
 		else:
 			# print("No response")
 			return False
@@ -1761,17 +2070,7 @@ class WSTCan:
 			raise Exception("Cannot write a value not within 0<=VALUE<=65535")
 		assert 30 >= parameter_number >= 1
 
-		data_bytes = data.to_bytes(2, 'big')
-		payloadWithOutChecksum = [0xBD, int(node_id), int(data_bytes[0]), int(parameter_number), int(data_bytes[1]), 0x04,
-															0x80]
-		# print("payload no checksum %s" % payloadWithOutChecksum)
-		# calculate checksum and append
-		checksum = 0
-		for byte in payloadWithOutChecksum:
-			checksum = checksum ^ int(byte)
-		# insert checksum to position 5
-		payload = payloadWithOutChecksum
-		payload.insert(5, checksum)
+		payload = self.customParameterWritePayload(node_id, parameter_number, data, short_int=True)
 		if verbose:
 			print("payload to write: %s" % self.arrayToHex(payload))
 		# write the frame
@@ -1782,13 +2081,83 @@ class WSTCan:
 			if verbose:
 				print("Response: %s" % self.arrayToHex(response))
 			# print("Parameter #%i is now: %i" % (parameterNumber, data[7]))
-			parser = SpParser()
-			result = parser.read_two_bytes_big_endian_from_array([response[5], response[7]], 0, True)
-			return result
+			return self.customParameterValue(response, short_int=True)
 		else:
 			# print("No Response")
 			return False
 
+	def read_custom_parameters(self, node_id, parameter_numbers, short_int=False, timeout=0.5, max_in_flight=4,
+														 request_spacing=0.005):
+		"""
+		Read several custom parameters from one node without the fixed sleep per parameter.
+		:arguments
+			parameter_numbers: list of parameter numbers
+			short_int: read them as short int (0x04 0x20) parameters instead of single bytes
+			timeout: seconds to wait for the reply of each parameter
+			max_in_flight: number of requests sent before waiting for their replies
+			request_spacing: pause between two requests
+		:returns
+			dict of parameter number: value, False for parameters that did not answer in time
+		"""
+		requests = []
+		for parameter_number in parameter_numbers:
+			requests.append((parameter_number, self.customParameterReadPayload(node_id, parameter_number, short_int)))
+		return self.customParameterRequests(node_id, requests, short_int, timeout, max_in_flight, request_spacing)
+
+	def write_custom_parameters(self, node_id, parameter_values, short_int=False, timeout=0.5, max_in_flight=4,
+															request_spacing=0.005):
+		"""
+		Write several custom parameters to one node. Same arguments as read_custom_parameters.
+		:arguments
+			parameter_values: dict of parameter number: value
+		:returns
+			dict of parameter number: value reported back by the BMS, False for parameters that did not answer in time
+		"""
+		requests = []
+		for parameter_number, value in parameter_values.items():
+			if short_int and not 0 <= value <= 65535:
+				raise Exception("Cannot write a value not within 0<=VALUE<=65535")
+			requests.append(
+				(parameter_number, self.customParameterWritePayload(node_id, parameter_number, value, short_int)))
+		return self.customParameterRequests(node_id, requests, short_int, timeout, max_in_flight, request_spacing)
+
+	# Streams the parameter requests and pairs the replies with them. Only a parameter reply (0xBD) from node_id for
+	# one of the outstanding parameter numbers (byte 3) is accepted. Everything else on the receive id is dropped, like
+	# late replies to parameters that already timed out, status and serial replies and replies from other nodes.
+	def customParameterRequests(self, node_id, requests, short_int, timeout, max_in_flight, request_spacing):
+		node_id = int(node_id)
+		self.initializePCAN()
+		self.emptyQueue(can_ids=[self.protocol_2_ids[1]])
+		try:
+			results = {}
+			to_send = list(requests)
+			pending = {}  # parameter number: deadline
+			while to_send or pending:
+				while to_send and len(pending) < max_in_flight:
+					parameter_number, payload = to_send.pop(0)
+					self.writeCANFrame(self.protocol_2_ids[0], payload)
+					pending[parameter_number] = time.monotonic() + timeout
+					if to_send and len(pending) < max_in_flight:
+						time.sleep(request_spacing)
+				now = time.monotonic()
+				for parameter_number, deadline in list(pending.items()):
+					if deadline <= now:
+						results[parameter_number] = False
+						del pending[parameter_number]
+				if not pending:
+					continue
+				response = self.readP2Frame(min(pending.values()) - now)
+				if response is None or response[0] != 0xBD or response[1] != node_id or response[3] not in pending:
+					continue
+				results[response[3]] = self.customParameterValue(response, short_int)
+				del pending[response[3]]
+		finally:
+			self.uninitializePCAN()
+		ordered_results = {}
+		for parameter_number, payload in requests:
+			ordered_results[parameter_number] = results[parameter_number]
+		return ordered_results
+
 	def get_parsed_sp_status(self, status_type="realtime"):
 		_sp_parser = SpParser()
 
@@ -1832,6 +2201,27 @@ class WSTCan:
 
 		return status_data
 
+	def start_telemetry(self, rate=5.0, capacity=3600, node_id=None, parse=True):
+		"""
+		Sample the battery continuously in the background. See TelemetryPoller.
+		:arguments
+			rate: samples per second
+			capacity: number of samples kept in the ring buffer
+			node_id: protocol 2 node id to read the status of. None samples the SP voltage, current and power status
+			parse: store the parsed values. False stores the raw responses
+		:returns
+			the running TelemetryPoller. Use latest() and history() on it.
+		"""
+		self.stop_telemetry()
+		self.telemetry_poller = TelemetryPoller(self, rate=rate, capacity=capacity, node_id=node_id, parse=parse)
+		self.telemetry_poller.start()
+		return self.telemetry_poller
+
+	def stop_telemetry(self):
+		if self.telemetry_poller is not None:
+			self.telemetry_poller.stop()
+
+	@_identity_cached
 	def get_all_sp_status(self, skip=[]):
 		# parse the status data and save in all status
 		all_status = {}
@@ -1842,6 +2232,7 @@ class WSTCan:
 		all_status['parsed_parameters'] = self.get_parsed_sp_status(status_type="parameters")
 		return all_status
 
+	@_identity_cached
 	def get_battery_description(self):
 		_sp_parser = SpParser()
 		firmware_version = self.getFirmwareVersion()
@@ -0,0 +1,97 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from pcanbasic.PCANBasic import PCAN_ERROR_OK, PCAN_NONEBUS, PCAN_ATTACHED_CHANNELS, PCAN_CHANNEL_AVAILABLE, PCAN_USB
+from wstcan.WSTCan import WSTCan, PCANHANDLE
+
+
+# Runs one WSTCan per PCAN channel, each in its own worker thread, so several adapters (and the batteries on them) are
+# driven at the same time from one process. Calls for the same channel are done in order, one at a time.
+# The PCAN-Basic calls release the GIL, so threads are enough here. Results are keyed by the channel handle number
+# (eg. 0x51 for PCAN_USBBUS1), as the ctypes channel handles can't be used as dict keys.
+#
+# 	with WSTCanPool([PCAN_USBBUS1, PCAN_USBBUS2]) as pool:
+# 		serials = pool.run_all(lambda wstcan: wstcan.getSerial())
+class WSTCanPool:
+	# transport is shared by the WSTCan of every channel, eg. one SimulatedBus. Defaults to the PCAN-Basic driver.
+	def __init__(self, channels=None, baudrate=250, debugging=False, session=True, start_receiver=False, transport=None):
+		if channels is None:
+			channels = [PCANHANDLE]
+		self.channels = list(channels)
+		self.session = session  # keep every channel open in a WSTCan session while the pool is open
+		self.start_receiver = start_receiver
+		self.wstcans = {}
+		self.executors = {}
+		for channel in self.channels:
+			key = channel_key(channel)
+			self.wstcans[key] = WSTCan(debugging=debugging, baudrate=baudrate, channel=channel, transport=transport)
+			self.executors[key] = ThreadPoolExecutor(max_workers=1, thread_name_prefix="WSTCan-0x%X" % key)
+		self.is_open = False
+
+	def open(self):
+		if self.session and not self.is_open:
+			for future in [self.submit(channel, WSTCan.open_session, start_receiver=self.start_receiver)
+										 for channel in self.channels]:
+				future.result()
+		self.is_open = True
+		return self
+
+	def close(self):
+		if self.session and self.is_open:
+			for future in [self.submit(channel, WSTCan.close_session) for channel in self.channels]:
+				future.result()
+		self.is_open = False
+
+	def shutdown(self):
+		self.close()
+		for executor in self.executors.values():
+			executor.shutdown(wait=True)
+
+	def __enter__(self):
+		return self.open()
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.shutdown()
+		return False
+
+	def submit(self, channel, function, *args, **kwargs):
+		"""
+		Run function(wstcan, *args, **kwargs) on the worker thread of a channel.
+		:returns
+			a concurrent.futures.Future with the result
+		"""
+		key = channel_key(channel)
+		return self.executors[key].submit(function, self.wstcans[key], *args, **kwargs)
+
+	def run_all(self, function, *args, **kwargs):
+		"""
+		Run function(wstcan, *args, **kwargs) on all channels in parallel and wait for all of them.
+		:returns
+			dict of channel handle number: result. If the call failed on a channel, the result is the exception, so one
+			failing battery does not hide the results of the others.
+		"""
+		futures = {}
+		for channel in self.channels:
+			futures[channel_key(channel)] = self.submit(channel, function, *args, **kwargs)
+		results = {}
+		for channel, future in futures.items():
+			try:
+				results[channel] = future.result()
+			except Exception as e:
+				results[channel] = e
+		return results
+
+
+def channel_key(channel):
+	return getattr(channel, "value", channel)
+
+
+# The USB channels the PCAN driver reports as plugged in and not used by another application.
+def attached_usb_channels(pcan):
+	result = pcan.GetValue(PCAN_NONEBUS, PCAN_ATTACHED_CHANNELS)
+	if result[0] != PCAN_ERROR_OK:
+		return []
+	channels = []
+	for channel_info in result[1]:
+		if channel_info.device_type == PCAN_USB.value and channel_info.channel_condition & PCAN_CHANNEL_AVAILABLE:
+			channels.append(channel_info.channel_handle)
+	return channels
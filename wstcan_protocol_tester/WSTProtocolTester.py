@@ -1,7 +1,9 @@
+import asyncio
 import time
 from random import choice
 
 from spparser.SpParser import SpParser
+from wstcan.AsyncWSTCan import AsyncWSTCan
 from wstcan.WSTCan import WSTCan
 
 
@@ -18,8 +20,9 @@ class TestException(Exception):
 
 
 class WSTProtocolTester:
-	def __init__(self, baudrate=250, init_battery=True):
-		self.wstcom = WSTCan(debugging=False, baudrate=baudrate)
+	# transport replaces the PCAN driver, eg. a SimulatedBus to run the tests without a battery.
+	def __init__(self, baudrate=250, init_battery=True, transport=None):
+		self.wstcom = WSTCan(debugging=False, baudrate=baudrate, transport=transport)
 		self.wstcom.initializePCAN()
 		self.test_results = {}
 
@@ -40,6 +43,8 @@ class WSTProtocolTester:
 			tests_to_run = [
 				"test_custom_parameter_single_byte",
 				"test_custom_parameter_short_int",
+				"test_custom_parameter_bulk_late_replies",
+				"test_async_custom_parameter_late_reply",
 				"test_change_baudrates",
 				"test_cp8_cell_diff",
 				"test_can_charge_protocol",
@@ -207,6 +212,82 @@ class WSTProtocolTester:
 			raise TestException(_("A custom parameter test in 1-8 failed See messages above [FAIL]"))
 		return True  # test was a success
 
+	# Bulk reads with a timeout shorter than the reply time. Replies that come in after their parameter timed out must
+	# be dropped, not stored as the value of another parameter.
+	def test_custom_parameter_bulk_late_replies(self) -> bool:
+		parameter_numbers = list(range(9, 17))
+		self.wstcom.initializePCAN()
+		expected_values = self.wstcom.read_custom_parameters(2, parameter_numbers, short_int=True, timeout=1,
+																												max_in_flight=1)
+		if False in expected_values.values():
+			raise TestException(_("Could not read custom parameters 9-16 [FAIL]"))
+		test_failed = False
+		for attempt in range(3):
+			values = self.wstcom.read_custom_parameters(2, parameter_numbers, short_int=True, timeout=0.02, max_in_flight=2)
+			for parameter_number, value in values.items():
+				if value is not False and value != expected_values[parameter_number]:
+					test_failed = True
+					print(_("Parameter %s is %s, but %s was expected [FAIL]" % (
+						parameter_number, value, expected_values[parameter_number])))
+			time.sleep(0.5)  # let the late replies of this attempt arrive before the next
+		self.wstcom.emptyQueue()
+		if test_failed:
+			raise TestException(_("Late custom parameter replies were credited to other parameters [FAIL]"))
+		print(_("Late custom parameter replies were dropped [OK]"))
+		return True
+
+	# AsyncWSTCan reads with a timeout shorter than the reply time, each followed by a read of the next parameter. The
+	# late reply to the first read must not be taken as the reply to the second.
+	def test_async_custom_parameter_late_reply(self) -> bool:
+		async def read_pairs():
+			async with AsyncWSTCan(self.wstcom) as bms:
+				expected_values = {}
+				for parameter_number in range(9, 17):
+					expected_values[parameter_number] = await bms.read_custom_parameter_short_int(2, parameter_number, 1)
+				if False in expected_values.values():
+					raise TestException(_("Could not read custom parameters 9-16 [FAIL]"))
+				wrong_values = []
+				for parameter_number in range(9, 16):
+					await bms.read_custom_parameter_short_int(2, parameter_number, 0.02)
+					value = await bms.read_custom_parameter_short_int(2, parameter_number + 1, 1)
+					if value != expected_values[parameter_number + 1]:
+						wrong_values.append((parameter_number + 1, value, expected_values[parameter_number + 1]))
+				return wrong_values
+
+		wrong_values = asyncio.run(read_pairs())
+		for parameter_number, value, expected_value in wrong_values:
+			print(_("Parameter %s is %s, but %s was expected [FAIL]" % (parameter_number, value, expected_value)))
+		if wrong_values:
+			raise TestException(_("A late custom parameter reply was taken as the reply to the next request [FAIL]"))
+		print(_("Late async custom parameter replies were dropped [OK]"))
+		return True
+
+	# Writes the serial number the battery already has and queries the voltage status right after. The tail of a late
+	# answer to the write must be thrown away, not read as part of the voltage status. Runs in a session with the
+	# background receiver, which wakes on the first frame of the answer. Not in "all", as it writes to the battery.
+	def test_sp_write_reply_drained(self) -> bool:
+		expected_status = self.wstcom.getVoltageStatus()
+		serial = self.wstcom.getSerial("hex")
+		if not expected_status or not serial:
+			raise TestException(_("Could not read the voltage status and serial number [FAIL]"))
+		test_failed = False
+		self.wstcom.open_session(start_receiver=True)
+		try:
+			for attempt in range(3):
+				self.wstcom.writeSerialNumber(int(serial))
+				status = self.wstcom.getVoltageStatus()
+				if not status or len(status) != len(expected_status) or status[:3] != expected_status[:3] or any(
+						abs((status[i] - expected_status[i]) * 256 + status[i + 1] - expected_status[i + 1]) > 100
+						for i in range(3, len(status) - 1, 2)):  # cell voltages (mV) should not move more than 100mV
+					test_failed = True
+					print(_("Voltage status after a serial number write is %s [FAIL]" % status))
+		finally:
+			self.wstcom.close_session()
+		if test_failed:
+			raise TestException(_("The answer to an SP write was read as part of the next query [FAIL]"))
+		print(_("SP write answers were thrown away [OK]"))
+		return True
+
 	def test_change_baudrates(self) -> bool:
 		test_success = True
 		baudrates_to_test = [125, 250, 500, 1000]